@@ -0,0 +1,282 @@
+"""
+Offline API benchmarks against the local stand-in server.
+
+Runs every scenario with every installed HTTP backend against
+`fakeserver.py`, started in a separate process so that its work does not
+count against the client's time and memory:
+
+- `list`: `Manager.list` of the surveys,
+- `get`: `Manager.get` of a survey,
+- `get_many`: `Manager.get_many` of every survey, on one thread with
+  pycurl's multi interface and over a thread pool otherwise,
+- `create`: `Manager.create` of a survey,
+- `structure`: `Survey.structure` of a survey not fetched before,
+- `export`: `Survey.export_responses` of every page of responses.
+
+Each scenario reports its throughput, latency percentiles, the CPU time
+the client used and, on Python
+3, the peak memory traced while running it again under tracemalloc. The
+results are written as JSON; `--compare` checks them against an earlier
+run and exits with status 1 when a scenario got slower or hungrier than
+`--tolerance` allows.
+
+    python benchmarks/api_suite.py --output results.json
+    python benchmarks/api_suite.py --compare results.json
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+sys.path.insert(0, HERE)
+
+import fakeserver
+from fluidsurveys import AccessInfo, http_client
+from fluidsurveys.resources import Survey
+
+BACKENDS = ('requests', 'pycurl', 'urllib2')
+
+SCENARIOS = ('list', 'get', 'get_many', 'create', 'structure', 'export')
+
+# CPU time of this process.
+cpu_time = getattr(time, 'process_time', None) or time.clock
+
+
+def percentile(values, q):
+    """ The `q` percentile of sorted `values`, linearly interpolated. """
+    if not values:
+        return None
+    position = (len(values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+class Scenarios(object):
+    """ One operation per scenario, on a client using a given backend. """
+
+    def __init__(self, backend, surveys, tmp):
+        self.client = http_client.Client()
+        self.client.httpclient = backend(verify_ssl_certs=False)
+        self.manager = Survey.get_manager(client=self.client)
+        self.surveys = surveys
+        self.tmp = tmp
+        self.calls = 0
+
+    def close(self):
+        self.client.close()
+
+    def _next_id(self):
+        self.calls += 1
+        return self.calls % self.surveys + 1
+
+    def list(self):
+        self.manager.list()
+
+    def get(self):
+        self.manager.get(self._next_id())
+
+    def get_many(self):
+        self.manager.get_many(range(1, self.surveys + 1))
+
+    def create(self):
+        self.manager.create(json.dumps({'name': 'Benchmark survey',
+                                        'language': 'en'}))
+
+    def structure(self):
+        survey = Survey({'id': self._next_id()}, manager=self.manager)
+        survey.structure
+
+    def export(self):
+        survey = Survey({'id': self._next_id()}, manager=self.manager)
+        survey.export_responses(os.path.join(self.tmp, 'export.col'),
+                                format='columnar')
+
+
+def run_scenario(scenarios, name, ops, memory=True):
+    operation = getattr(scenarios, name)
+    # One warm-up call opens the connections and fills the server's caches.
+    operation()
+    latencies = []
+    cpu_started = cpu_time()
+    started = time.time()
+    for _ in range(ops):
+        begin = time.time()
+        operation()
+        latencies.append(time.time() - begin)
+    elapsed = time.time() - started
+    cpu = cpu_time() - cpu_started
+    latencies.sort()
+
+    result = {
+        'ops': ops,
+        'seconds': elapsed,
+        'ops_per_sec': ops / elapsed if elapsed else None,
+        'cpu_seconds': cpu,
+        'latency_ms': {
+            'mean': 1000 * sum(latencies) / len(latencies),
+            'p50': 1000 * percentile(latencies, 0.5),
+            'p90': 1000 * percentile(latencies, 0.9),
+            'p99': 1000 * percentile(latencies, 0.99),
+            'max': 1000 * latencies[-1],
+        },
+        'peak_memory_bytes': None,
+    }
+    if memory and tracemalloc is not None:
+        # Tracing slows allocations down, so memory gets a run of its own.
+        gc.collect()
+        tracemalloc.start()
+        for _ in range(ops):
+            operation()
+        result['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+def start_server(args):
+    command = [sys.executable, os.path.join(HERE, 'fakeserver.py')]
+    for key, value in sorted(fakeserver.server_options(args).items()):
+        command += ['--' + key.replace('_', '-'), str(value)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    api_base = process.stdout.readline().decode('ascii').strip()
+    if not api_base:
+        process.wait()
+        raise RuntimeError('The benchmark server did not start')
+    return process, api_base
+
+
+def run(args):
+    process, api_base = start_server(args)
+    AccessInfo(api_base=api_base, username='benchmark', api_key='benchmark')
+    tmp = tempfile.mkdtemp()
+    ops = dict((name, args.ops) for name in SCENARIOS)
+    ops['export'] = args.export_ops
+    ops['get_many'] = args.get_many_ops
+    results = []
+    try:
+        for backend in BACKENDS:
+            if args.backends and backend not in args.backends:
+                continue
+            impl = http_client.load_backend(backend)
+            if impl is None:
+                sys.stderr.write('skipping %s: not installed\n' % backend)
+                continue
+            scenarios = Scenarios(impl, args.surveys, tmp)
+            try:
+                for name in SCENARIOS:
+                    if args.scenarios and name not in args.scenarios:
+                        continue
+                    result = run_scenario(scenarios, name, ops[name],
+                                          memory=not args.no_memory)
+                    result.update(backend=backend, scenario=name)
+                    results.append(result)
+                    sys.stderr.write('%-8s %-9s %8.1f ops/s  p50 %7.2f ms  '
+                                     'p99 %7.2f ms  cpu %6.3f s\n' % (
+                                         backend, name, result['ops_per_sec'],
+                                         result['latency_ms']['p50'],
+                                         result['latency_ms']['p99'],
+                                         result['cpu_seconds']))
+            finally:
+                scenarios.close()
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(tmp)
+
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'config': dict(fakeserver.server_options(args), ops=args.ops,
+                           export_ops=args.export_ops,
+                           get_many_ops=args.get_many_ops),
+        },
+        'results': results,
+    }
+
+
+def compare(baseline, current, tolerance):
+    """ The regressions of `current` against `baseline`, as messages. """
+    previous = dict(((r['backend'], r['scenario']), r)
+                    for r in baseline['results'])
+    regressions = []
+    for result in current['results']:
+        key = (result['backend'], result['scenario'])
+        before = previous.get(key)
+        if before is None:
+            continue
+        checks = (
+            ('throughput', before['ops_per_sec'], result['ops_per_sec'], -1),
+            ('p99 latency', before['latency_ms']['p99'],
+             result['latency_ms']['p99'], 1),
+            ('peak memory', before['peak_memory_bytes'],
+             result['peak_memory_bytes'], 1),
+            ('cpu time', before.get('cpu_seconds'),
+             result['cpu_seconds'], 1),
+        )
+        for label, old, new, direction in checks:
+            if not old or new is None:
+                continue
+            change = (new - old) / float(old)
+            if change * direction > tolerance:
+                regressions.append('%s %s: %s %.3g -> %.3g (%+.0f%%)' % (
+                    key[0], key[1], label, old, new, 100 * change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    fakeserver.add_arguments(parser)
+    parser.add_argument('--backends', nargs='*',
+                        choices=BACKENDS)
+    parser.add_argument('--scenarios', nargs='*', choices=SCENARIOS)
+    parser.add_argument('--ops', type=int, default=200,
+                        help='operations per scenario')
+    parser.add_argument('--export-ops', type=int, default=3,
+                        help='operations of the export scenario')
+    parser.add_argument('--get-many-ops', type=int, default=20,
+                        help='operations of the get_many scenario')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip the peak memory runs')
+    parser.add_argument('--output', help='write the results to this file')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='results of an earlier run to check against')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative change before a regression')
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        sys.stdout.write(text + '\n')
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.tolerance)
+        for message in regressions:
+            sys.stderr.write('REGRESSION %s\n' % message)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""
+Throughput of decoding responses, compiled decoder versus walking the
+structure for every record.
+
+Decodes the responses the stand-in server generates for one survey, with
+`decoder.ResponseDecoder` and with a naive decoder that looks every
+question of the structure up again for each record, and reports records
+per second of both.
+
+    python benchmarks/decode.py [--questions 30] [--responses 20000]
+"""
+import argparse
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+sys.path.insert(0, HERE)
+
+import fakeserver
+from fluidsurveys.decoder import ResponseDecoder
+from fluidsurveys.export import (MULTI_CHOICE_TYPES, NUMERIC_TYPES, _choices,
+                                 _question_type, _selected, iter_questions)
+
+
+def naive_decode(structure, record):
+    decoded = {'id': record.get('id')}
+    for question in iter_questions(structure):
+        value = record.get(question['id'])
+        qtype = _question_type(question)
+        choices = _choices(question)
+        if qtype in NUMERIC_TYPES:
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                value = None
+        elif choices:
+            labels = dict((raw, label) for label, raws in choices
+                          for raw in raws)
+            if qtype in MULTI_CHOICE_TYPES:
+                value = tuple(labels.get(v, v) for v in _selected(value))
+            else:
+                value = labels.get(value, value)
+        decoded[question['id']] = value
+    return decoded
+
+
+def best_rate(function, records, runs):
+    best = None
+    for _ in range(runs):
+        started = time.time()
+        for record in records:
+            function(record)
+        elapsed = time.time() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return len(records) / best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--questions', type=int, default=30)
+    parser.add_argument('--responses', type=int, default=20000)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    dataset = fakeserver.Dataset(questions=args.questions,
+                                 responses=args.responses)
+    structure = dataset.structure(1)
+    rand = fakeserver.random.Random('decode')
+    records = [dataset.response(rand, structure, i)
+               for i in range(1, args.responses + 1)]
+
+    started = time.time()
+    decoder = ResponseDecoder(structure)
+    compile_ms = 1000 * (time.time() - started)
+    assert decoder.decode(records[0]) == naive_decode(structure, records[0])
+
+    naive = best_rate(lambda r: naive_decode(structure, r), records,
+                      args.runs)
+    compiled = best_rate(decoder.decode, records, args.runs)
+    tuples = best_rate(decoder.decode_tuple, records, args.runs)
+    sys.stdout.write('compile      %10.2f ms\n' % compile_ms)
+    sys.stdout.write('naive        %10.0f records/s\n' % naive)
+    sys.stdout.write('decode       %10.0f records/s  %5.1fx\n' % (
+        compiled, compiled / naive))
+    sys.stdout.write('decode_tuple %10.0f records/s  %5.1fx\n' % (
+        tuples, tuples / naive))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,320 @@
+"""
+A local stand-in for the FluidSurveys API, for offline benchmarks.
+
+Serves generated surveys, survey structures and paginated response
+listings under `/api/v3/`, with a configurable number of records, page
+size and added latency per request:
+
+    GET    /api/v3/surveys/                      paginated surveys
+    POST   /api/v3/surveys/                      create a survey
+    GET    /api/v3/surveys/<id>/                 one survey
+    PUT    /api/v3/surveys/<id>/                 update it
+    DELETE /api/v3/surveys/<id>/                 delete it
+    GET    /api/v3/surveys/<id>/structure/       its questions
+    GET    /api/v3/surveys/<id>/responses/       paginated responses
+
+The data is generated from a seed, so every run serves the same bytes.
+Gzip encoded request bodies are accepted, and with `--gzip-level` replies
+are gzip encoded for clients that accept it.
+
+    python benchmarks/fakeserver.py [--port 0] [--latency 0.005] ...
+
+prints the server's api_base on its first line of output and serves until
+interrupted.
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+import zlib
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import parse_qs, urlsplit
+
+API_PREFIX = '/api/v3'
+
+_ROUTE = re.compile(r'^%s/surveys/(?:(\d+)/(?:(structure|responses)/)?)?$'
+                    % API_PREFIX)
+
+QUESTION_TYPES = ('number', 'single-choice', 'multiple-choice', 'text')
+
+
+class Dataset(object):
+    """ The generated surveys, structures and responses. """
+
+    def __init__(self, surveys=20, questions=30, responses=2000,
+                 page_size=100, seed=0):
+        self.surveys = surveys
+        self.questions = questions
+        self.responses = responses
+        self.page_size = page_size
+        self.seed = seed
+        self.created = {}
+        self.next_id = surveys + 1
+        self._pages = {}
+        self._lock = threading.Lock()
+
+    def survey(self, survey_id):
+        if survey_id in self.created:
+            return self.created[survey_id]
+        if not 1 <= survey_id <= self.surveys:
+            return None
+        return {
+            'id': survey_id,
+            'name': 'Survey %d' % survey_id,
+            'title': 'Customer satisfaction %d' % survey_id,
+            'response_count': self.responses,
+            'created_at': '2014-01-%02dT09:30:00' % (survey_id % 28 + 1),
+            'language': 'en',
+            'status': 'live',
+        }
+
+    def structure(self, survey_id):
+        rand = random.Random('%s/%s/structure' % (self.seed, survey_id))
+        children = []
+        for index in range(self.questions):
+            qtype = QUESTION_TYPES[index % len(QUESTION_TYPES)]
+            question = {
+                'id': 'q%d' % index,
+                'question_type': qtype,
+                'title': 'Question %d' % index,
+            }
+            if 'choice' in qtype:
+                question['choices'] = [
+                    {'label': 'Choice %d' % c, 'code': 'c%d' % c}
+                    for c in range(rand.randint(3, 8))]
+            children.append(question)
+        return {'pages': [{'id': 'page1', 'children': children}]}
+
+    def response(self, rand, structure, response_id):
+        record = {
+            'id': response_id,
+            '_completed': 1,
+            '_created_at': '2014-02-28T10:00:00',
+            '_updated_at': '2014-02-28T10:%02d:00' % (response_id % 60),
+            '_language': 'en',
+            '_invite': None,
+        }
+        for question in structure['pages'][0]['children']:
+            qtype = question['question_type']
+            if qtype == 'number':
+                value = rand.randint(0, 100)
+            elif qtype == 'single-choice':
+                value = rand.choice(question['choices'])['code']
+            elif qtype == 'multiple-choice':
+                value = [c['code'] for c in question['choices']
+                         if rand.random() < 0.3]
+            else:
+                value = 'Free text answer number %d' % rand.randint(0, 1000)
+            record[question['id']] = value
+        return record
+
+    def survey_page(self, base, page):
+        ids = sorted(set(range(1, self.surveys + 1)) | set(self.created))
+        return self._listing(base, page, ids, self.survey)
+
+    def response_page(self, base, survey_id, page):
+        """ One page of responses as bytes; pages are built once. """
+        key = (survey_id, page)
+        with self._lock:
+            body = self._pages.get(key)
+        if body is None:
+            structure = self.structure(survey_id)
+            rand = random.Random('%s/%s/%s' % (self.seed, survey_id, page))
+            ids = range(1, self.responses + 1)
+            body = json.dumps(self._listing(
+                base, page, ids,
+                lambda i: self.response(rand, structure, i))).encode('utf-8')
+            with self._lock:
+                self._pages[key] = body
+        return body
+
+    def _listing(self, base, page, ids, build):
+        ids = list(ids)
+        start = (page - 1) * self.page_size
+        results = [build(i) for i in ids[start:start + self.page_size]]
+        next_url = None
+        if start + self.page_size < len(ids):
+            next_url = '%s?page=%d' % (base, page + 1)
+        return {
+            'count': len(ids),
+            'next': next_url,
+            'previous': None,
+            'results': results,
+        }
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; without this the body
+    # waits on the client's delayed ACK.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def do_HEAD(self):
+        self._dispatch('HEAD')
+
+    def _dispatch(self, method):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        data = server.dataset
+        url = urlsplit(self.path)
+        page = int(parse_qs(url.query).get('page', ['1'])[0])
+        base = 'http://%s:%d%s' % (server.server_address[0],
+                                   server.server_address[1], url.path)
+        body = self._read_body()
+        match = _ROUTE.match(url.path)
+        if match is None:
+            return self._reply(404, {'detail': 'Not found.'})
+        survey_id, sub = match.groups()
+
+        if survey_id is None:
+            if method == 'POST':
+                with server.lock:
+                    created = dict(body, id=data.next_id)
+                    data.created[data.next_id] = created
+                    data.next_id += 1
+                return self._reply(201, created)
+            return self._reply(200, data.survey_page(base, page))
+
+        survey_id = int(survey_id)
+        survey = data.survey(survey_id)
+        if survey is None:
+            return self._reply(404, {'detail': 'Not found.'})
+        if sub == 'structure':
+            return self._reply(200, data.structure(survey_id))
+        if sub == 'responses':
+            return self._reply(200, raw=data.response_page(base, survey_id,
+                                                           page))
+        if method == 'PUT':
+            return self._reply(200, dict(survey, **body))
+        if method == 'DELETE':
+            return self._reply(204)
+        return self._reply(200, survey)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return {}
+        raw = self.rfile.read(length)
+        if self.headers.get('Content-Encoding') == 'gzip':
+            raw = zlib.decompress(raw, 16 + zlib.MAX_WBITS)
+        raw = raw.decode('utf-8')
+        try:
+            body = json.loads(raw)
+        except ValueError:
+            body = dict((k, v[0]) for k, v in parse_qs(raw).items())
+        return body if isinstance(body, dict) else {}
+
+    def _reply(self, status, body=None, raw=None):
+        if raw is None:
+            raw = b'' if body is None else json.dumps(body).encode('utf-8')
+        level = self.server.gzip_level
+        gzipped = raw and level and 'gzip' in (
+            self.headers.get('Accept-Encoding') or '')
+        if gzipped:
+            compressor = zlib.compressobj(level, zlib.DEFLATED,
+                                          16 + zlib.MAX_WBITS)
+            raw = compressor.compress(raw) + compressor.flush()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(raw)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(raw)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeFluidServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    # The default backlog of 5 leaves extra connections of a concurrent
+    # benchmark waiting on a SYN retransmit, about a second each.
+    request_queue_size = 128
+
+    def __init__(self, port=0, latency=0.0, gzip_level=0, **dataset):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port),
+                                           _Handler)
+        self.latency = latency
+        self.gzip_level = gzip_level
+        self.dataset = Dataset(**dataset)
+        self.lock = threading.Lock()
+
+    @property
+    def api_base(self):
+        return 'http://%s:%d%s/' % (self.server_address[0],
+                                    self.server_address[1], API_PREFIX)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def add_arguments(parser):
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to every request')
+    parser.add_argument('--surveys', type=int, default=20)
+    parser.add_argument('--questions', type=int, default=30)
+    parser.add_argument('--responses', type=int, default=2000,
+                        help='responses per survey')
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--gzip-level', type=int, default=0,
+                        help='gzip replies at this level, 0 for never')
+
+
+def server_options(args):
+    return {
+        'latency': args.latency,
+        'surveys': args.surveys,
+        'questions': args.questions,
+        'responses': args.responses,
+        'page_size': args.page_size,
+        'seed': args.seed,
+        'gzip_level': args.gzip_level,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--port', type=int, default=0)
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    server = FakeFluidServer(port=args.port, **server_options(args))
+    sys.stdout.write(server.api_base + '\n')
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+Import time of the package, as reported by `python -X importtime`.
+
+Imports each module in a fresh interpreter `--runs` times and keeps the
+fastest run, reporting the cumulative import time of the module itself and
+of the slowest modules it pulled in. The results are written as JSON;
+`--compare` checks them against an earlier run and exits with status 1
+when an import got slower than `--tolerance` allows.
+
+    python benchmarks/import_time.py [--output results.json]
+    python benchmarks/import_time.py --compare results.json
+
+Needs Python 3.7+ for -X importtime.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+MODULES = ('fluidsurveys', 'fluidsurveys.http_client',
+           'fluidsurveys.resources')
+
+
+def import_times(statement):
+    """ {imported module: cumulative microseconds} of running `statement`
+    in a fresh interpreter, leaving out what the interpreter imports at
+    startup. """
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    process = subprocess.Popen(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        stderr=subprocess.PIPE, env=env, cwd=ROOT)
+    _, err = process.communicate()
+    if process.returncode:
+        raise RuntimeError('Running %r failed:\n%s' % (
+            statement, err.decode('utf-8', 'replace')))
+    times = {}
+    for line in err.decode('utf-8', 'replace').splitlines():
+        # "import time: self [us] | cumulative | imported package"
+        if not line.startswith('import time:') or '[us]' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def measure(module, runs, top):
+    startup = set(import_times('pass'))
+    best = None
+    for _ in range(runs):
+        times = import_times('import ' + module)
+        times = dict((name, us) for name, us in times.items()
+                     if name not in startup)
+        if best is None or times[module] < best[module]:
+            best = times
+    slowest = sorted(((us, name) for name, us in best.items()
+                      if name != module), reverse=True)[:top]
+    return {
+        'module': module,
+        'cumulative_us': best[module],
+        'modules_imported': len(best),
+        'slowest': [{'module': name, 'cumulative_us': us}
+                    for us, name in slowest],
+    }
+
+
+def compare(baseline, current, tolerance):
+    previous = dict((r['module'], r) for r in baseline['results'])
+    regressions = []
+    for result in current['results']:
+        before = previous.get(result['module'])
+        if not before or not before['cumulative_us']:
+            continue
+        change = (result['cumulative_us'] - before['cumulative_us']) / float(
+            before['cumulative_us'])
+        if change > tolerance:
+            regressions.append('import %s: %d us -> %d us (%+.0f%%)' % (
+                result['module'], before['cumulative_us'],
+                result['cumulative_us'], 100 * change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('modules', nargs='*', default=list(MODULES))
+    parser.add_argument('--runs', type=int, default=5,
+                        help='fresh imports per module, the fastest counts')
+    parser.add_argument('--top', type=int, default=10,
+                        help='number of slowest imported modules to list')
+    parser.add_argument('--output', help='write the results to this file')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='results of an earlier run to check against')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative change before a regression')
+    args = parser.parse_args(argv)
+    if sys.version_info < (3, 7):
+        parser.error('-X importtime needs Python 3.7 or later')
+
+    results = []
+    for module in args.modules:
+        result = measure(module, args.runs, args.top)
+        results.append(result)
+        sys.stderr.write('%-28s %8.1f ms\n' % (
+            module, result['cumulative_us'] / 1000.0))
+    results = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'runs': args.runs,
+        },
+        'results': results,
+    }
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        sys.stdout.write(text + '\n')
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.tolerance)
+        for message in regressions:
+            sys.stderr.write('REGRESSION %s\n' % message)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""
+CPU overhead of `http_client.Client.request` per request.
+
+Sends requests through a null transport, a backend answering every request
+at once with the same canned reply, so that what is measured is only the
+client's own work: building the url and headers, encoding the body and
+decoding the reply. Reports microseconds per request of a GET of a survey,
+a GET of a listing page and a POST, with every JSON codec installed.
+
+    python benchmarks/request_overhead.py [--requests 20000]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+sys.path.insert(0, HERE)
+
+import fakeserver
+from fluidsurveys import http_client
+
+try:
+    from fluidsurveys import codec
+except ImportError:
+    codec = None
+
+
+class NullTransport(http_client.HTTPClient):
+    """ Answers every request with `reply`, without any I/O. """
+
+    name = 'null'
+
+    def __init__(self, reply):
+        http_client.HTTPClient.__init__(self)
+        self.reply = (reply, 200, {})
+
+    def request(self, method, url, headers, body=None):
+        return self.reply
+
+
+def replies():
+    dataset = fakeserver.Dataset(surveys=1, questions=30, responses=100)
+    structure = dataset.structure(1)
+    rand = fakeserver.random.Random('overhead')
+    page = dataset._listing('/api/v3/surveys/1/responses/', 1,
+                            range(1, 101),
+                            lambda i: dataset.response(rand, structure, i))
+    survey = json.dumps(dataset.survey(1)).encode('utf-8')
+    return survey, json.dumps(page).encode('utf-8')
+
+
+def per_request(client, method, url, body, requests):
+    best = None
+    for _ in range(3):
+        started = time.time()
+        for _ in range(requests):
+            client.request(method, url, body)
+        elapsed = time.time() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return 1e6 * best / requests
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--requests', type=int, default=20000)
+    args = parser.parse_args(argv)
+
+    survey, page = replies()
+    codecs = codec.available_codecs() if codec is not None else [None]
+    sys.stdout.write('%-12s %10s %10s %10s\n' % ('codec', 'get us',
+                                                  'page us', 'post us'))
+    for name in codecs:
+        options = {'coalesce': False}
+        if name is not None:
+            options['codec'] = name
+        client = http_client.Client(httpclient=NullTransport(survey),
+                                    **options)
+        get = per_request(client, 'GET', '/surveys/1', None, args.requests)
+        post = per_request(client, 'POST', '/surveys', {'name': 'x'},
+                           args.requests)
+        client.httpclient.reply = (page, 200, {})
+        listing = per_request(client, 'GET', '/surveys/1/responses', None,
+                              max(1, args.requests // 10))
+        sys.stdout.write('%-12s %10.2f %10.2f %10.2f\n' % (
+            name or 'json', get, listing, post))
+
+
+if __name__ == '__main__':
+    main()
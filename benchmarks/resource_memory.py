@@ -0,0 +1,89 @@
+"""
+Memory held by Response resources, compact layout versus the old one.
+
+The "legacy" resource reproduces how resources used to be stored: fields in
+the instance __dict__, a `_info` key list that grew with every
+`_add_details` call, and a Manager plus Client plus HTTP backend built for
+each instance.
+
+    python benchmarks/resource_memory.py [count]
+
+Needs Python 3.4+ for tracemalloc.
+"""
+import gc
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from fluidsurveys import base, http_client
+from fluidsurveys.resources import Response, ResponseManager
+
+
+class LegacyResource(object):
+
+    def __init__(self, info, **kwargs):
+        self._info = []
+        self._add_details(info)
+        self._loaded = True
+        client = http_client.Client.__new__(http_client.Client)
+        client.httpclient = http_client.HTTPClient()
+        self.manager = ResponseManager(self.__class__, client=client, **kwargs)
+
+    def _add_details(self, info):
+        for k, v in info.items():
+            setattr(self, k, v)
+            self._info.append(k)
+
+
+def record(i):
+    return {
+        'id': i,
+        '_completed': 1,
+        '_created_at': '2014-02-28T10:00:00',
+        '_updated_at': '2014-02-28T10:05:00',
+        '_language': 'en',
+        '_invite': None,
+        'q1': 'yes',
+        'q2': 4,
+        'q3': 'free text answer',
+    }
+
+
+def measure(build, count):
+    gc.collect()
+    tracemalloc.start()
+    objects = [build(i) for i in range(count)]
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objects
+    return current
+
+
+def main(count=100000):
+    manager = base.shared_manager(Response, survey=1)
+
+    def legacy(i):
+        obj = LegacyResource(record(i), survey=1)
+        # A later get() merges the same fields in again.
+        obj._add_details(record(i))
+        return obj
+
+    def compact(i):
+        obj = manager.wrap(record(i))
+        obj._add_details(record(i))
+        return obj
+
+    results = {'count': count}
+    for name, build in (('legacy', legacy), ('compact', compact)):
+        total = measure(build, count)
+        results[name] = {'bytes': total, 'bytes_per_resource': total // count}
+    results['ratio'] = round(
+        float(results['legacy']['bytes']) / results['compact']['bytes'], 2)
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
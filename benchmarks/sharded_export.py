@@ -0,0 +1,68 @@
+"""
+Scaling of the sharded export with the number of worker processes.
+
+Exports the responses of one survey of `fakeserver.py`, started in a
+separate process, once with `Survey.export_responses` and then with
+`Survey.export_sharded` for each number of processes given, and reports
+the records per second and speedup of every run.
+
+    python benchmarks/sharded_export.py [--processes 1 2 4 8] ...
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+sys.path.insert(0, HERE)
+
+import fakeserver
+from api_suite import start_server
+from fluidsurveys import AccessInfo
+from fluidsurveys.resources import Survey
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    fakeserver.add_arguments(parser)
+    parser.add_argument('--processes', type=int, nargs='+',
+                        default=[1, 2, 4])
+    parser.add_argument('--pages-per-shard', type=int, default=10)
+    parser.add_argument('--format', default='csv',
+                        choices=('csv', 'columnar'))
+    parser.set_defaults(responses=50000, surveys=1)
+    args = parser.parse_args(argv)
+
+    process, api_base = start_server(args)
+    AccessInfo(api_base=api_base, username='benchmark', api_key='benchmark')
+    tmp = tempfile.mkdtemp()
+    try:
+        survey = Survey({'id': 1}, manager=Survey.get_manager())
+        survey.structure
+        path = os.path.join(tmp, 'export')
+        # The server builds every page on its first request.
+        survey.export_responses(path, format=args.format)
+
+        started = time.time()
+        rows = survey.export_responses(path, format=args.format)
+        baseline = rows / (time.time() - started)
+        sys.stdout.write('single       %10.0f records/s\n' % baseline)
+        for processes in args.processes:
+            started = time.time()
+            stats = survey.export_sharded(
+                path, format=args.format, processes=processes,
+                pages_per_shard=args.pages_per_shard)
+            rate = stats['rows'] / (time.time() - started)
+            sys.stdout.write('%2d processes %10.0f records/s  %5.1fx\n' % (
+                processes, rate, rate / baseline))
+    finally:
+        shutil.rmtree(tmp)
+        process.terminate()
+        process.wait()
+
+
+if __name__ == '__main__':
+    main()
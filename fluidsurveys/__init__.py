@@ -3,7 +3,7 @@
 class AccessInfoClass(dict):
 
     def __call__(self, **kwargs):
-        for key, value in kwargs.iteritems():
+        for key, value in kwargs.items():
             self[key] = value
 
     def render_header(self):
@@ -0,0 +1,455 @@
+"""
+asyncio client and managers (Python 3.6+ only).
+
+`AsyncClient` speaks HTTP/1.1 over asyncio streams with a pool of keep-alive
+connections per host and caps the number of requests in flight.
+`AsyncManager` mirrors the operations of `base.Manager` as coroutines and
+builds the same resource classes, so `Survey`, `Response` and `Template`
+work with either client::
+
+    client = aio.AsyncClient(max_concurrency=20)
+    surveys = aio.manager_for(Survey, client=client)
+    survey = await surveys.get(1)
+    structure = await surveys.get_structure(survey)
+
+Operations that only run synchronously, such as `build_index` or the
+imports and exports of `ResponseManager`, raise `TypeError`.
+"""
+import asyncio
+import json
+import ssl
+import threading
+
+from fluidsurveys import AccessInfo, AccessInfoClass, base, deadline, \
+    exceptions
+from fluidsurveys.compat import urlencode, urlsplit
+from fluidsurveys.http_client import build_url
+from fluidsurveys.resources import ResponseManager, Survey
+
+
+class AsyncClient(object):
+    """ asyncio counterpart of `http_client.Client`.
+
+    With `coalesce`, a GET made while an identical one (same url and
+    credentials) is in flight awaits that one's reply instead of sending
+    its own. The shared request runs as a task of its own, so cancelling
+    one of the callers leaves it running for the others.
+
+    Like `http_client.Client`, requests use the credentials and `api_base`
+    of `access_info`, or of the global `AccessInfo` when it is None, and
+    take no longer than `timeout` seconds nor than the time left before the
+    current `deadline`. A caller awaits a shared GET no longer than its own
+    deadline, and sends the GET again when it failed on the deadline of the
+    caller that sent it.
+    """
+
+    def __init__(self, max_concurrency=10, pool_maxsize=10, timeout=80,
+                 verify_ssl_certs=True, coalesce=True, access_info=None):
+        if access_info is not None and \
+                not isinstance(access_info, AccessInfoClass):
+            access_info = AccessInfoClass(access_info)
+        self.access_info = access_info
+        self.max_concurrency = max_concurrency
+        self.pool_maxsize = pool_maxsize
+        self.timeout = timeout
+        self.coalesce = coalesce
+        self.shared = 0
+        self._verify_ssl_certs = verify_ssl_certs
+        self._loop = None
+        self._semaphore = None
+        self._idle = {}
+        self._in_flight = {}
+
+    def _bind(self):
+        # Semaphores and connections belong to one event loop. Start afresh
+        # when the client gets used from another one.
+        loop = asyncio.get_event_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._idle = {}
+            self._in_flight = {}
+
+    @property
+    def access(self):
+        if self.access_info is not None:
+            return self.access_info
+        return AccessInfo
+
+    async def request(self, method, url, body=None):
+        self._bind()
+        access = self.access
+        headers = access.render_header()
+        url_to_use = build_url(url, access['api_base'])
+        if method != 'GET' or not self.coalesce:
+            return await self._request(method, url_to_use, headers, body)
+
+        key = (url_to_use, headers.get('AUTHORIZATION'))
+        while True:
+            task = self._in_flight.get(key)
+            if task is None:
+                task = asyncio.ensure_future(
+                    self._request(method, url_to_use, headers, body))
+                self._in_flight[key] = task
+
+                def done(task):
+                    if self._in_flight.get(key) is task:
+                        del self._in_flight[key]
+                    # Nobody may be left to see the outcome.
+                    if not task.cancelled():
+                        task.exception()
+                task.add_done_callback(done)
+            else:
+                self.shared += 1
+            timeout = deadline.timeout()
+            try:
+                return await asyncio.wait_for(asyncio.shield(task), timeout)
+            except asyncio.TimeoutError:
+                raise exceptions.DeadlineExceeded('The deadline of the '
+                                                  'operation has passed')
+            except exceptions.DeadlineExceeded:
+                # The deadline of the caller that sent it, not ours.
+                deadline.check()
+                if self._in_flight.get(key) is task:
+                    del self._in_flight[key]
+
+    async def _request(self, method, url_to_use, headers, body):
+        async with self._semaphore:
+            timeout = deadline.timeout(self.timeout)
+            try:
+                resp, status_code = await asyncio.wait_for(
+                    self._fetch(method, url_to_use, headers, body), timeout)
+            except (OSError, asyncio.IncompleteReadError,
+                    asyncio.TimeoutError) as e:
+                deadline.check()
+                raise exceptions.APIConnectionError(
+                    "Unexpected error communicating with Fluid.\n\n"
+                    "(Network error: %s: %s)" % (type(e).__name__, e))
+
+        try:
+            body = json.loads(resp.decode('utf-8'))
+        except (ValueError, TypeError):
+            body = None
+
+        return body, status_code
+
+    async def close(self):
+        idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for reader, writer in connections:
+                writer.close()
+
+    async def _fetch(self, method, url, headers, body):
+        parts = urlsplit(url)
+        secure = parts.scheme == 'https'
+        key = (parts.hostname, parts.port or (443 if secure else 80), secure)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        lines = ['%s %s HTTP/1.1' % (method.upper(), path),
+                 'Host: %s' % parts.netloc,
+                 'Accept: application/json']
+        if isinstance(body, dict):
+            payload = urlencode(body).encode('utf-8')
+            lines.append('Content-Type: application/x-www-form-urlencoded')
+        elif isinstance(body, str):
+            payload = body.encode('utf-8')
+        else:
+            payload = body or b''
+        lines.append('Content-Length: %d' % len(payload))
+        lines.extend('%s: %s' % (k, v) for k, v in headers.items())
+        data = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + payload
+
+        # A pooled connection may have been closed by the server while idle,
+        # in which case the request is retried once on a fresh connection.
+        while True:
+            (reader, writer), reused = await self._acquire(key)
+            try:
+                writer.write(data)
+                await writer.drain()
+                status_code, content, keep_alive = await _read_response(
+                    reader, method.upper())
+            except (OSError, asyncio.IncompleteReadError):
+                writer.close()
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            break
+
+        if keep_alive:
+            self._release(key, reader, writer)
+        else:
+            writer.close()
+        return content, status_code
+
+    async def _acquire(self, key):
+        connections = self._idle.get(key)
+        while connections:
+            reader, writer = connections.pop()
+            if not reader.at_eof():
+                return (reader, writer), True
+            writer.close()
+
+        host, port, secure = key
+        context = None
+        if secure:
+            context = ssl.create_default_context()
+            if not self._verify_ssl_certs:
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+        connection = await asyncio.open_connection(host, port, ssl=context)
+        return connection, False
+
+    def _release(self, key, reader, writer):
+        connections = self._idle.setdefault(key, [])
+        if len(connections) < self.pool_maxsize:
+            connections.append((reader, writer))
+        else:
+            writer.close()
+
+
+async def _read_response(reader, method):
+    """ Read one response. Returns (status_code, body, keep_alive). """
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionResetError('Connection closed by server')
+    version, status = status_line.split(None, 2)[:2]
+    status_code = int(status)
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    keep_alive = (version == b'HTTP/1.1' and
+                  headers.get('connection', '').lower() != 'close')
+    if method == 'HEAD' or status_code in (204, 304) or status_code < 200:
+        content = b''
+    elif 'chunked' in headers.get('transfer-encoding', '').lower():
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if not size:
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+        # Skip trailers up to the final empty line.
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+        content = b''.join(chunks)
+    elif 'content-length' in headers:
+        content = await reader.readexactly(int(headers['content-length']))
+    else:
+        content = await reader.read()
+        keep_alive = False
+    return status_code, content, keep_alive
+
+
+_shared_client = None
+_shared_client_lock = threading.Lock()
+
+
+def get_shared_async_client():
+    """ Return the process-wide AsyncClient used when none is given. """
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is None:
+            _shared_client = AsyncClient()
+        return _shared_client
+
+
+class AsyncManager(base.Manager):
+    """ `base.Manager` whose operations are coroutines.
+
+    Resources built by an async manager keep the regular, synchronous
+    manager of their class.
+    """
+
+    def __init__(self, resource_class, client=None, **kwargs):
+        if client is None:
+            client = get_shared_async_client()
+        super(AsyncManager, self).__init__(resource_class, client=client,
+                                           **kwargs)
+
+    def wrap(self, info, obj_class=None):
+        if obj_class is None:
+            obj_class = self.resource_class
+        return obj_class(info, loaded=True, **self.kwargs)
+
+    async def list(self, obj_class=None, body=None):
+        """ List the collection """
+        url = self.build_url()
+        if body:
+            body, status_code = await self.client.request('POST', url,
+                                                          body=body)
+        else:
+            body, status_code = await self.client.request('GET', url)
+        return [self.wrap(res, obj_class) for res in body['results'] if res]
+
+    async def iter_pages(self, params=None, stream=False):
+        """ Asynchronously yield the `results` of each page of the
+        collection, following the `next` link of every page. """
+        if stream:
+            raise TypeError('AsyncClient does not stream pages')
+        url = self.build_url()
+        if params:
+            url += '?' + urlencode(params)
+        while url:
+            body, status_code = await self.client.request('GET', url)
+            if not body:
+                return
+            yield body.get('results') or []
+            url = body.get('next')
+
+    async def iter(self, obj_class=None, params=None):
+        """ Asynchronously iterate over the whole collection, following the
+        `next` link of every page. """
+        async for page in self.iter_pages(params=params):
+            for res in page:
+                if res:
+                    yield self.wrap(res, obj_class)
+
+    async def get(self, entity_id):
+        """ Get an object from the collection """
+        url = self.build_url(entity_id=entity_id)
+        content, status_code = await self.client.request('GET', url)
+        return self.wrap_found(entity_id, content, status_code)
+
+    async def get_many(self, ids, max_workers=8, ordered=True):
+        """ Get several objects concurrently, at most `max_workers` at a
+        time. Returns `(resources, errors)` as `base.Manager.get_many`. """
+        slots = asyncio.Semaphore(max_workers)
+
+        async def get(entity_id):
+            async with slots:
+                try:
+                    return entity_id, await self.get(entity_id), None
+                except Exception as e:
+                    return entity_id, None, e
+        calls = [get(entity_id) for entity_id in ids]
+        if ordered:
+            results = await asyncio.gather(*calls)
+        else:
+            results = [await call for call in asyncio.as_completed(calls)]
+
+        resources, errors = [], {}
+        for entity_id, resource, error in results:
+            if error is not None:
+                errors[entity_id] = error
+            else:
+                resources.append(resource)
+        return resources, errors
+
+    async def head(self, entity_id):
+        """ Retrieve request header for an object """
+        url = self.build_url(entity_id=entity_id)
+        content, status_code = await self.client.request('HEAD', url)
+        return status_code == 204
+
+    async def create(self, body):
+        url = self.build_url()
+        body, status_code = await self.client.request('POST', url, body=body)
+        return self.wrap(body)
+
+    async def update(self, obj, fields=None):
+        """ Update an object: PATCH only `fields` when given and the API
+        takes partial updates, PUT the whole object otherwise. """
+        url = self.build_url(entity_id=obj.id)
+        method, payload = self.update_payload(obj, fields)
+        body, status_code = await self.client.request(method, url,
+                                                      body=payload)
+        if method == 'PATCH' and status_code in base.PATCH_REFUSED:
+            self.supports_patch = False
+            method, payload = self.update_payload(obj)
+            body, status_code = await self.client.request(method, url,
+                                                          body=payload)
+        if body is not None:
+            return self.wrap(body)
+
+    async def delete(self, entity_id):
+        """ Delete an object """
+        url = self.build_url(entity_id=entity_id)
+        return await self.client.request('DELETE', url)
+
+    async def request(self, url, method, body=None):
+        content, status_code = await self.client.request(method, url,
+                                                         body=body)
+        return content
+
+    def build_index(self, *attrs):
+        raise TypeError('Async managers can not build an index')
+
+    async def find(self, **kwargs):
+        found = await self.findall(**kwargs)
+        if not found:
+            msg = "No %s matching %s." % (self.resource_class.__name__,
+                                          kwargs)
+            raise exceptions.NotFound(404, msg)
+        if len(found) > 1:
+            raise exceptions.NoUniqueMatch
+        return found[0]
+
+    async def findall(self, **kwargs):
+        """ All resources whose attributes equal `kwargs`, filtered as
+        `base.Manager.findall` does. """
+        if self.index is not None and self.index.covers(kwargs):
+            return self.index.lookup(**kwargs)
+        params = dict((k, v) for k, v in kwargs.items()
+                      if k in self.filter_fields)
+        searches = [(k, v) for k, v in kwargs.items() if k not in params]
+        found = []
+        async for obj in self.iter(params=params):
+            try:
+                if all(getattr(obj, attr) == value
+                       for attr, value in searches):
+                    found.append(obj)
+            except AttributeError:
+                continue
+        return found
+
+
+def _sync_only(name):
+    def operation(self, *args, **kwargs):
+        raise TypeError('%s runs synchronously; use a manager of a '
+                        'http_client.Client' % (name,))
+    operation.__name__ = name
+    return operation
+
+
+class AsyncResponseManager(AsyncManager, ResponseManager):
+
+    async def get_structure(self):
+        """ The structure of this survey. """
+        return await manager_for(Survey, client=self.client).get_structure(
+            Survey({'id': self.kwargs['survey']}))
+
+    sync_to = _sync_only('sync_to')
+    import_rows = _sync_only('import_rows')
+    iter_decoded = _sync_only('iter_decoded')
+    export_sharded = _sync_only('export_sharded')
+
+
+_manager_classes = {ResponseManager: AsyncResponseManager}
+
+
+def manager_for(resource_class, client=None, **kwargs):
+    """ Build an async manager for `resource_class`.
+
+    The manager class combines `AsyncManager` with the resource's own
+    manager class, so collection urls and extra operations such as
+    `SurveyManager.get_structure` carry over and become awaitable.
+    """
+    manager_class = resource_class.manager_class
+    cls = _manager_classes.get(manager_class)
+    if cls is None:
+        cls = type('Async' + manager_class.__name__,
+                   (AsyncManager, manager_class), {})
+        _manager_classes[manager_class] = cls
+    return cls(resource_class, client=client, **kwargs)
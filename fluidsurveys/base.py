@@ -1,10 +1,27 @@
 """
 Base utilities to build API operation managers and objects on top of.
 """
+import json
+import threading
+
 import six
+from six.moves import queue
 
+from fluidsurveys import deadline, exceptions
 from fluidsurveys.compat import urlencode
-from fluidsurveys.http_client import Client
+from fluidsurveys.http_client import get_shared_client
+
+
+# Replies to a PATCH meaning the API does not take partial updates.
+PATCH_REFUSED = (405, 501)
+
+
+_MUTABLE = (list, dict, set)
+
+
+def payload_size(body):
+	""" Size of a request body encoded as JSON, in bytes. """
+	return len(json.dumps(body, default=str))
 
 
 class Manager(object):
@@ -14,12 +31,22 @@ class Manager(object):
 	collection_key = None
 	key = None
 	base_url = ''
-
-	def __init__(self, resource_class, **kwargs):
+	# Attributes the API can filter the collection on through query
+	# parameters of the same name.
+	filter_fields = ()
+	# Whether updates of changed fields only go out as PATCH. Turned off
+	# for the manager when the API refuses one.
+	supports_patch = True
+	# A `metrics.PayloadStats` counting the bytes updates send.
+	payload_stats = None
+
+	def __init__(self, resource_class, client=None, **kwargs):
 		super(Manager, self).__init__()
-		self.client = Client()
+		self.client = client if client is not None else get_shared_client()
 		self.resource_class = resource_class
+		self.kwargs = kwargs
 		self.base_url = self.base_url % kwargs
+		self.index = None
 
 	def build_url(self, entity_id=None):
 		""" Build a resource url for a given resource. """
@@ -32,24 +59,115 @@ class Manager(object):
 
 		return url
 
+	def wrap(self, info, obj_class=None):
+		""" Build a loaded resource of this collection from API data. """
+		if obj_class is None or obj_class is self.resource_class:
+			return self.resource_class(info, loaded=True, manager=self)
+		return obj_class(info, loaded=True, client=self.client, **self.kwargs)
+
 	def list(self, obj_class=None, body=None):
 		""" List the collection """
 		url = self.build_url()
 		if body:
-			body, status_code = self.client.request(url, 'POST', body=body)
+			body, status_code = self.client.request('POST', url, body=body)
 		else:
 			body, status_code = self.client.request('GET', url)
 
-		if obj_class is None:
-			obj_class = self.resource_class
 		data = body['results']
-		return [obj_class(res, loaded=True) for res in data if res]
+		return [self.wrap(res, obj_class) for res in data if res]
+
+	def iter_pages(self, params=None, stream=False):
+		""" Yield the `results` of each page of the collection, following
+		the `next` link of every page until there is none.
+
+		With `stream`, each page is a `ResultsStream` decoding the records
+		as they arrive; it has to be consumed before the next page is
+		requested.
+		"""
+		url = self.build_url()
+		if params:
+			url += '?' + urlencode(params)
+		while url:
+			if stream:
+				page, status_code = self.client.stream('GET', url)
+				yield page
+				url = page.meta.get('next')
+				continue
+			body, status_code = self.client.request('GET', url)
+			if not body:
+				return
+			yield body.get('results') or []
+			url = body.get('next')
+
+	def iter(self, obj_class=None, params=None, prefetch=False, max_pages=2,
+			stream=False):
+		""" Lazily iterate over the whole collection, one resource at a time.
+
+		Only the page being consumed is held in memory. With `prefetch`, the
+		following pages are fetched by a background thread while the caller
+		works on the current one, holding at most `max_pages` of them. With
+		`stream`, not even the current page is: records are decoded and
+		yielded as they come off the connection.
+		"""
+		if stream and prefetch:
+			raise ValueError('stream and prefetch can not be combined')
+		pages = self.iter_pages(params=params, stream=stream)
+		if prefetch:
+			pages = prefetched(pages, max_pages)
+		for page in pages:
+			for res in page:
+				if res:
+					yield self.wrap(res, obj_class)
 
 	def get(self, entity_id):
 		""" Get an object from the collection """
 		url = self.build_url(entity_id=entity_id)
 		content, status_code = self.client.request('GET', url)
-		return self.resource_class(content, loaded=True)
+		return self.wrap_found(entity_id, content, status_code)
+
+	def wrap_found(self, entity_id, content, status_code):
+		""" Wrap the reply to a GET of `entity_id`. Raises `NotFound` for a
+		404 and `APIError` for any other error status. """
+		if status_code == 404:
+			msg = "No %s with id %s." % (self.resource_class.__name__, entity_id)
+			raise exceptions.NotFound(404, msg)
+		if status_code >= 400:
+			raise exceptions.APIError('Fluid answered %s to GET %s' % (
+				status_code, self.build_url(entity_id=entity_id)),
+				http_status=status_code, json_body=content)
+		return self.wrap(content)
+
+	def get_many(self, ids, max_workers=8, ordered=True):
+		""" Get several objects concurrently over a pool of threads, or on
+		this thread when the client can multiplex requests (see
+		`Client.can_send_many`).
+
+		Returns `(resources, errors)`: the fetched resources, in the order of
+		`ids` or, when `ordered` is false, in the order they arrived, and a
+		dict mapping each id that failed to its exception, `NotFound` for a
+		missing one as `get` raises.
+		"""
+		resources, errors = [], {}
+		if self.client.can_send_many():
+			ids = list(ids)
+			urls = [self.build_url(entity_id=entity_id) for entity_id in ids]
+			for entity_id, result in zip(ids,
+					self.client.request_many('GET', urls)):
+				if isinstance(result, Exception):
+					errors[entity_id] = result
+					continue
+				try:
+					resources.append(self.wrap_found(entity_id, *result))
+				except (exceptions.NotFound, exceptions.APIError) as e:
+					errors[entity_id] = e
+			return resources, errors
+		for entity_id, resource, error in threaded_map(self.get, ids,
+				max_workers=max_workers, ordered=ordered):
+			if error is not None:
+				errors[entity_id] = error
+			else:
+				resources.append(resource)
+		return resources, errors
 
 	def head(self, entity_id):
 		""" Retrieve request header for an object """
@@ -59,26 +177,70 @@ class Manager(object):
 
 	def create(self, body):
 		url = self.build_url()
-		resp, body = self.client.request('POST', url, body=body)
-		return self.resource_class(self, body)
-
-	def update(self, obj):
-		""" Update an object with PUT method """
+		body, status_code = self.client.request('POST', url, body=body)
+		self.client.invalidate(url)
+		obj = self.wrap(body)
+		if self.index is not None:
+			self.index.add(obj)
+		return obj
+
+	def update(self, obj, fields=None):
+		""" Update an object: PATCH only `fields` when given and the API
+		takes partial updates, PUT the whole object otherwise. """
 		url = self.build_url(entity_id=obj.id)
-		body, status_code = self.client.request('PUT', url, body=obj.to_dict())
-		print body
+		method, payload = self.update_payload(obj, fields)
+		body, status_code = self.client.request(method, url, body=payload)
+		if method == 'PATCH' and status_code in PATCH_REFUSED:
+			self.supports_patch = False
+			method, payload = self.update_payload(obj)
+			body, status_code = self.client.request(method, url, body=payload)
+		self.client.invalidate(self.build_url())
 		if body is not None:
-			return self.resource_class(body)
+			new = self.wrap(body)
+			if self.index is not None:
+				self.index.discard(obj.id)
+				self.index.add(new)
+			return new
+
+	def update_payload(self, obj, fields=None):
+		""" The method and body updating `obj`, counted in `payload_stats`.
+		"""
+		info = obj.to_dict()
+		method, payload = 'PUT', info
+		# A removed field can only go away by replacing the whole object.
+		if fields is not None and self.supports_patch and \
+				all(field in info for field in fields):
+			method = 'PATCH'
+			payload = dict((field, info[field]) for field in fields)
+		if self.payload_stats is not None:
+			self.payload_stats.record(method, payload_size(payload),
+				payload_size(info))
+		return method, payload
 
 	def delete(self, entity_id):
 		""" Delete an object """
 		url = self.build_url(entity_id=entity_id)
-		return self.client.request("DELETE", url)
+		result = self.client.request("DELETE", url)
+		self.client.invalidate(self.build_url())
+		if self.index is not None:
+			self.index.discard(entity_id)
+		return result
 
 	def request(self, url, method, body=None):
 		content, status_code = self.client.request(method, url, body=body)
 		return content
 
+	def filter(self, **params):
+		""" Lazily iterate over the resources the API returns for the
+		query parameters `params`. """
+		return self.iter(params=params)
+
+	def build_index(self, *attrs):
+		""" Index the whole collection on `attrs`, so that `find` and
+		`findall` lookups on those attributes no longer list it. """
+		self.index = ResourceIndex(attrs, self.iter())
+		return self.index
+
 	def find(self, **kwargs):
 		r1 = self.findall(**kwargs)
 		num = len(r1)
@@ -91,70 +253,372 @@ class Manager(object):
 		else:
 			return r1[0]
 
-	def finalall(self, **kwargs):
-		found = []
-		searches = kwargs.items()
+	def findall(self, **kwargs):
+		""" All resources whose attributes equal `kwargs`.
+
+		Uses the index when it covers every attribute. Otherwise the
+		attributes in `filter_fields` are sent to the API as query
+		parameters and the rest are checked on the returned resources.
+		"""
+		if self.index is not None and self.index.covers(kwargs):
+			return self.index.lookup(**kwargs)
+
+		params = dict((k, v) for k, v in kwargs.items()
+			if k in self.filter_fields)
+		searches = [(k, v) for k, v in kwargs.items() if k not in params]
 
-		for obj in self.list():
+		found = []
+		for obj in self.iter(params=params):
 			try:
 				if all(getattr(obj, attr) == value for (attr, value) in searches):
 					found.append(obj)
 			except AttributeError:
 				continue
 
-		return found 
+		return found
+
+
+class ResourceIndex(object):
+	""" In-memory hash index of resources over a few attributes. """
+
+	def __init__(self, attrs, resources=()):
+		self.attrs = tuple(attrs)
+		self._maps = dict((attr, {}) for attr in self.attrs)
+		# The (attr, value) keys each resource id is filed under.
+		self._keys = {}
+		for resource in resources:
+			self.add(resource)
+
+	def add(self, resource):
+		filed = self._keys.setdefault(getattr(resource, 'id', None), [])
+		for attr, values in six.iteritems(self._maps):
+			try:
+				value = getattr(resource, attr)
+				values.setdefault(value, []).append(resource)
+			except (AttributeError, TypeError):
+				# Missing or unhashable values can't be looked up.
+				continue
+			filed.append((attr, value))
+
+	def discard(self, entity_id):
+		""" Remove the resources whose id is `entity_id`. """
+		for attr, value in self._keys.pop(entity_id, ()):
+			values = self._maps[attr]
+			kept = [r for r in values.get(value, ())
+				if getattr(r, 'id', None) != entity_id]
+			if kept:
+				values[value] = kept
+			else:
+				values.pop(value, None)
+
+	def covers(self, kwargs):
+		return bool(kwargs) and all(attr in self._maps for attr in kwargs)
+
+	def lookup(self, **kwargs):
+		candidates = None
+		for attr, value in kwargs.items():
+			try:
+				matches = self._maps[attr].get(value, [])
+			except TypeError:
+				return []
+			if candidates is None or len(matches) < len(candidates):
+				candidates = matches
+		return [r for r in candidates
+			if all(getattr(r, attr, None) == value for attr, value in kwargs.items())]
+
+
+_DONE = object()
+
+
+def prefetched(iterable, max_items=2):
+	""" Consume `iterable` in a background thread, keeping at most
+	`max_items` of it buffered ahead of the caller.
+
+	Errors raised by the producer are re-raised in the caller. Closing the
+	returned generator early stops the producer. The producer runs under the
+	caller's deadline.
+	"""
+	buf = queue.Queue(maxsize=max(max_items - 1, 1))
+	stop = threading.Event()
+	operation = deadline.current()
+
+	def put(item):
+		while not stop.is_set():
+			try:
+				buf.put(item, timeout=0.1)
+				return True
+			except queue.Full:
+				continue
+		return False
+
+	def produce():
+		try:
+			with deadline.bound(operation):
+				for item in iterable:
+					if not put((item, None)):
+						return
+		except Exception as e:
+			put((_DONE, e))
+		else:
+			put((_DONE, None))
+
+	worker = threading.Thread(target=produce)
+	worker.daemon = True
+	worker.start()
+	try:
+		while True:
+			item, error = buf.get()
+			if item is _DONE:
+				if error is not None:
+					raise error
+				return
+			yield item
+	finally:
+		stop.set()
+
+
+def threaded_map(func, items, max_workers=8, ordered=True):
+	""" Call `func` on every item from a pool of `max_workers` threads.
+
+	Yields `(item, result, error)` for each item, in the order of `items`
+	or, when `ordered` is false, as soon as each call finishes. An exception
+	raised by `func` is reported as `error` instead of being raised. The
+	calls run under the caller's deadline.
+	"""
+	items = list(items)
+	tasks = queue.Queue()
+	done = queue.Queue()
+	for task in enumerate(items):
+		tasks.put(task)
+	operation = deadline.current()
+
+	def work():
+		with deadline.bound(operation):
+			while True:
+				try:
+					index, item = tasks.get_nowait()
+				except queue.Empty:
+					return
+				try:
+					done.put((index, item, func(item), None))
+				except Exception as e:
+					done.put((index, item, None, e))
+
+	for _ in range(min(max_workers, len(items))):
+		worker = threading.Thread(target=work)
+		worker.daemon = True
+		worker.start()
+
+	pending = {}
+	next_index = 0
+	for _ in range(len(items)):
+		index, item, result, error = done.get()
+		if not ordered:
+			yield item, result, error
+			continue
+		pending[index] = (item, result, error)
+		while next_index in pending:
+			yield pending.pop(next_index)
+			next_index += 1
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def shared_manager(resource_class, client=None, **kwargs):
+	""" Return the manager shared by every `resource_class` instance of
+	the same client and url kwargs (e.g. the responses of one survey). """
+	if client is None:
+		client = get_shared_client()
+	key = (resource_class, client, tuple(sorted(kwargs.items())))
+	manager = _managers.get(key)
+	if manager is None:
+		with _managers_lock:
+			manager = _managers.get(key)
+			if manager is None:
+				manager = resource_class.manager_class(
+					resource_class=resource_class, client=client, **kwargs)
+				_managers[key] = manager
+	return manager
+
+
+def forget_client(client):
+	""" Drop the shared managers of `client`, e.g. once it is closed. """
+	with _managers_lock:
+		for key in [k for k in _managers if k[1] is client]:
+			del _managers[key]
+
+
+class Layout(object):
+	""" Ordered field names shared by every resource with the same keys.
+
+	A resource only stores its values in a list; the position of each
+	field lives here, once, instead of in a dict per instance.
+	"""
+
+	__slots__ = ('keys', 'positions', 'transitions')
+
+	def __init__(self, keys):
+		self.keys = keys
+		self.positions = dict((k, i) for i, k in enumerate(keys))
+		self.transitions = {}
+
+	def extend(self, key):
+		""" The layout with `key` appended. """
+		layout = self.transitions.get(key)
+		if layout is None:
+			layout = self.transitions[key] = layout_for(self.keys + (key,))
+		return layout
+
+
+_layouts = {}
+_layouts_lock = threading.Lock()
+
+
+def layout_for(keys):
+	keys = tuple(keys)
+	layout = _layouts.get(keys)
+	if layout is None:
+		with _layouts_lock:
+			layout = _layouts.setdefault(keys, Layout(keys))
+	return layout
+
+
+EMPTY_LAYOUT = layout_for(())
+
+
+def _restore(cls, info, loaded, kwargs):
+	return cls(info, loaded=loaded, **kwargs)
 
 
 class Resource(object):
-	""" Base class for fluidsurvey resource (user, survey, embed, etc.)"""
+	""" Base class for fluidsurvey resource (user, survey, embed, etc.)
+
+	Fields are kept in a values list indexed through a shared `Layout`, and
+	the manager is shared by all resources of the same collection, so
+	subclasses should declare `__slots__` as well to stay compact.
+
+	Fields assigned since the resource was loaded are tracked, so that
+	`save` only sends those. Changes made in place, to a list or dict
+	field, are not seen: assign the field again or `mark_dirty` it.
+	"""
+
+	__slots__ = ('_layout', '_values', '_loaded', '_dirty', 'manager',
+		'__weakref__')
 
 	manager_class = None
 
-	def __init__(self, info={}, loaded=False, **kwargs):
-		self._info = []
-		self._add_details(info)
-		self._loaded= loaded
-		self.manager = self.manager_class(resource_class=self.__class__, **kwargs)
+	def __init__(self, info={}, loaded=False, manager=None, **kwargs):
+		self._layout = layout_for(info)
+		self._values = list(info.values())
+		self._loaded = loaded
+		self._dirty = None
+		if manager is None:
+			manager = shared_manager(self.__class__, **kwargs)
+		self.manager = manager
+
+	@classmethod
+	def get_manager(cls, client=None, **kwargs):
+		""" The shared manager of this resource's collection. """
+		return shared_manager(cls, client=client, **kwargs)
 
 	@classmethod
 	def retreive(cls, obj_id, **kwargs):
-		instance = cls(info={'id':obj_id})
+		instance = cls(info={'id':obj_id}, **kwargs)
 		instance.get()
 		return instance
 
 	@classmethod
-	def list(cls):
-		instance = cls()
-		return instance.manager.list()
+	def retreive_many(cls, obj_ids, max_workers=8, ordered=True, **kwargs):
+		""" Bulk counterpart of `retreive`. See `Manager.get_many`. """
+		return cls.get_manager(**kwargs).get_many(obj_ids,
+			max_workers=max_workers, ordered=ordered)
 
-	def to_dict(self):
-		return dict((key, getattr(self, key)) for key in self._info)
+	@classmethod
+	def list(cls, **kwargs):
+		return cls.get_manager(**kwargs).list()
+
+	@classmethod
+	def iter_all(cls, params=None, prefetch=False, max_pages=2, stream=False,
+			**kwargs):
+		""" Lazily iterate over every resource of the collection. See
+		`Manager.iter`. """
+		return cls.get_manager(**kwargs).iter(params=params,
+			prefetch=prefetch, max_pages=max_pages, stream=stream)
 
+	def to_dict(self):
+		return dict(zip(self._layout.keys, self._values))
 
 	def clone(self, **kwargs):
-		instance = self.__class__(info=self._info)
-		instance._add_details(**kwargs)
+		instance = self.__class__(info=self.to_dict(), loaded=self._loaded,
+			manager=self.manager)
+		instance._add_details(kwargs)
+		instance._dirty = set(self._dirty or ())
+		instance.mark_dirty(*kwargs)
 		return instance
 
 	def _add_details(self, info):
 		for (k, v) in six.iteritems(info):
-			setattr(self, k, v)
-			self._info.append(k)	
-
-	def _getattr__(self, k):
-		if not k in self.__dict__:
-			if not self.is_loaded():
-				self.get()
-				return self._getattr__(k)
+			self._set_field(k, v)
+
+	def _set_field(self, key, value):
+		position = self._layout.positions.get(key)
+		if position is None:
+			self._layout = self._layout.extend(key)
+			self._values.append(value)
+		else:
+			self._values[position] = value
+
+	def __getattr__(self, k):
+		# Only called when regular lookup fails, i.e. for API fields.
+		try:
+			layout = object.__getattribute__(self, '_layout')
+			values = object.__getattribute__(self, '_values')
+		except AttributeError:
 			raise AttributeError(k)
+		position = layout.positions.get(k)
+		if position is None:
+			raise AttributeError(k)
+		return values[position]
+
+	def __setattr__(self, k, v):
+		if hasattr(getattr(type(self), k, None), '__set__'):
+			# Slots and properties.
+			object.__setattr__(self, k, v)
+			return
+		position = self._layout.positions.get(k)
+		if position is None:
+			self._layout = self._layout.extend(k)
+			self._values.append(v)
 		else:
-			return self.__dict__[k]
+			old = self._values[position]
+			self._values[position] = v
+			# Assigning the same list or dict again marks it, for changes
+			# made in place.
+			if old == v and (old is not v or not isinstance(v, _MUTABLE)):
+				return
+		self.mark_dirty(k)
+
+	def __delattr__(self, k):
+		if hasattr(getattr(type(self), k, None), '__delete__'):
+			object.__delattr__(self, k)
+			return
+		info = self.to_dict()
+		if k not in info:
+			raise AttributeError(k)
+		del info[k]
+		self._layout = layout_for(info)
+		self._values = list(info.values())
+		self.mark_dirty(k)
+
+	def __reduce__(self):
+		return (_restore,
+			(self.__class__, self.to_dict(), self._loaded, self.manager.kwargs))
 
-	def __repre__(self):
-		repkeys = sorted(k for k in self.__dict__ if k[0] != '_' and
-			k != 'manager')
-		info = ",".join("%s=%s" % (k, getattr(self, k)) for k in repkeys)
-		return "<%s %s>" % (self.__class___.__name__, info)
+	def __repr__(self):
+		info = ",".join("%s=%s" % (k, v) for k, v in sorted(self.to_dict().items()))
+		return "<%s %s>" % (self.__class__.__name__, info)
 
 	def get(self):
 		self.set_loaded(True)
@@ -163,28 +627,63 @@ class Resource(object):
 		new = self.manager.get(entity_id=self.id)
 		if new:
 			self._add_details(new.to_dict())
-
-	def save(self):
-		new = self.manager.update(self)
-		if new:
+		self._dirty = None
+
+	def save(self, merge=True):
+		""" Send the changes to the API.
+
+		A loaded resource only sends its changed fields, and nothing at all
+		when none changed; one not loaded is sent whole. With `merge`, the
+		fields of the API's reply are copied onto the resource.
+		"""
+		fields = None
+		if self._loaded:
+			if not self._dirty:
+				if self.manager.payload_stats is not None:
+					self.manager.payload_stats.record_skipped()
+				return
+			fields = sorted(self._dirty)
+		new = self.manager.update(self, fields=fields)
+		self._dirty = None
+		if new and merge:
 			self._add_details(new.to_dict())
 
 	def delete(self):
-		return self.manager.delete(self)
+		return self.manager.delete(self.id)
 
 	def __eq__(self, other):
-		if not isinstance(self, other):
+		if not isinstance(other, Resource):
 			return NotImplemented
 		if not isinstance(other, self.__class__):
 			return False
-		if hasattr(self, 'id') and hasattr(self, 'id'):
+		if 'id' in self._layout.positions and 'id' in other._layout.positions:
 			return self.id == other.id
-		return self._info == other.__info
+		return self.to_dict() == other.to_dict()
+
+	def __ne__(self, other):
+		result = self.__eq__(other)
+		if result is NotImplemented:
+			return result
+		return not result
 
 	def is_loaded(self):
 		return self._loaded
 
-	def set_loaded(self, val):
-		self._loaded = val
+	def is_dirty(self):
+		return bool(self._dirty)
+
+	def dirty_fields(self):
+		""" The fields changed since the resource was loaded or saved. """
+		return frozenset(self._dirty or ())
 
+	def mark_dirty(self, *fields):
+		if self._dirty is None:
+			self._dirty = set(fields)
+		else:
+			self._dirty.update(fields)
+
+	def mark_clean(self):
+		self._dirty = None
 
+	def set_loaded(self, val):
+		self._loaded = val
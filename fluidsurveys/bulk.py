@@ -0,0 +1,368 @@
+"""
+Streaming bulk import of survey responses from CSV or NDJSON files.
+
+`ResponseImport` reads the rows of a file one at a time, checks and maps
+each against the survey's structure with a `RowMapper`, and creates the
+valid ones through a pool of threads that keeps at most `max_in_flight`
+requests running; reading stops while the pool is busy, so the file is
+never held in memory. Rejected rows, by the mapper or by the API, are
+appended to an NDJSON error file together with the reason. Responses are
+posted as `application/json`, encoded with the client's codec.
+
+Progress is saved to a checkpoint file every `checkpoint_every` rows: the
+number of leading rows that are done. An interrupted import started again
+with the same checkpoint skips them. Rows that completed past that point
+before the interruption are sent again.
+"""
+import csv
+import io
+import json
+import os
+import threading
+import time
+
+import six
+from six.moves import queue
+
+from fluidsurveys.export import (MULTI_CHOICE_TYPES, NUMERIC_TYPES,
+                                 _choices, _question_type, iter_questions)
+from fluidsurveys.resources import Response
+
+FORMATS = {
+    '.csv': 'csv',
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.json': 'ndjson',
+}
+
+# Columns never sent: the API assigns response ids.
+_DROPPED = frozenset(['id'])
+
+_DONE = object()
+
+
+def iter_rows(path, format=None, encoding='utf-8'):
+    """ Yield `(row number, record)` for each row of a CSV or NDJSON file,
+    rows numbered from 1. CSV records map the header to the cells of the
+    row; blank lines of NDJSON files are skipped but counted. """
+    format = format or FORMATS.get(os.path.splitext(path)[1].lower())
+    if format == 'csv':
+        return _csv_rows(path, encoding)
+    if format == 'ndjson':
+        return _ndjson_rows(path, encoding)
+    raise ValueError('Unknown import format %r for %s' % (format, path))
+
+
+def _csv_rows(path, encoding):
+    if six.PY2:
+        with open(path, 'rb') as f:
+            reader = csv.reader(f)
+            header = [c.decode(encoding) for c in next(reader)]
+            for number, row in enumerate(reader, 1):
+                row = [c.decode(encoding) for c in row]
+                record = dict(zip(header, row))
+                # Like csv.DictReader on Python 3.
+                if len(row) > len(header):
+                    record[None] = row[len(header):]
+                yield number, record
+    else:
+        with io.open(path, newline='', encoding=encoding) as f:
+            for number, record in enumerate(csv.DictReader(f), 1):
+                yield number, record
+
+
+def _ndjson_rows(path, encoding):
+    with io.open(path, encoding=encoding) as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if line:
+                try:
+                    yield number, json.loads(line)
+                except ValueError as e:
+                    yield number, _Invalid(line, 'Invalid JSON: %s' % (e,))
+
+
+class _Invalid(object):
+    """ A row that could not even be parsed. """
+
+    def __init__(self, raw, error):
+        self.raw = raw
+        self.error = error
+
+
+class RowMapper(object):
+    """ Turns file rows into response bodies for a survey structure.
+
+    Columns are matched to questions by `columns` (file column to question
+    id), then by question id, then by question title, ignoring case.
+    Columns starting with `_` (`_language`, `_created_at`, ...) are passed
+    through. Other columns are ignored, or rejected when `strict`.
+
+    Numeric answers must be numbers, choice answers one of the question's
+    choices by code or label, and multiple choice answers lists or text
+    joined with `multi_separator`. Empty cells are left unanswered.
+    """
+
+    def __init__(self, structure, columns=None, strict=False,
+                 multi_separator=';'):
+        self.strict = strict
+        self.multi_separator = multi_separator
+        self.questions = {}
+        titles = {}
+        for question in iter_questions(structure):
+            qtype = _question_type(question)
+            choices = _choices(question)
+            if qtype in NUMERIC_TYPES:
+                kind = 'numeric'
+            elif choices and qtype in MULTI_CHOICE_TYPES:
+                kind = 'multi'
+            elif choices:
+                kind = 'choice'
+            else:
+                kind = 'text'
+            # Any representation of a choice maps to the first one.
+            lookup = {}
+            for label, raws in choices:
+                for raw in raws:
+                    lookup.setdefault(six.text_type(raw), raws[0])
+            self.questions[question['id']] = (kind, lookup)
+            title = question.get('title')
+            if title:
+                titles.setdefault(six.text_type(title).lower(),
+                                  question['id'])
+        self._titles = titles
+        self._columns = dict(columns or {})
+        self._targets = {}
+
+    def target(self, column):
+        """ The question id or meta field a column feeds, or None. """
+        try:
+            return self._targets[column]
+        except KeyError:
+            pass
+        if column in self._columns:
+            target = self._columns[column]
+        elif column in self.questions or column.startswith('_'):
+            target = column
+        elif column in _DROPPED:
+            target = None
+        else:
+            target = self._titles.get(column.lower())
+            if target is None and self.strict:
+                raise ValueError('Column %r matches no question' % (column,))
+        self._targets[column] = target
+        return target
+
+    def map(self, record):
+        """ The response body for a row. Raises ValueError if the row does
+        not fit the structure. """
+        if not isinstance(record, dict):
+            raise ValueError('Expected an object, got %s' %
+                             (type(record).__name__,))
+        body = {}
+        for column, value in record.items():
+            if column is None:
+                # csv.DictReader's cells past the end of the header.
+                if any(value):
+                    raise ValueError('Row has %d extra cells' % len(value))
+                continue
+            target = self.target(column)
+            if target is None or value is None or value == '':
+                continue
+            question = self.questions.get(target)
+            if question is not None:
+                value = self._convert(target, question, value)
+            body[target] = value
+        return body
+
+    def _convert(self, qid, question, value):
+        kind, lookup = question
+        if kind == 'numeric':
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                return value
+            try:
+                number = float(value)
+            except (TypeError, ValueError):
+                raise ValueError('%s: %r is not a number' % (qid, value))
+            return int(number) if number.is_integer() else number
+        if kind == 'choice':
+            return self._choice(qid, lookup, value)
+        if kind == 'multi':
+            if isinstance(value, six.string_types):
+                value = [v.strip() for v in value.split(self.multi_separator)
+                         if v.strip()]
+            elif not isinstance(value, (list, tuple)):
+                value = [value]
+            return [self._choice(qid, lookup, v) for v in value]
+        return value
+
+    def _choice(self, qid, lookup, value):
+        try:
+            return lookup[six.text_type(value)]
+        except KeyError:
+            raise ValueError('%s: %r is not one of the choices' %
+                             (qid, value))
+
+
+class ResponseImport(object):
+
+    def __init__(self, mapper, client=None, checkpoint=None, errors=None,
+                 max_in_flight=8, checkpoint_every=1000):
+        self.mapper = mapper
+        self.client = client
+        self.checkpoint = checkpoint
+        self.errors = errors
+        self.max_in_flight = max_in_flight
+        self.checkpoint_every = checkpoint_every
+
+    def run(self, survey_id, path, format=None):
+        """ Import the rows of `path` as responses to a survey.
+
+        Returns a dict with the number of rows `imported`, `rejected`,
+        `skipped` as done by an earlier run, and the `seconds` it took.
+        """
+        started = time.time()
+        manager = Response.get_manager(client=self.client,
+                                       survey=str(survey_id))
+        url = manager.build_url()
+        client = manager.client
+        source = os.path.abspath(path)
+        done_before = self._load_checkpoint(source)
+        stats = {'imported': 0, 'rejected': 0, 'skipped': done_before}
+        progress = _Progress(done_before)
+
+        tasks = queue.Queue(maxsize=self.max_in_flight)
+        results = queue.Queue()
+
+        def work():
+            while True:
+                task = tasks.get()
+                if task is _DONE:
+                    return
+                number, record, body = task
+                try:
+                    reply, status_code = client.request('POST', url,
+                                                        json=body)
+                except Exception as e:
+                    results.put((number, record, str(e)))
+                    continue
+                if status_code >= 400:
+                    results.put((number, record, 'HTTP %s: %s' % (
+                        status_code, json.dumps(reply))))
+                else:
+                    results.put((number, None, None))
+
+        workers = [threading.Thread(target=work)
+                   for _ in range(self.max_in_flight)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        error_file = None
+        if self.errors:
+            error_file = io.open(self.errors, 'a' if done_before else 'w',
+                                 encoding='utf-8')
+        complete = False
+        try:
+            try:
+                for number, record in iter_rows(path, format):
+                    if number <= done_before:
+                        continue
+                    progress.expect(number)
+                    if isinstance(record, _Invalid):
+                        results.put((number, record.raw, record.error))
+                    else:
+                        try:
+                            body = self.mapper.map(record)
+                        except ValueError as e:
+                            results.put((number, record, str(e)))
+                        else:
+                            tasks.put((number, record, body))
+                    self._collect(results, progress, stats, error_file,
+                                  source)
+                complete = True
+            finally:
+                for _ in workers:
+                    tasks.put(_DONE)
+                for worker in workers:
+                    worker.join()
+                # Also on the way out of a failed import, so that a rerun
+                # does not send its finished rows again.
+                self._collect(results, progress, stats, error_file, source,
+                              save=True, complete=complete)
+        finally:
+            if error_file is not None:
+                error_file.close()
+            client.invalidate(url)
+        stats['seconds'] = time.time() - started
+        return stats
+
+    def _collect(self, results, progress, stats, error_file, source,
+                 save=False, complete=False):
+        """ Account for the rows finished so far, saving a checkpoint
+        every `checkpoint_every` rows. """
+        while True:
+            try:
+                number, record, error = results.get_nowait()
+            except queue.Empty:
+                break
+            if error is None:
+                stats['imported'] += 1
+            else:
+                stats['rejected'] += 1
+                if error_file is not None:
+                    line = json.dumps({'row': number, 'error': error,
+                                       'record': record})
+                    error_file.write(six.text_type(line) + u'\n')
+            progress.finish(number)
+        done = progress.done
+        if save or done - progress.saved >= self.checkpoint_every:
+            # Rejected rows must be on disk before the checkpoint skips them.
+            if error_file is not None:
+                error_file.flush()
+            self._save_checkpoint(source, done, stats, complete=complete)
+            progress.saved = done
+
+    def _load_checkpoint(self, source):
+        """ The number of rows of `source` done by an unfinished import. """
+        if not self.checkpoint or not os.path.exists(self.checkpoint):
+            return 0
+        with open(self.checkpoint) as f:
+            saved = json.load(f)
+        if saved.get('source') != source or saved.get('complete'):
+            return 0
+        return saved['rows_done']
+
+    def _save_checkpoint(self, source, rows_done, stats, complete=False):
+        if not self.checkpoint:
+            return
+        data = dict(stats, source=source, rows_done=rows_done,
+                    complete=complete)
+        tmp = self.checkpoint + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        # A crash while writing leaves the previous checkpoint whole.
+        if os.name == 'nt' and os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+        os.rename(tmp, self.checkpoint)
+
+
+class _Progress(object):
+    """ The number of leading rows done, as rows finish out of order. """
+
+    def __init__(self, done=0):
+        self.done = self.saved = self._last = done
+        self._pending = set()
+
+    def expect(self, number):
+        self._pending.add(number)
+        self._last = number
+        if len(self._pending) == 1:
+            self.done = number - 1
+
+    def finish(self, number):
+        self._pending.discard(number)
+        if self._pending:
+            self.done = min(self._pending) - 1
+        else:
+            self.done = self._last
@@ -0,0 +1,148 @@
+"""
+Response cache for GET requests.
+
+`http_client.Client` keeps parsed GET responses in a cache object so that
+repeated reads of the same survey, structure or template skip the network,
+and expired entries carrying an `ETag` or `Last-Modified` validator are
+revalidated with a conditional GET instead of being downloaded and parsed
+again. Any object with the interface of `LRUCache` can be plugged in, such
+as the on-disk `diskcache.PersistentCache`.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheEntry(object):
+    """ A cached, already decoded response body. """
+
+    __slots__ = ('body', 'size', 'etag', 'last_modified', 'expires')
+
+    def __init__(self, body, size, etag=None, last_modified=None,
+                 expires=None):
+        self.body = body
+        self.size = size
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = expires
+
+    def is_fresh(self, now=None):
+        return self.expires is None or (now or time.time()) < self.expires
+
+    def is_servable(self, window, now=None):
+        """ Whether the entry may still be served, expired, while it is
+        revalidated in the background: until `window` seconds past its
+        expiry. """
+        if window is None:
+            return False
+        return self.expires is None or (now or time.time()) < \
+            self.expires + window
+
+    def can_revalidate(self):
+        return bool(self.etag or self.last_modified)
+
+    def conditional_headers(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class LRUCache(object):
+    """ Thread-safe in-memory LRU cache with a time to live.
+
+    Entries are evicted least recently used first once there are more than
+    `max_entries` of them or their bodies add up to more than `max_bytes`
+    (the size of the raw response). Expired entries that can be revalidated
+    are kept until they are evicted.
+    """
+
+    # Seconds past expiry during which the client serves an entry while
+    # revalidating it in the background; None revalidates in the request.
+    stale_while_revalidate = None
+
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024,
+                 ttl=300):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """ Return the entry for `key`, fresh or revalidatable, or None. """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.is_fresh():
+                self.hits += 1
+            elif not entry.can_revalidate():
+                self._size -= entry.size
+                self.misses += 1
+                return None
+            self._entries[key] = entry
+            return entry
+
+    def set(self, key, body, size=0, etag=None, last_modified=None):
+        entry = CacheEntry(body, size, etag, last_modified,
+                           self._expiry())
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old.size
+            self._entries[key] = entry
+            self._size += size
+            self._evict()
+        return entry
+
+    def refresh(self, key, entry):
+        """ Mark `entry` as confirmed by the server (a 304 reply). """
+        with self._lock:
+            entry.expires = self._expiry()
+            self.revalidations += 1
+
+    def invalidate(self, prefix=None):
+        """ Drop the entries whose url starts with `prefix`, or all of them. """
+        with self._lock:
+            if prefix is None:
+                self._entries.clear()
+                self._size = 0
+                return
+            for key in [k for k in self._entries if k[0].startswith(prefix)]:
+                self._size -= self._entries.pop(key).size
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'revalidations': self.revalidations,
+                'evictions': self.evictions,
+            }
+
+    def _expiry(self):
+        if self.ttl is None:
+            return None
+        return time.time() + self.ttl
+
+    def _evict(self):
+        while self._entries and (
+                len(self._entries) > self.max_entries or
+                (self.max_bytes is not None and self._size > self.max_bytes)):
+            key, entry = self._entries.popitem(last=False)
+            self._size -= entry.size
+            self.evictions += 1
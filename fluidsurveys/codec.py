@@ -0,0 +1,124 @@
+"""
+Pluggable JSON codecs.
+
+A `Codec` decodes JSON straight from the bytes of a reply and encodes
+request bodies to bytes. `default_codec` picks the fastest library
+installed, in the order of `CODEC_ORDER`: orjson, ujson, simplejson and
+finally the standard library's `json`, which is always there. The
+`FLUIDSURVEYS_JSON` environment variable names the one to use instead.
+
+The fast libraries differ from `json` at the edges: orjson and ujson only
+keep 64 bit integers, and orjson encodes NaN and infinities as null and
+rejects them in replies.
+"""
+import json
+import os
+
+CODEC_ORDER = ('orjson', 'ujson', 'simplejson', 'json')
+
+CODEC_ENV = 'FLUIDSURVEYS_JSON'
+
+
+class Codec(object):
+    """ `decode(data)` takes bytes or text, `encode(obj)` gives bytes. """
+
+    __slots__ = ('name', 'decode', 'encode')
+
+    def __init__(self, name, decode, encode):
+        self.name = name
+        self.decode = decode
+        self.encode = encode
+
+    def __repr__(self):
+        return '<Codec %s>' % self.name
+
+
+def _text_encoder(dumps, **options):
+    def encode(obj):
+        return dumps(obj, **options).encode('utf-8')
+    return encode
+
+
+def _orjson():
+    import orjson
+    option = orjson.OPT_NON_STR_KEYS
+
+    def encode(obj):
+        return orjson.dumps(obj, option=option)
+    return Codec('orjson', orjson.loads, encode)
+
+
+def _ujson():
+    import ujson
+    return Codec('ujson', ujson.loads, _text_encoder(ujson.dumps))
+
+
+def _simplejson():
+    import simplejson
+    return Codec('simplejson', simplejson.loads,
+                 _text_encoder(simplejson.dumps, separators=(',', ':')))
+
+
+def _stdlib():
+    return Codec('json', json.loads,
+                 _text_encoder(json.dumps, separators=(',', ':')))
+
+
+_LOADERS = {
+    'orjson': _orjson,
+    'ujson': _ujson,
+    'simplejson': _simplejson,
+    'json': _stdlib,
+}
+
+_loaded = {}
+_default = None
+
+
+def load_codec(name):
+    """ The codec of library `name`, or None if it is not installed. """
+    if name not in _LOADERS:
+        raise ValueError('Unknown JSON codec %r, expected one of %s' % (
+            name, ', '.join(CODEC_ORDER)))
+    if name not in _loaded:
+        try:
+            _loaded[name] = _LOADERS[name]()
+        except ImportError:
+            _loaded[name] = None
+    return _loaded[name]
+
+
+def available_codecs():
+    """ Names of the codecs that can be used here, fastest first. """
+    return [name for name in CODEC_ORDER if load_codec(name) is not None]
+
+
+def default_codec():
+    """ The codec named by `FLUIDSURVEYS_JSON`, or else the first one of
+    `CODEC_ORDER` installed. """
+    global _default
+    if _default is None:
+        name = os.environ.get(CODEC_ENV)
+        if name:
+            codec = load_codec(name)
+            if codec is None:
+                raise ImportError('The %r JSON codec was selected but its '
+                                  'library could not be imported' % (name,))
+        else:
+            codec = next(load_codec(n) for n in CODEC_ORDER
+                         if load_codec(n) is not None)
+        _default = codec
+    return _default
+
+
+def get_codec(codec):
+    """ `codec` itself, the codec of that name, or the default one for
+    None. """
+    if codec is None:
+        return default_codec()
+    if isinstance(codec, Codec):
+        return codec
+    loaded = load_codec(codec)
+    if loaded is None:
+        raise ImportError('The %r JSON codec is not installed' % (codec,))
+    return loaded
@@ -0,0 +1,120 @@
+"""
+Deadlines of API operations.
+
+A deadline bounds the time an operation may take however many requests it
+makes. Under `within(seconds)`, every request gets at most the time left
+as its timeout, retries stop once their backoff would outlast it, and a
+request that can not be sent in time raises `exceptions.DeadlineExceeded`::
+
+    with deadline.within(0.8):
+        survey = surveys.get(1)
+        structure = survey.structure
+
+Deadlines nest, the earliest one winning. They follow the calling thread,
+and the calling asyncio task on Python 3.7+, into the threads started by
+`base.threaded_map` and `base.prefetched`.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from fluidsurveys import exceptions
+
+try:
+    import contextvars
+except ImportError:
+    contextvars = None
+
+
+class Deadline(object):
+    """ A point in time, `seconds` from when it is created. """
+
+    __slots__ = ('expires',)
+
+    def __init__(self, seconds):
+        self.expires = time.time() + seconds
+
+    def remaining(self):
+        return self.expires - time.time()
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def __repr__(self):
+        return '<Deadline in %.3fs>' % self.remaining()
+
+
+if contextvars is not None:
+    _current = contextvars.ContextVar('fluidsurveys_deadline', default=None)
+
+    def current():
+        """ The deadline the calling code runs under, or None. """
+        return _current.get()
+
+    def _enter(deadline):
+        return _current.set(deadline)
+
+    def _leave(token):
+        _current.reset(token)
+else:
+    _local = threading.local()
+
+    def current():
+        """ The deadline the calling code runs under, or None. """
+        return getattr(_local, 'deadline', None)
+
+    def _enter(deadline):
+        outer = current()
+        _local.deadline = deadline
+        return outer
+
+    def _leave(outer):
+        _local.deadline = outer
+
+
+@contextmanager
+def bound(deadline):
+    """ Run the block under `deadline` as it is, e.g. one carried over from
+    another thread, or under none with None. """
+    token = _enter(deadline)
+    try:
+        yield deadline
+    finally:
+        _leave(token)
+
+
+@contextmanager
+def within(seconds):
+    """ Run the block under a deadline `seconds` from now, or under the
+    enclosing one if that comes first. """
+    deadline = Deadline(seconds)
+    outer = current()
+    if outer is not None and outer.expires <= deadline.expires:
+        deadline = outer
+    with bound(deadline) as deadline:
+        yield deadline
+
+
+def timeout(default=None):
+    """ The timeout of a request: `default`, None for the backend's own,
+    cut to the time left before the current deadline.
+
+    Raises `exceptions.DeadlineExceeded` once the deadline has passed.
+    """
+    deadline = current()
+    if deadline is None:
+        return default
+    left = deadline.remaining()
+    if left <= 0:
+        raise exceptions.DeadlineExceeded('The deadline of the operation '
+                                          'has passed')
+    return left if default is None else min(default, left)
+
+
+def check(delay=0):
+    """ Raise `exceptions.DeadlineExceeded` if the current deadline passes
+    within `delay` seconds. """
+    deadline = current()
+    if deadline is not None and deadline.remaining() <= delay:
+        raise exceptions.DeadlineExceeded('The deadline of the operation '
+                                          'has passed')
@@ -0,0 +1,159 @@
+"""
+Typed decoding of survey responses.
+
+`ResponseDecoder` compiles a survey's structure once into a function that
+turns raw response records into typed values in a single pass, with no
+lookups in the structure per record:
+
+- numeric answers become ints or floats (None when unanswered or
+  unreadable),
+- choice answers become the choice's label,
+- multiple choice answers become a tuple of the labels selected,
+- anything else is kept as it is.
+
+Answers that match no choice are kept raw. `decoder_for` keeps the
+decoders of recently seen surveys, keyed on the survey and the version of
+its structure.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+import six
+
+from fluidsurveys.export import (MULTI_CHOICE_TYPES, NUMERIC_TYPES, _choices,
+                                 _hashable, _question_type, _selected,
+                                 iter_questions)
+
+# Structure members telling its versions apart, when the API sends one.
+VERSION_KEYS = ('version', 'updated_at', '_updated_at', 'modified')
+
+_NUMBER_TYPES = (int, float) + six.integer_types
+
+
+def _number(value):
+    if value.__class__ in _NUMBER_TYPES:
+        return value
+    if value is None or value == '':
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return int(number) if number.is_integer() else number
+
+
+def _label(labels, value):
+    try:
+        return labels.get(value, value)
+    except TypeError:
+        return value
+
+
+def _labels(labels, value):
+    return tuple(_label(labels, choice) for choice in _selected(value))
+
+
+class ResponseDecoder(object):
+    """ Decodes the responses of one survey structure.
+
+    `fields` are the keys of decoded records: `meta_fields`, copied as
+    they are, followed by the question ids. `decode` returns a dict and
+    `decode_tuple` a tuple in the order of `fields`.
+    """
+
+    def __init__(self, structure, meta_fields=('id',)):
+        self.fields = tuple(meta_fields)
+        # (field, kind, labels) of each field.
+        self.plan = [(field, 'raw', None) for field in meta_fields]
+        for question in iter_questions(structure):
+            qid = question['id']
+            if qid in self.fields:
+                continue
+            qtype = _question_type(question)
+            choices = _choices(question)
+            labels = {}
+            for label, raws in choices:
+                for raw in raws:
+                    if _hashable(raw):
+                        labels.setdefault(raw, label)
+            if qtype in NUMERIC_TYPES:
+                kind = 'number'
+            elif choices and qtype in MULTI_CHOICE_TYPES:
+                kind = 'labels'
+            elif choices:
+                kind = 'label'
+            else:
+                kind = 'raw'
+            self.fields += (qid,)
+            self.plan.append((qid, kind, labels))
+        self.decode = self._compile(tuples=False)
+        self.decode_tuple = self._compile(tuples=True)
+
+    def _compile(self, tuples):
+        """ Build a function returning the decoded record as one dict or
+        tuple display, every field written out as an expression. """
+        namespace = {'_number': _number, '_label': _label,
+                     '_labels': _labels}
+        items = []
+        for index, (field, kind, labels) in enumerate(self.plan):
+            value = 'get(%r)' % (field,)
+            if kind == 'number':
+                value = '_number(%s)' % value
+            elif kind in ('label', 'labels'):
+                name = 'labels%d' % index
+                namespace[name] = labels
+                value = '_%s(%s, %s)' % (kind, name, value)
+            items.append(value if tuples else '%r: %s' % (field, value))
+        if tuples:
+            display = '(%s)' % ''.join(item + ', ' for item in items)
+        else:
+            display = '{%s}' % ', '.join(items)
+        source = ('def decode(record):\n'
+                  '    get = record.get\n'
+                  '    return %s\n' % display)
+        exec(compile(source, '<ResponseDecoder>', 'exec'), namespace)
+        return namespace['decode']
+
+    def decode_many(self, records, tuples=False):
+        """ Decode an iterable of records lazily, skipping empty ones. """
+        decode = self.decode_tuple if tuples else self.decode
+        for record in records:
+            if record:
+                yield decode(record)
+
+
+_decoders = OrderedDict()
+_decoders_lock = threading.Lock()
+
+# Number of decoders `decoder_for` keeps.
+DECODER_CACHE_SIZE = 64
+
+
+def structure_version(structure):
+    """ What tells versions of a structure apart: its version member when
+    it has one, a digest of its contents otherwise. """
+    if isinstance(structure, dict):
+        for key in VERSION_KEYS:
+            if structure.get(key) is not None:
+                return '%s:%s' % (key, structure[key])
+    encoded = json.dumps(structure, sort_keys=True, default=str)
+    return hashlib.sha1(encoded.encode('utf-8')).hexdigest()
+
+
+def decoder_for(survey_id, structure, meta_fields=('id',)):
+    """ The decoder of a survey's `structure`, compiled once per survey,
+    structure version and meta fields. """
+    key = (str(survey_id), structure_version(structure), tuple(meta_fields))
+    with _decoders_lock:
+        decoder = _decoders.get(key)
+        if decoder is not None:
+            _decoders[key] = _decoders.pop(key)
+            return decoder
+    decoder = ResponseDecoder(structure, meta_fields)
+    with _decoders_lock:
+        _decoders[key] = decoder
+        while len(_decoders) > DECODER_CACHE_SIZE:
+            _decoders.popitem(last=False)
+    return decoder
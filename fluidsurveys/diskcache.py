@@ -0,0 +1,257 @@
+"""
+Persistent cache of survey, template and group metadata.
+
+`PersistentCache` is a response cache for `http_client.Client`, with the
+interface of `cache.LRUCache`, that keeps the listings and details of
+surveys, templates and groups and the structures of surveys in a SQLite
+database on disk. Worker processes pointed at the same file share it: a
+freshly started one reads what the others have already fetched instead of
+listing everything again, and every write is a single transaction, safe
+under the concurrent readers and writers of SQLite's WAL journal.
+
+Expired entries are still served for `stale_while_revalidate` seconds
+while the client revalidates them in the background, so a worker starting
+from an old file serves its first requests from disk too. Entries are
+tagged with a `version`: bumping it, e.g. on a deploy that changes how
+bodies are interpreted, makes the entries of other versions misses. The
+credentials entries are keyed on are stored only as a digest.
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from fluidsurveys.cache import CacheEntry
+
+# Layout of the database; files of another one are emptied on open.
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    url TEXT NOT NULL,
+    auth TEXT NOT NULL,
+    version TEXT NOT NULL,
+    body TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    expires REAL,
+    PRIMARY KEY (url, auth)
+);
+"""
+
+# Survey and template listings and details, survey structures and groups.
+METADATA_URLS = re.compile(
+    r'/(?:templates/(?:[^/?]+/)?|'
+    r'surveys/(?:[^/?]+/(?:structure/|groups/(?:[^/?]+/)?)?)?)(?:\?|$)')
+
+
+def _auth_digest(authorization):
+    if authorization is None:
+        return ''
+    return hashlib.sha256(authorization.encode('utf-8')).hexdigest()
+
+
+def _like_prefix(prefix):
+    return prefix.replace('\\', '\\\\').replace('%', '\\%') \
+        .replace('_', '\\_') + '%'
+
+
+class PersistentCache(object):
+    """ Response cache kept in the SQLite database at `path`.
+
+    Only GETs of urls matching `include`, a compiled pattern searched in
+    the url, are kept; None keeps every GET. Entries are fresh for `ttl`
+    seconds and served while being revalidated for
+    `stale_while_revalidate` more. The last `max_entries` entries used are
+    also held decoded in memory, where invalidations made by other
+    processes reach them once they expire. The file is pruned of entries
+    past their stale window on open and by `prune`.
+
+    Failing to write, such as when another process holds the database
+    locked for longer than `timeout` seconds, only costs the entry: it is
+    counted in `errors` and the cache carries on.
+    """
+
+    def __init__(self, path, ttl=300, stale_while_revalidate=86400,
+                 include=METADATA_URLS, version='1', max_entries=1024,
+                 timeout=5.0):
+        self.path = path
+        self.ttl = ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        self.include = include
+        self.version = str(version)
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._memory = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.errors = 0
+        self._open()
+        self.prune()
+
+    def _open(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, timeout=self.timeout,
+                                  check_same_thread=False,
+                                  isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        # Processes opening the file together agree on its layout.
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            version = self.db.execute('PRAGMA user_version').fetchone()[0]
+            if version != SCHEMA_VERSION:
+                self.db.execute('DROP TABLE IF EXISTS entries')
+                self.db.execute('PRAGMA user_version = %d' % SCHEMA_VERSION)
+            self.db.execute(SCHEMA)
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        self.db.execute('COMMIT')
+
+    def _connection(self):
+        # A connection is not to be used across a fork; the child opens
+        # its own.
+        if os.getpid() != self._pid:
+            self._memory = OrderedDict()
+            self._open()
+        return self.db
+
+    def close(self):
+        self.db.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._connection().execute(
+                'SELECT COUNT(*) FROM entries WHERE version = ?',
+                (self.version,)).fetchone()[0]
+
+    def caches(self, url):
+        return self.include is None or self.include.search(url) is not None
+
+    def get(self, key):
+        """ Return the entry for `key` if it is fresh, revalidatable or
+        within its stale window, or None. """
+        url, authorization = key
+        if not self.caches(url):
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._memory.pop(key, None)
+            if entry is not None and entry.is_fresh(now):
+                self._memory[key] = entry
+                self.hits += 1
+                return entry
+            # Another process may have fetched it again since.
+            entry = self._load(url, authorization) or entry
+            if entry is None or not (
+                    entry.is_fresh(now) or entry.can_revalidate() or
+                    entry.is_servable(self.stale_while_revalidate, now)):
+                self.misses += 1
+                return None
+            self._remember(key, entry)
+            self.hits += 1
+            self.disk_hits += 1
+            return entry
+
+    def set(self, key, body, size=0, etag=None, last_modified=None):
+        entry = CacheEntry(body, size, etag, last_modified, self._expiry())
+        url, authorization = key
+        if not self.caches(url):
+            return entry
+        data = json.dumps(body)
+        with self._lock:
+            self._remember(key, entry)
+            self._write(
+                'INSERT OR REPLACE INTO entries (url, auth, version, body, '
+                'size, etag, last_modified, expires) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (url, _auth_digest(authorization), self.version, data, size,
+                 etag, last_modified, entry.expires))
+        return entry
+
+    def refresh(self, key, entry):
+        """ Mark `entry` as confirmed by the server (a 304 reply). """
+        url, authorization = key
+        with self._lock:
+            entry.expires = self._expiry()
+            self.revalidations += 1
+            self._write(
+                'UPDATE entries SET expires = ? '
+                'WHERE url = ? AND auth = ? AND version = ?',
+                (entry.expires, url, _auth_digest(authorization),
+                 self.version))
+
+    def invalidate(self, prefix=None):
+        """ Drop the entries whose url starts with `prefix`, or all of
+        them, for every process sharing the file. """
+        with self._lock:
+            if prefix is None:
+                self._memory.clear()
+                self._write('DELETE FROM entries', ())
+                return
+            for key in [k for k in self._memory if k[0].startswith(prefix)]:
+                del self._memory[key]
+            self._write("DELETE FROM entries WHERE url LIKE ? ESCAPE '\\'",
+                        (_like_prefix(prefix),))
+
+    def prune(self):
+        """ Remove the entries of other versions and those past their
+        stale window that can not be revalidated. """
+        window = self.stale_while_revalidate or 0
+        with self._lock:
+            self._write(
+                'DELETE FROM entries WHERE version != ? OR (expires < ? AND '
+                'etag IS NULL AND last_modified IS NULL)',
+                (self.version, time.time() - window))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._memory),
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'revalidations': self.revalidations,
+                'errors': self.errors,
+            }
+
+    def _load(self, url, authorization):
+        try:
+            row = self._connection().execute(
+                'SELECT body, size, etag, last_modified, expires '
+                'FROM entries WHERE url = ? AND auth = ? AND version = ?',
+                (url, _auth_digest(authorization), self.version)).fetchone()
+        except sqlite3.Error:
+            self.errors += 1
+            return None
+        if row is None:
+            return None
+        data, size, etag, last_modified, expires = row
+        return CacheEntry(json.loads(data), size, etag, last_modified,
+                          expires)
+
+    def _write(self, statement, parameters):
+        try:
+            self._connection().execute(statement, parameters)
+        except sqlite3.Error:
+            self.errors += 1
+
+    def _remember(self, key, entry):
+        self._memory.pop(key, None)
+        self._memory[key] = entry
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _expiry(self):
+        if self.ttl is None:
+            return None
+        return time.time() + self.ttl
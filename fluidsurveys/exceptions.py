@@ -20,6 +20,16 @@ class UnsupportedVersion(WrapperException):
 class AuthorizationFailure(WrapperException):
 	"""Cannot authorize API client."""
 	pass
+
+class NotFound(WrapperException):
+	"""No resource matches a lookup."""
+	def __init__(self, code, message):
+		self.code = code
+		super(NotFound, self).__init__(message)
+
+class NoUniqueMatch(WrapperException):
+	"""More than one resource matches a lookup expected to be unique."""
+	pass
 	
 # Exceptions
 class FluidError(Exception):
@@ -60,3 +70,9 @@ class InvalidRequestError(FluidError):
 
 class AuthenticationError(FluidError):
 	pass
+
+
+class DeadlineExceeded(APIConnectionError):
+	""" The deadline of an operation passed before it completed, see
+	`deadline.within`. """
+	pass
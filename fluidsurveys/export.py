@@ -0,0 +1,609 @@
+"""
+Columnar export of survey responses.
+
+`ResponseTable` lays out one typed column per question of a survey's
+structure and fills them record by record:
+
+- the `id` of responses becomes an int64 column (-1 when missing),
+- numeric questions become float64 columns (NaN when unanswered),
+- other questions with choices become int32 category codes (-1 when
+  unanswered) with the choice labels kept once per column,
+- multiple choice questions become one uint8 flag column per choice,
+- anything else is kept as text.
+
+Numeric columns are arrays, NumPy arrays when NumPy is installed and
+`array.array` otherwise, allocated for the `capacity` a table is given or
+`reserve`s once the number of rows is known, and grow by doubling. The table can
+be written as CSV or in a compact binary columnar format readable with
+`read_columnar`; `merge_csv` and `merge_columnar` join the exports of
+parts of a survey's responses. `TableWriter` writes a table out a part at
+a time, so that an export of any size holds one part in memory.
+"""
+import array
+import csv
+import json
+import os
+import struct
+import sys
+
+import six
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+NUMERIC_TYPES = frozenset(['number', 'numeric', 'integer', 'decimal',
+                           'slider', 'rating', 'nps', 'scale'])
+MULTI_CHOICE_TYPES = frozenset(['multiple-choice', 'multiple_choice',
+                                'multi-choice', 'checkbox', 'checkboxes'])
+
+_TYPE_KEYS = ('question_type', 'type')
+_CHOICE_KEYS = ('label', 'title', 'text')
+_CODE_KEYS = ('code', 'value', 'id')
+
+MAGIC = b'FSCOL\x01'
+
+
+def _int64_typecode():
+    # 'q' is missing from Python 2, whose 'l' is 64 bits wide on most
+    # 64 bit platforms.
+    for typecode in ('q', 'l'):
+        try:
+            if array.array(typecode).itemsize == 8:
+                return typecode
+        except ValueError:
+            continue
+    return None
+
+
+# (numpy dtype, array typecode) of each array-backed column kind.
+_DTYPES = {
+    'integer': ('<i8', _int64_typecode()),
+    'numeric': ('<f8', 'd'),
+    'categorical': ('<i4', 'i'),
+    'flag': ('u1', 'B'),
+}
+_MISSING = {
+    'integer': -1,
+    'numeric': float('nan'),
+    'categorical': -1,
+    'flag': 0,
+}
+
+
+def iter_questions(structure):
+    """ Yield the question dicts of a survey structure, in order.
+
+    A question is any dict with an `id` and a question type, wherever it
+    sits in the nested pages/sections of the structure.
+    """
+    if isinstance(structure, dict):
+        if 'id' in structure and any(k in structure for k in _TYPE_KEYS):
+            yield structure
+            return
+        values = structure.values()
+    elif isinstance(structure, (list, tuple)):
+        values = structure
+    else:
+        return
+    for value in values:
+        for question in iter_questions(value):
+            yield question
+
+
+def _question_type(question):
+    for key in _TYPE_KEYS:
+        if key in question:
+            return str(question[key]).lower()
+    return ''
+
+
+def _choices(question):
+    """ (label, [raw representations]) of each choice of a question. """
+    choices = []
+    for index, choice in enumerate(question.get('choices') or ()):
+        if isinstance(choice, dict):
+            label = next((choice[k] for k in _CHOICE_KEYS if k in choice),
+                         None)
+            raws = [choice[k] for k in _CODE_KEYS if k in choice]
+            if label is None:
+                label = raws[0] if raws else index
+            raws.append(label)
+        else:
+            label, raws = choice, [choice]
+        choices.append((six.text_type(label), raws))
+    return choices
+
+
+def _hashable(value):
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+class Column(object):
+    """ One typed column of a `ResponseTable`. """
+
+    def __init__(self, name, kind, key, categories=None, capacity=0,
+                 convert=None, raws=None):
+        self.name = name
+        self.kind = kind
+        self.key = key
+        self.categories = categories
+        self.convert = convert
+        # The raw answers that set a flag column.
+        self.raws = raws
+        self.size = 0
+        if kind == 'text':
+            self.data = []
+        else:
+            self.data = _allocate(kind, capacity)
+
+    def reserve(self, capacity):
+        if self.kind == 'text' or capacity <= len(self.data):
+            return
+        grown = _allocate(self.kind, capacity)
+        grown[:self.size] = self.data[:self.size]
+        self.data = grown
+
+    def append(self, value):
+        if self.kind == 'text':
+            self.data.append(value)
+        else:
+            if self.size == len(self.data):
+                self.reserve(max(1024, 2 * self.size))
+            self.data[self.size] = value
+        self.size += 1
+
+    def extend(self, values):
+        if self.kind == 'text':
+            self.data.extend(values)
+        else:
+            end = self.size + len(values)
+            if end > len(self.data):
+                self.reserve(max(1024, 2 * self.size, end))
+            self.data[self.size:end] = _as_storage(self.kind, values)
+        self.size += len(values)
+
+    def clear(self):
+        """ Empty the column, keeping its capacity. """
+        if self.kind == 'text':
+            self.data = []
+        self.size = 0
+
+    @property
+    def values(self):
+        """ The filled part of the column. """
+        return self.data[:self.size]
+
+    def tobytes(self):
+        values = self.values
+        if self.kind == 'text':
+            encoded = [(v if v is not None else u'').encode('utf-8')
+                       for v in values]
+            lengths = array.array('I', [len(v) for v in encoded])
+            return _array_bytes(lengths) + b''.join(encoded)
+        if numpy is not None:
+            return numpy.ascontiguousarray(values).tobytes()
+        return _array_bytes(values)
+
+
+def _allocate(kind, capacity):
+    dtype, typecode = _DTYPES[kind]
+    if numpy is not None:
+        return numpy.full(capacity, _MISSING[kind], dtype=dtype)
+    return array.array(typecode, [_MISSING[kind]]) * capacity
+
+
+def _as_storage(kind, values):
+    if numpy is not None:
+        return values
+    return array.array(_DTYPES[kind][1], values)
+
+
+def _array_bytes(values):
+    if sys.byteorder != 'little' and values.itemsize > 1:
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    if hasattr(values, 'tobytes'):
+        return values.tobytes()
+    return values.tostring()
+
+
+def _to_float(value):
+    if value is None or value == '':
+        return float('nan')
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+def _to_int(value):
+    if value is None or value == '':
+        return -1
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return -1
+
+
+def _to_text(value):
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple, dict)):
+        return json.dumps(value)
+    return six.text_type(value)
+
+
+def _category_converter(codes):
+    def convert(value):
+        try:
+            return codes.get(value, -1)
+        except TypeError:
+            return -1
+    return convert
+
+
+def _selected(value):
+    """ The raw choices selected in a multiple choice answer. """
+    if isinstance(value, dict):
+        return [k for k, v in value.items() if v]
+    if isinstance(value, (list, tuple, set)):
+        return value
+    if value is None or value == '':
+        return ()
+    return (value,)
+
+
+class ResponseTable(object):
+    """ Responses of one survey laid out as typed columns. """
+
+    def __init__(self, columns, capacity=0):
+        self.columns = columns
+        self.size = 0
+        self._multi = {}
+        for column in columns:
+            column.reserve(capacity)
+            if column.kind == 'flag':
+                self._multi.setdefault(column.key, []).append(column)
+
+    @classmethod
+    def from_structure(cls, structure, meta_fields=('id',), capacity=0):
+        columns = []
+        for field in meta_fields:
+            if field != 'id':
+                columns.append(Column(field, 'text', field, convert=_to_text))
+            elif numpy is None and _DTYPES['integer'][1] is None:
+                # No 64 bit array type to keep the ids in.
+                columns.append(Column(field, 'numeric', field,
+                                      convert=_to_float))
+            else:
+                columns.append(Column(field, 'integer', field,
+                                      convert=_to_int))
+        for question in iter_questions(structure):
+            key = question['id']
+            qtype = _question_type(question)
+            choices = _choices(question)
+            if qtype in NUMERIC_TYPES:
+                columns.append(Column(key, 'numeric', key, convert=_to_float))
+            elif choices and qtype in MULTI_CHOICE_TYPES:
+                for label, raws in choices:
+                    columns.append(Column(
+                        '%s:%s' % (key, label), 'flag', key,
+                        raws=frozenset(r for r in raws if _hashable(r))))
+            elif choices:
+                codes = {}
+                for index, (label, raws) in enumerate(choices):
+                    for raw in raws:
+                        if _hashable(raw):
+                            codes.setdefault(raw, index)
+                columns.append(Column(key, 'categorical', key,
+                                      categories=[c[0] for c in choices],
+                                      convert=_category_converter(codes)))
+            else:
+                columns.append(Column(key, 'text', key, convert=_to_text))
+        return cls(columns, capacity)
+
+    def __len__(self):
+        return self.size
+
+    def reserve(self, capacity):
+        for column in self.columns:
+            column.reserve(capacity)
+
+    def clear(self):
+        """ Drop the rows, keeping the columns and their capacity. """
+        for column in self.columns:
+            column.clear()
+        self.size = 0
+
+    def append(self, record):
+        get = record.get
+        for column in self.columns:
+            if column.kind != 'flag':
+                column.append(column.convert(get(column.key)))
+        for key, flags in six.iteritems(self._multi):
+            selected = set(v for v in _selected(get(key)) if _hashable(v))
+            for column in flags:
+                column.append(1 if column.raws & selected else 0)
+        self.size += 1
+
+    def extend(self, records, batch_size=4096):
+        """ Append records, converting them a batch at a time. """
+        batch = []
+        for record in records:
+            if record:
+                batch.append(record)
+                if len(batch) == batch_size:
+                    self._append_batch(batch)
+                    batch = []
+        if batch:
+            self._append_batch(batch)
+
+    def _append_batch(self, records):
+        for column in self.columns:
+            if column.kind != 'flag':
+                key, convert = column.key, column.convert
+                column.extend([convert(r.get(key)) for r in records])
+        for key, flags in six.iteritems(self._multi):
+            selected = [set(v for v in _selected(r.get(key)) if _hashable(v))
+                        for r in records]
+            for column in flags:
+                raws = column.raws
+                column.extend([1 if raws & s else 0 for s in selected])
+        self.size += len(records)
+
+    def as_dict(self):
+        return dict((column.name, column.values) for column in self.columns)
+
+    def write(self, path, format='csv'):
+        if format == 'csv':
+            return self.to_csv(path)
+        if format == 'columnar':
+            return self.to_columnar(path)
+        raise ValueError('Unknown export format %r' % (format,))
+
+    def to_csv(self, path):
+        """ Write the table as CSV, with category labels and 0/1 flags. """
+        with _open_csv(path) as f:
+            writer = csv.writer(f)
+            self.write_csv_header(writer)
+            self.write_csv_rows(writer)
+
+    def write_csv_header(self, writer):
+        writer.writerow([_csv_text(c.name) for c in self.columns])
+
+    def write_csv_rows(self, writer):
+        cells = [_csv_cells(c) for c in self.columns]
+        for row in six.moves.zip(*cells):
+            writer.writerow(row)
+
+    def to_columnar(self, path):
+        """ Write the table in the binary columnar format.
+
+        Layout: `MAGIC`, the byte length of a JSON header as a little
+        endian uint32, the header, then the data of every column back to
+        back. The header lists the name, kind, dtype, number of rows, byte
+        length and categories of each column. Text columns hold the uint32
+        byte length of every value followed by the utf-8 values.
+        """
+        blobs = [c.tobytes() for c in self.columns]
+        header = {
+            'rows': self.size,
+            'columns': [{
+                'name': c.name,
+                'kind': c.kind,
+                'dtype': _DTYPES[c.kind][0] if c.kind in _DTYPES else 'text',
+                'nbytes': len(blob),
+                'categories': c.categories,
+            } for c, blob in zip(self.columns, blobs)],
+        }
+        header = json.dumps(header).encode('utf-8')
+        with open(path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<I', len(header)))
+            f.write(header)
+            for blob in blobs:
+                f.write(blob)
+
+
+class TableWriter(object):
+    """ Writes the rows of `table` to `path` as `csv` or `columnar` a part
+    at a time: every `flush` writes out the rows the table holds and
+    empties it. CSV rows are appended to `path` as they come; columnar
+    parts are written beside it and joined by `close`, which returns the
+    number of rows written. `abort` removes whatever was written. """
+
+    def __init__(self, table, path, format='csv'):
+        if format not in ('csv', 'columnar'):
+            raise ValueError('Unknown export format %r' % (format,))
+        self.table = table
+        self.path = path
+        self.format = format
+        self.rows = 0
+        self.parts = []
+        self._file = self._writer = None
+        if format == 'csv':
+            self._file = _open_csv(path)
+            self._writer = csv.writer(self._file)
+            table.write_csv_header(self._writer)
+
+    def flush(self):
+        table = self.table
+        if not len(table):
+            return
+        if self._writer is not None:
+            table.write_csv_rows(self._writer)
+        else:
+            part = '%s.part%05d' % (self.path, len(self.parts))
+            self.parts.append(part)
+            table.to_columnar(part)
+        self.rows += len(table)
+        table.clear()
+
+    def close(self):
+        try:
+            self.flush()
+            if self._file is not None:
+                self._file.close()
+            elif self.parts:
+                merge_columnar(self.parts, self.path)
+            else:
+                self.table.to_columnar(self.path)
+        except BaseException:
+            self.abort()
+            raise
+        self._remove(self.parts)
+        return self.rows
+
+    def abort(self):
+        if self._file is not None:
+            self._file.close()
+        self._remove(self.parts + [self.path])
+
+    @staticmethod
+    def _remove(paths):
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _open_csv(path):
+    if six.PY2:
+        return open(path, 'wb')
+    return open(path, 'w', newline='', encoding='utf-8')
+
+
+def _csv_text(value):
+    if six.PY2 and isinstance(value, six.text_type):
+        return value.encode('utf-8')
+    return value
+
+
+def _csv_cells(column):
+    values = column.values
+    if column.kind == 'integer':
+        return [u'%d' % v if v >= 0 else u'' for v in values]
+    if column.kind == 'numeric':
+        return [u'' if v != v else (u'%d' % v if float(v).is_integer()
+                                    else repr(float(v))) for v in values]
+    if column.kind == 'categorical':
+        labels = column.categories
+        return [_csv_text(labels[v]) if v >= 0 else u'' for v in values]
+    if column.kind == 'flag':
+        return [int(v) for v in values]
+    return [_csv_text(v) if v is not None else u'' for v in values]
+
+
+def _read_header(f, path):
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError('%s is not a columnar export' % (path,))
+    length, = struct.unpack('<I', f.read(4))
+    return json.loads(f.read(length).decode('utf-8'))
+
+
+def _copy(source, target, size, chunk_size=1 << 20):
+    while size > 0:
+        data = source.read(min(size, chunk_size))
+        if not data:
+            raise ValueError('Truncated columnar export')
+        target.write(data)
+        size -= len(data)
+
+
+def merge_csv(paths, path):
+    """ Concatenate CSV exports of the same survey into `path`, keeping
+    the header row of the first one only. """
+    with open(path, 'wb') as target:
+        for index, shard in enumerate(paths):
+            with open(shard, 'rb') as source:
+                header = source.readline()
+                if index == 0:
+                    target.write(header)
+                _copy(source, target, os.path.getsize(shard) - len(header))
+
+
+def merge_columnar(paths, path):
+    """ Concatenate columnar exports of the same survey into `path`.
+
+    Columns are copied from one file at a time, so no more than a chunk of
+    them is held in memory.
+    """
+    files = [open(shard, 'rb') for shard in paths]
+    try:
+        headers = [_read_header(f, shard) for f, shard in zip(files, paths)]
+        starts = [f.tell() for f in files]
+        merged = {'rows': sum(h['rows'] for h in headers), 'columns': []}
+        for index, meta in enumerate(headers[0]['columns']):
+            metas = [h['columns'][index] for h in headers]
+            if any(m['name'] != meta['name'] for m in metas):
+                raise ValueError('Exports of different structures')
+            merged['columns'].append(dict(
+                meta, nbytes=sum(m['nbytes'] for m in metas)))
+        encoded = json.dumps(merged).encode('utf-8')
+
+        with open(path, 'wb') as target:
+            target.write(MAGIC)
+            target.write(struct.pack('<I', len(encoded)))
+            target.write(encoded)
+            offsets = list(starts)
+            for index, meta in enumerate(merged['columns']):
+                parts = []
+                for shard, (f, header) in enumerate(zip(files, headers)):
+                    nbytes = header['columns'][index]['nbytes']
+                    # Text columns hold all their lengths before the values.
+                    split = 4 * header['rows'] if meta['kind'] == 'text' \
+                        else nbytes
+                    parts.append((f, offsets[shard], split, nbytes))
+                    offsets[shard] += nbytes
+                for f, offset, split, nbytes in parts:
+                    f.seek(offset)
+                    _copy(f, target, split)
+                for f, offset, split, nbytes in parts:
+                    f.seek(offset + split)
+                    _copy(f, target, nbytes - split)
+    finally:
+        for f in files:
+            f.close()
+
+
+def read_columnar(path):
+    """ Load a file written by `ResponseTable.to_columnar`.
+
+    Returns `(header, columns)`, `columns` mapping each column name to its
+    values: NumPy arrays or `array.array`s for numeric, categorical and
+    flag columns and lists of strings for text columns.
+    """
+    with open(path, 'rb') as f:
+        header = _read_header(f, path)
+        columns = {}
+        for meta in header['columns']:
+            blob = f.read(meta['nbytes'])
+            if meta['kind'] == 'text':
+                lengths = _load_array('I', blob[:4 * header['rows']])
+                offset, values = 4 * header['rows'], []
+                for size in lengths:
+                    values.append(blob[offset:offset + size].decode('utf-8'))
+                    offset += size
+                columns[meta['name']] = values
+            elif numpy is not None:
+                columns[meta['name']] = numpy.frombuffer(blob, meta['dtype'])
+            else:
+                columns[meta['name']] = _load_array(
+                    _DTYPES[meta['kind']][1], blob)
+    return header, columns
+
+
+def _load_array(typecode, blob):
+    values = array.array(typecode)
+    if hasattr(values, 'frombytes'):
+        values.frombytes(blob)
+    else:
+        values.fromstring(blob)
+    if sys.byteorder != 'little' and values.itemsize > 1:
+        values.byteswap()
+    return values
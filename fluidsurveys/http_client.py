@@ -1,34 +1,48 @@
-import json
 import os
 import sys
 import textwrap
+import threading
+import time
 import warnings
+import zlib
 
-from fluidsurveys import exceptions, util, compat
-from fluidsurveys import AccessInfo
+import six
+from six.moves import queue
 
-# - Requests is the preferred HTTP library
+from fluidsurveys import deadline, exceptions, util, compat
+from fluidsurveys import AccessInfo, AccessInfoClass
+from fluidsurveys.jsonstream import ResultsStream
+from fluidsurveys.ratelimit import RetryPolicy, parse_retry_after
+from fluidsurveys.codec import get_codec
+from fluidsurveys.singleflight import SingleFlight
+
+# Backend libraries, imported by `load_backend` on first use.
+requests = None
+pycurl = None
+urlfetch = None
+urllib2 = None
+
+# Name of the environment variable that picks a backend, see
+# `configure_backend`.
+BACKEND_ENV = 'FLUIDSURVEYS_HTTP_BACKEND'
+
+# Without a configured backend the first one found is used, in this order:
 # - Google App Engine has urlfetch
+# - Requests is the preferred HTTP library
 # - Use Pycurl if it's there (at least it verifies SSL certs)
 # - Fall back to urllib2 with a warning if needed
-try:
-    import urllib2
-except ImportError:
-    pass
-
-try:
-    import pycurl
-except ImportError:
-    pycurl = None
-
-try:
-    import requests
-except ImportError:
-    requests = None
-else:
+BACKEND_ORDER = ('urlfetch', 'requests', 'pycurl', 'urllib2')
+
+_backend = None
+_loaded_backends = {}
+
+
+def _import_requests():
+    global requests
+    import requests as module
     try:
         # Require version 0.8.8, but don't want to depend on distutils
-        version = requests.__version__
+        version = module.__version__
         major, minor, patch = [int(i) for i in version.split('.')]
     except Exception:
         # Probably some new-fangled version, so it should support verify
@@ -44,23 +58,93 @@ else:
                 'questions, please contact support@fluidsurveys.com. (HINT: running '
                 '"pip install -U requests" should upgrade your requests '
                 'library to the latest version.)' % (version,))
-            requests = None
+            raise ImportError('requests %s is too old' % (version,))
+    requests = module
+
+
+def _import_pycurl():
+    global pycurl
+    import pycurl as module
+    pycurl = module
+
+
+def _import_urlfetch():
+    global urlfetch
+    from google.appengine.api import urlfetch as module
+    urlfetch = module
+
+
+def _import_urllib2():
+    global urllib2
+    try:
+        import urllib2 as module
+    except ImportError:
+        import urllib.request as module
+    urllib2 = module
+
 
-try:
-    from google.appengine.api import urlfetch
-except ImportError:
-    urlfetch = None
+def _backend_name(name):
+    if name == 'urllib':
+        return 'urllib2'
+    if name not in BACKEND_ORDER:
+        raise ValueError('Unknown HTTP backend %r, expected one of %s' %
+                         (name, ', '.join(BACKEND_ORDER)))
+    return name
+
+
+def load_backend(name):
+    """ Import the library of the backend called `name` and return the
+    backend's class, or None if the library can't be imported. """
+    name = _backend_name(name)
+    if name not in _loaded_backends:
+        loader, impl = {
+            'urlfetch': (_import_urlfetch, UrlFetchClient),
+            'requests': (_import_requests, RequestsClient),
+            'pycurl': (_import_pycurl, PycurlClient),
+            'urllib2': (_import_urllib2, Urllib2Client),
+        }[name]
+        try:
+            loader()
+        except ImportError:
+            impl = None
+        _loaded_backends[name] = impl
+    return _loaded_backends[name]
+
+
+def available_backends():
+    """ Names of the backends whose library can be imported. """
+    return [name for name in BACKEND_ORDER if load_backend(name) is not None]
+
+
+def configure_backend(name=None):
+    """ Use the backend called `name` (one of `BACKEND_ORDER`) for every
+    new client instead of probing for one. The `FLUIDSURVEYS_HTTP_BACKEND`
+    environment variable does the same without code; None goes back to it
+    and then to probing. The shared client is rebuilt on its next use. """
+    global _backend, _shared_client
+    if name is not None:
+        name = _backend_name(name)
+    with _shared_client_lock:
+        _backend = name
+        if _shared_client is not None:
+            _shared_client.close()
+        _shared_client = None
 
 
 def new_default_http_client(*args, **kwargs):
-    if urlfetch:
-        impl = UrlFetchClient
-    elif requests:
-        impl = RequestsClient
-    elif pycurl:
-        impl = PycurlClient
-    else:
-        impl = Urllib2Client
+    name = _backend or os.environ.get(BACKEND_ENV)
+    if name:
+        impl = load_backend(name)
+        if impl is None:
+            raise ImportError('The %r HTTP backend was selected but its '
+                              'library could not be imported' % (name,))
+        return impl(*args, **kwargs)
+
+    for name in BACKEND_ORDER:
+        impl = load_backend(name)
+        if impl is not None:
+            break
+    if name == 'urllib2':
         warnings.warn(
             "Warning: the Fluid library is falling back to urllib2/urllib "
             "because neither requests nor pycurl are installed. "
@@ -71,39 +155,1010 @@ def new_default_http_client(*args, **kwargs):
     return impl(*args, **kwargs)
 
 
+# Connection pool settings used by RequestsClient. `pool_connections` is the
+# number of distinct hosts kept in the pool manager, `pool_maxsize` is the
+# number of keep-alive connections kept per host and `pool_block` makes a
+# request wait for a free connection instead of opening an extra one once a
+# host is at `pool_maxsize`.
+POOL_DEFAULTS = {
+    'pool_connections': 10,
+    'pool_maxsize': 10,
+    'pool_block': False,
+    'keep_alive': True,
+}
+
+_shared_client = None
+_shared_client_lock = threading.Lock()
+_shared_options = {'cache': None, 'rate_limiter': None, 'retry': None,
+                   'instrumentation': None, 'compress_min_size': None,
+                   'codec': None, 'timeout': None, 'hedge': None}
+
+
+def configure_pool(**kwargs):
+    """ Change the connection pool settings of the shared client.
+
+    Accepts the keys of `POOL_DEFAULTS`. The shared client is rebuilt on its
+    next use so that the new settings take effect.
+    """
+    global _shared_client
+    unknown = set(kwargs) - set(POOL_DEFAULTS)
+    if unknown:
+        raise ValueError('Unknown pool option(s): %s' %
+                         ', '.join(sorted(unknown)))
+    with _shared_client_lock:
+        POOL_DEFAULTS.update(kwargs)
+        if _shared_client is not None:
+            _shared_client.close()
+        _shared_client = None
+
+
+def get_shared_client():
+    """ Return the process-wide Client that all managers reuse. """
+    global _shared_client
+    client = _shared_client
+    if client is None:
+        with _shared_client_lock:
+            if _shared_client is None:
+                options = dict(_shared_options, **POOL_DEFAULTS)
+                _shared_client = Client(**options)
+            client = _shared_client
+    return client
+
+
+def _set_shared_option(name, value):
+    with _shared_client_lock:
+        _shared_options[name] = value
+        if _shared_client is not None:
+            setattr(_shared_client, name, value)
+
+
+def configure_cache(cache):
+    """ Set the GET response cache of the shared client, e.g. a
+    `cache.LRUCache`. Pass None to turn caching off. """
+    _set_shared_option('cache', cache)
+
+
+def configure_rate_limit(rate_limiter=None, retry=None):
+    """ Set the `ratelimit.RateLimiter` and `ratelimit.RetryPolicy` of the
+    shared client. None removes the limiter and restores the default
+    retry policy. """
+    _set_shared_option('rate_limiter', rate_limiter)
+    _set_shared_option('retry', retry if retry is not None else RetryPolicy())
+
+
+def configure_instrumentation(instrumentation):
+    """ Set the `metrics.Instrumentation` of the shared client, or None to
+    stop instrumenting it. """
+    _set_shared_option('instrumentation', instrumentation)
+
+
+def configure_compression(min_size=None):
+    """ Gzip the request bodies of the shared client from `min_size` bytes
+    on, or never with None. """
+    _set_shared_option('compress_min_size', min_size)
+
+
+def configure_codec(codec=None):
+    """ Set the JSON codec of the shared client, a `codec.Codec` or the
+    name of one, or the default codec with None. """
+    _set_shared_option('codec', get_codec(codec))
+
+
+def configure_deadlines(timeout=None, hedge=None):
+    """ Cap every request of the shared client at `timeout` seconds, or at
+    the backend's own with None, and hedge its GETs according to `hedge`,
+    a `ratelimit.HedgePolicy`, or never with None. """
+    _set_shared_option('timeout', timeout)
+    _set_shared_option('hedge', hedge)
+
+
+def pool_stats():
+    """ Connection pool counters of the shared client. """
+    return get_shared_client().pool_stats()
+
+
+def build_url(url, api_base=None):
+    """ Resolve an API path against `api_base`, that of `AccessInfo` by
+    default.
+
+    Absolute urls, such as the `next` links of paginated listings, are used
+    untouched.
+    """
+    if url.startswith(_ABSOLUTE):
+        return url
+    if api_base is None:
+        api_base = AccessInfo['api_base']
+    return _join(str(api_base).rstrip('/'), url)
+
+
+_ABSOLUTE = ('http://', 'https://')
+
+
+def _join(prefix, url):
+    path, _, query = url.partition('?')
+    url_to_use = prefix + path.rstrip('/') + '/'
+    if query:
+        url_to_use += '?' + query
+    return url_to_use
+
+
 class Client(object):
+    """ Sends API calls through an `HTTPClient` backend.
 
-    def __init__(self):
-        self.httpclient = new_default_http_client()
+    Replies are always accepted gzip or deflate encoded, see `HTTPClient`.
+    Request bodies of at least `compress_min_size` bytes are sent gzip
+    encoded; None sends them as they are.
+
+    With `coalesce`, GETs of the same url with the same credentials made
+    while one is in flight wait for it and share its reply, see
+    `single_flight`.
+
+    Expired cache entries within the cache's `stale_while_revalidate`
+    window are answered from the cache at once and revalidated by a
+    background thread.
+
+    Requests carry the credentials and go to the `api_base` of
+    `access_info`, an `AccessInfoClass`, or of the global `AccessInfo` when
+    it is None. A client of its own per account lets one process work for
+    several at once, see `tenants.ClientRegistry`. `httpclient` is the
+    backend to send through, which may be shared with other clients; by
+    default the client opens one of its own with `pool_options`.
+
+    Replies are decoded with `codec`, a `codec.Codec` or the name of one, by
+    default the fastest installed. Bodies are sent form encoded, or encoded
+    with the codec as `application/json` when given to `request` as `json`.
+
+    A request may take `timeout` seconds, or as long as the backend allows
+    with None, and no longer than the time left before the current
+    `deadline`. With a `ratelimit.HedgePolicy` as `hedge`, a GET slow to
+    answer is sent a second time and the first reply taken.
+    """
 
-    def request(self, method, url, body=None):
-        headers = AccessInfo.render_header()
-        # import ipdb; ipdb.set_trace()
-        url_to_use = "".join(map(lambda x: str(x).rstrip('/'), [AccessInfo['api_base'], url])) + '/'
-        resp, status_code = self.httpclient.request(method, url_to_use, headers, body)
+    def __init__(self, cache=None, rate_limiter=None, retry=None,
+                 instrumentation=None, compress_min_size=None, coalesce=True,
+                 access_info=None, httpclient=None, codec=None, timeout=None,
+                 hedge=None, **pool_options):
+        if access_info is not None and \
+                not isinstance(access_info, AccessInfoClass):
+            access_info = AccessInfoClass(access_info)
+        self.access_info = access_info
+        self.owns_httpclient = httpclient is None
+        if httpclient is None:
+            httpclient = new_default_http_client(**pool_options)
+        self.httpclient = httpclient
+        self.codec = get_codec(codec)
+        self._prepared = None
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.retry = retry if retry is not None else RetryPolicy()
+        self.instrumentation = instrumentation
+        self.compress_min_size = compress_min_size
+        self.single_flight = SingleFlight() if coalesce else None
+        self.timeout = timeout
+        self.hedge = hedge
+        self.retries = 0
+        self._revalidating = set()
+        self._revalidating_lock = threading.Lock()
 
+    def rate_stats(self):
+        """ Current rate, concurrency limit and retry count. """
+        stats = {}
+        if self.rate_limiter is not None:
+            stats.update(self.rate_limiter.stats())
+        stats['retries'] = self.retries
+        return stats
+
+    def pool_stats(self):
+        stats = getattr(self.httpclient, 'stats', None)
+        if stats is None:
+            return {}
+        return stats.snapshot()
+
+    @property
+    def access(self):
+        """ The credentials and `api_base` requests are made with. """
+        if self.access_info is not None:
+            return self.access_info
+        return AccessInfo
+
+    def close(self):
+        if self.owns_httpclient:
+            self.httpclient.close()
+
+    def build_url(self, url):
+        if url.startswith(_ABSOLUTE):
+            return url
+        return _join(self._prepare()[0], url)
+
+    def _prepare(self):
+        """ `(url prefix, headers)` of requests, rendered again only when
+        the access info, its `api_base` or its credentials change. The
+        headers are shared by every request and must not be modified. """
+        access = self.access
+        state = (id(access), access['api_base'], access.get('username'),
+                 access.get('api_key'))
+        prepared = self._prepared
+        if prepared is None or prepared[0] != state:
+            prepared = self._prepared = (
+                state, str(access['api_base']).rstrip('/'),
+                access.render_header())
+        return prepared[1], prepared[2]
+
+    def invalidate(self, url=None):
+        """ Drop cached responses for `url` and everything below it. """
+        if self.cache is not None:
+            self.cache.invalidate(None if url is None else self.build_url(url))
+
+    def request(self, method, url, body=None, json=None):
+        content_type = None
+        if json is not None:
+            body, content_type = self.codec.encode(json), 'application/json'
+        instrumentation = self.instrumentation
+        if instrumentation is None:
+            return self._request(method, url, body, None, content_type)
+        event = instrumentation.start(method, self.build_url(url),
+                                      self.access['api_base'])
+        try:
+            result = self._request(method, url, body, event, content_type)
+            event.status_code = result[1]
+            return result
+        except Exception as e:
+            event.error = e
+            raise
+        finally:
+            instrumentation.finish(event)
+
+    def _request(self, method, url, body=None, event=None,
+                 content_type=None):
+        prefix, headers = self._prepare()
+        if content_type is not None:
+            headers = dict(headers, **{'Content-Type': content_type})
+        url_to_use = url if url.startswith(_ABSOLUTE) else _join(prefix, url)
+        key = (url_to_use, headers.get('AUTHORIZATION'))
+
+        cache, entry = self.cache, None
+        if cache is not None:
+            if method == 'GET':
+                entry = cache.get(key)
+                if entry is not None:
+                    if entry.is_fresh():
+                        if event is not None:
+                            event.cached = True
+                        return entry.body, 200
+                    if entry.is_servable(
+                            getattr(cache, 'stale_while_revalidate', None)):
+                        self._revalidate_later(key, entry)
+                        if event is not None:
+                            event.cached = True
+                        return entry.body, 200
+                    headers = dict(headers, **entry.conditional_headers())
+            else:
+                cache.invalidate(url_to_use)
+
+        single_flight = self.single_flight
+        if method != 'GET' or single_flight is None:
+            return self._fetch(method, url_to_use, headers, body, key, entry,
+                               event)
+        result, shared = single_flight.do(key, lambda: self._fetch(
+            method, url_to_use, headers, body, key, entry, event))
+        if shared and event is not None:
+            event.coalesced = True
+        return result
+
+    def _revalidate_later(self, key, entry):
+        """ Revalidate a stale cache `entry` on a background thread, unless
+        it already is being revalidated. """
+        with self._revalidating_lock:
+            if key in self._revalidating:
+                return
+            self._revalidating.add(key)
+        thread = threading.Thread(target=self._revalidate, args=(key, entry))
+        thread.daemon = True
+        thread.start()
+
+    def _revalidate(self, key, entry):
+        url_to_use, authorization = key
+        headers = dict(self._prepare()[1], **entry.conditional_headers())
+        if authorization is None:
+            headers.pop('AUTHORIZATION', None)
+        else:
+            headers['AUTHORIZATION'] = authorization
+
+        def fetch():
+            return self._fetch('GET', url_to_use, headers, None, key, entry,
+                               None)
         try:
-            body = json.loads(resp)
+            if self.single_flight is None:
+                body, status_code = fetch()
+            else:
+                (body, status_code), shared = self.single_flight.do(key,
+                                                                    fetch)
+            if status_code in (404, 410):
+                self.cache.invalidate(url_to_use)
+        except Exception:
+            # The entry stays stale; the next request tries again.
+            pass
+        finally:
+            with self._revalidating_lock:
+                self._revalidating.discard(key)
+
+    def _fetch(self, method, url_to_use, headers, body, key, entry, event):
+        """ Send a request and decode its reply, revalidating the cache
+        `entry` of a GET. """
+        cache = self.cache
+        if self.hedge is not None and method == 'GET':
+            resp, status_code, rheaders = self._send_hedged(
+                url_to_use, headers, event)
+        else:
+            resp, status_code, rheaders = self._send(
+                method, url_to_use, headers, body, event=event)
+
+        if entry is not None and status_code == 304:
+            cache.refresh(key, entry)
+            if event is not None:
+                event.cached = True
+            return entry.body, 200
+
+        if event is not None:
+            started = time.time()
+        try:
+            body = self.codec.decode(resp)
         except (ValueError, TypeError):
             body = None
+        if event is not None:
+            event.add_time('decode', time.time() - started)
+
+        if (cache is not None and method == 'GET' and status_code == 200 and
+                body is not None):
+            cache.set(key, body, size=len(resp), etag=rheaders.get('etag'),
+                      last_modified=rheaders.get('last-modified'))
 
         return body, status_code
 
+    def _send_hedged(self, url, headers, event):
+        """ Send a GET and, once it has taken longer than the hedge policy's
+        delay, a copy of it. The first reply is taken. The other attempt
+        can't be cancelled on a blocking backend, so it is left to finish
+        on its own and its reply dropped.
+
+        While a GET is hedged its attempts run on threads of their own, so
+        its event only gets the time it took as a whole. """
+        hedge = self.hedge
+        delay = hedge.delay()
+        if delay is None:
+            started = time.time()
+            result = self._send('GET', url, headers, None, event=event)
+            hedge.record(time.time() - started)
+            return result
+
+        replies = queue.Queue()
+        operation = deadline.current()
+
+        def attempt(hedged):
+            started = time.time()
+            try:
+                with deadline.bound(operation):
+                    result = self._send('GET', url, headers, None)
+            except Exception as e:
+                replies.put((hedged, None, e))
+            else:
+                hedge.record(time.time() - started)
+                replies.put((hedged, result, None))
+
+        def start(hedged):
+            thread = threading.Thread(target=attempt, args=(hedged,))
+            thread.daemon = True
+            thread.start()
+
+        started = time.time()
+        start(False)
+        pending = 1
+        try:
+            reply = replies.get(timeout=delay)
+        except queue.Empty:
+            reply = None
+            if hedge.allow():
+                start(True)
+                pending += 1
+                if event is not None:
+                    event.hedged = True
+        while True:
+            if reply is None:
+                # Each attempt is bounded by its own timeouts.
+                reply = replies.get()
+            pending -= 1
+            hedged, result, error = reply
+            if error is None:
+                break
+            if not pending:
+                raise error
+            reply = None
+        if hedged:
+            hedge.record_win()
+        if event is not None:
+            event.add_time('server', time.time() - started)
+        return result
+
+    def can_send_many(self):
+        """ Whether `request_many` runs its requests concurrently on the
+        calling thread. Requests paced by a rate limiter or instrumented
+        are sent one at a time. """
+        return (hasattr(self.httpclient, 'request_many') and
+                self.rate_limiter is None and self.instrumentation is None)
+
+    def request_many(self, method, urls, body=None):
+        """ Send the same request to several urls.
+
+        Returns, in the order of `urls`, the `(body, status_code)` of each
+        request or the exception it failed with. With a backend that has
+        `request_many` the requests run concurrently; any that need retrying
+        are then sent again one at a time.
+        """
+        if not self.can_send_many():
+            results = []
+            for url in urls:
+                try:
+                    results.append(self.request(method, url, body))
+                except Exception as e:
+                    results.append(e)
+            return results
+
+        headers = self._prepare()[1]
+        cache = self.cache if method == 'GET' else None
+        results, calls, sent = {}, [], []
+        headers, encoded = self._encode_body(headers, body)
+        for index, url in enumerate(urls):
+            url_to_use = self.build_url(url)
+            key = (url_to_use, headers.get('AUTHORIZATION'))
+            entry = cache.get(key) if cache is not None else None
+            call_headers = headers
+            if entry is not None:
+                if entry.is_fresh():
+                    results[index] = (entry.body, 200)
+                    continue
+                call_headers = dict(headers, **entry.conditional_headers())
+            calls.append((method, url_to_use, call_headers, encoded))
+            sent.append((index, url, key, entry))
+
+        replies = []
+        if calls:
+            timeout = deadline.timeout(self.timeout)
+            if timeout is None:
+                replies = self.httpclient.request_many(calls)
+            else:
+                replies = self.httpclient.request_many(calls, timeout=timeout)
+        for (index, url, key, entry), reply in zip(sent, replies):
+            if isinstance(reply, Exception) or reply[1] == 429 or \
+                    reply[1] >= 500:
+                try:
+                    results[index] = self.request(method, url, body)
+                except Exception as e:
+                    results[index] = e
+                continue
+            resp, status_code, rheaders = reply
+            if entry is not None and status_code == 304:
+                cache.refresh(key, entry)
+                results[index] = (entry.body, 200)
+                continue
+            try:
+                decoded = self.codec.decode(resp)
+            except (ValueError, TypeError):
+                decoded = None
+            if cache is not None and status_code == 200 and \
+                    decoded is not None:
+                cache.set(key, decoded, size=len(resp),
+                          etag=rheaders.get('etag'),
+                          last_modified=rheaders.get('last-modified'))
+            results[index] = (decoded, status_code)
+        return [results[index] for index in range(len(urls))]
+
+    def stream(self, method, url, body=None):
+        """ Send a request for a listing page and decode it as it arrives.
+
+        Returns `(stream, status_code)`. Iterating over the `ResultsStream`
+        yields the records of the page's `results` one by one; its `meta`
+        holds the other members of the page once the records are consumed.
+        An instrumented call completes once the page is read or closed.
+        """
+        prefix, headers = self._prepare()
+        url_to_use = url if url.startswith(_ABSOLUTE) else _join(prefix, url)
+        instrumentation = self.instrumentation
+        if instrumentation is None:
+            chunks, status_code, rheaders = self._send(
+                method, url_to_use, headers, body, stream=True)
+            return ResultsStream(chunks), status_code
+
+        event = instrumentation.start(method, url_to_use,
+                                      self.access['api_base'])
+        try:
+            chunks, status_code, rheaders = self._send(
+                method, url_to_use, headers, body, stream=True, event=event)
+        except Exception as e:
+            event.error = e
+            instrumentation.finish(event)
+            raise
+        event.status_code = status_code
+        chunks = _MeasuredChunks(chunks, event, instrumentation,
+                                 self.httpclient)
+        return ResultsStream(chunks), status_code
+
+    def _send(self, method, url, headers, body, stream=False, event=None):
+        """ Send a request through the backend, paced by the rate limiter
+        and retried according to the retry policy.
+
+        A request still throttled or failing with a transient server error
+        (one of the retry policy's `RETRY_STATUSES`) once it is out of
+        retries raises `exceptions.APIError`. With `stream`, the
+        limiter's slot is given back as soon as the reply's headers are in.
+
+        Every attempt is sent with the time left before the current deadline
+        as its timeout; one that can't be made, or retried, in time raises
+        `exceptions.DeadlineExceeded`.
+        """
+        httpclient = self.httpclient
+        send = httpclient.stream if stream else httpclient.request
+        limiter, retry = self.rate_limiter, self.retry
+        headers, body = self._encode_body(headers, body, event)
+        attempt = 0
+        while True:
+            if event is not None:
+                event.retries = attempt
+                started = time.time()
+            if limiter is not None:
+                limiter.acquire()
+            if event is not None:
+                sent = time.time()
+                event.add_time('wait', sent - started)
+            try:
+                timeout = deadline.timeout(self.timeout)
+            except exceptions.DeadlineExceeded:
+                if limiter is not None:
+                    limiter.release(None)
+                raise
+            try:
+                # Backends of other makers may not take a timeout.
+                if timeout is None:
+                    content, status_code, rheaders = send(method, url,
+                                                          headers, body)
+                else:
+                    content, status_code, rheaders = send(
+                        method, url, headers, body, timeout=timeout)
+            except exceptions.APIConnectionError:
+                if limiter is not None:
+                    limiter.release(None)
+                deadline.check()
+                if not retry.should_retry(method, None, attempt):
+                    raise
+                self._backoff(retry.delay(attempt), event)
+                attempt += 1
+                continue
+            if event is not None:
+                self._record_transfer(event, sent, content, stream)
+
+            retry_after = None
+            if status_code == 429 or status_code >= 500:
+                retry_after = parse_retry_after(rheaders.get('retry-after'))
+            if limiter is not None:
+                limiter.release(status_code, retry_after)
+            # Client errors, and server errors no retry can fix such as 501
+            # Not Implemented, are answers for the caller to handle.
+            if status_code != 429 and \
+                    status_code not in retry.RETRY_STATUSES:
+                return content, status_code, rheaders
+
+            if stream:
+                close = getattr(content, 'close', None)
+                if close is not None:
+                    close()
+                content = None
+            if not retry.should_retry(method, status_code, attempt):
+                raise exceptions.APIError(
+                    'Fluid answered %s to %s %s' % (status_code, method, url),
+                    http_body=content, http_status=status_code)
+            self._backoff(retry.delay(attempt, retry_after), event)
+            attempt += 1
+
+    def _encode_body(self, headers, body, event=None):
+        """ The headers and body to send. A dict body is form encoded here,
+        the same for every backend, and the body gzipped when it is at
+        least `compress_min_size` bytes. The sizes of the encoded body,
+        before and after compression, go to the instrumentation `event`.
+        """
+        if isinstance(body, dict):
+            body = _form_encode(body)
+            headers = dict(headers, **{
+                'Content-Type': 'application/x-www-form-urlencoded'})
+        if not body:
+            return headers, body
+        encoded = body if isinstance(body, bytes) else body.encode('utf-8')
+        if event is not None:
+            event.bytes_out = event.wire_bytes_out = len(encoded)
+        if self.compress_min_size is None or \
+                len(encoded) < self.compress_min_size:
+            return headers, body
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        headers = dict(headers, **{'Content-Encoding': 'gzip'})
+        body = compressor.compress(encoded) + compressor.flush()
+        if event is not None:
+            event.wire_bytes_out = len(body)
+        return headers, body
+
+    def _backoff(self, delay, event):
+        deadline.check(delay)
+        self.retries += 1
+        time.sleep(delay)
+        if event is not None:
+            event.add_time('wait', delay)
+
+    def _record_transfer(self, event, sent, content, stream):
+        """ Phase timings and size of the latest attempt of a call. """
+        elapsed = time.time() - sent
+        phases = self.httpclient.pop_timings()
+        if not isinstance(phases, dict):
+            phases = {}
+        timings = event.timings
+        for phase in ('dns', 'connect', 'server', 'download'):
+            timings.pop(phase, None)
+        timings.update(phases)
+        if 'server' not in phases:
+            timings['server'] = elapsed
+        elif not stream and 'download' not in phases:
+            timings['download'] = max(
+                elapsed - sum(phases.values()), 0.0)
+        if not stream:
+            event.bytes_in = len(content) if content else 0
+            event.wire_bytes_in = self.httpclient.pop_wire_bytes()
+
+
+def _form_encode(body):
+    """ A dict body form encoded to bytes as requests encodes it: list
+    values repeat their field, None values are left out and text goes out
+    UTF-8 encoded. """
+    fields = []
+    for key, values in body.items():
+        if isinstance(values, (six.string_types, bytes)) or \
+                not hasattr(values, '__iter__'):
+            values = [values]
+        if isinstance(key, six.text_type):
+            key = key.encode('utf-8')
+        for value in values:
+            if value is None:
+                continue
+            if isinstance(value, six.text_type):
+                value = value.encode('utf-8')
+            fields.append((key, value))
+    return compat.urlencode(fields, doseq=True).encode('ascii')
+
+
+def _raw_bytes_read(result):
+    """ Bytes of a `requests` reply's body read from the connection. """
+    try:
+        return result.raw.tell()
+    except Exception:
+        return None
+
+
+class _Decoder(object):
+    """ Incremental decoder of a gzip or deflate encoded reply. """
+
+    def __init__(self, coding):
+        self.coding = coding
+        if coding == 'deflate':
+            # Usually zlib wrapped, sometimes raw; told apart on the first
+            # chunk.
+            self._decompressor = None
+        else:
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    @classmethod
+    def for_headers(cls, rheaders):
+        """ A decoder for a reply with lower-cased `rheaders`, or None if
+        it is not encoded. """
+        coding = (rheaders.get('content-encoding') or '').strip().lower()
+        if coding in ('gzip', 'x-gzip', 'deflate'):
+            return cls(coding)
+        return None
+
+    def decode(self, chunk):
+        if self._decompressor is None:
+            self._decompressor = zlib.decompressobj()
+            try:
+                return self._decompressor.decompress(chunk)
+            except zlib.error:
+                self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self._decompressor.decompress(chunk)
+
+    def flush(self):
+        if self._decompressor is None:
+            return b''
+        return self._decompressor.flush()
+
+
+class _StreamedChunks(object):
+    """ The chunks of a streamed reply, read by generator `chunks`, which
+    calls `release` once done with the connection. Closing them releases
+    it too, also before iterating: a generator closed before it started
+    never runs its `finally`. """
+
+    def __init__(self, chunks, release):
+        self.chunks = chunks
+        self._release = release
+        self.released = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.chunks)
+
+    next = __next__
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self._release()
+
+    def close(self):
+        self.chunks.close()
+        self.release()
+
+
+def _streamed(chunks, release):
+    """ `_StreamedChunks` of generator function `chunks`, which is given
+    the once-only release function to call when it finishes. """
+    streamed = _StreamedChunks(None, release)
+    streamed.chunks = chunks(streamed.release)
+    return streamed
+
+
+class _MeasuredChunks(object):
+    """ Pass the chunks of a streamed reply through, counting their bytes
+    and the time taken to read them, and complete the call's event once
+    they are consumed or closed. """
+
+    def __init__(self, chunks, event, instrumentation, httpclient=None):
+        self.chunks = chunks
+        self.httpclient = httpclient
+        self.iterator = iter(chunks)
+        self.event = event
+        self.instrumentation = instrumentation
+        self.started = time.time()
+        self.finished = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            chunk = next(self.iterator)
+        except StopIteration:
+            self.close()
+            raise
+        except Exception as e:
+            self.event.error = e
+            self.close()
+            raise
+        self.event.bytes_in += len(chunk)
+        return chunk
+
+    next = __next__
+
+    def close(self):
+        if self.finished:
+            return
+        self.finished = True
+        close = getattr(self.chunks, 'close', None)
+        if close is not None:
+            close()
+        if self.httpclient is not None:
+            self.event.wire_bytes_in = self.httpclient.pop_wire_bytes()
+        self.event.add_time('download', time.time() - self.started)
+        self.instrumentation.finish(self.event)
+
 
 class HTTPClient(object):
+    """ Base class of the HTTP backends.
 
-    def __init__(self, verify_ssl_certs=True):
+    With `decompress`, every backend asks for gzip or deflate encoded
+    replies and hands out their content decoded, also when streaming.
+
+    A request given no `timeout` may take up to `timeout` seconds, of
+    which `connect_timeout` to connect.
+    """
+
+    # The `BACKEND_ORDER` name of the library the backend is built on.
+    library = None
+
+    # Content codings asked for with `decompress`.
+    accept_encoding = 'gzip, deflate'
+
+    # Seconds a request may take and may spend connecting by default.
+    default_timeout = 80
+    default_connect_timeout = 30
+
+    def __init__(self, verify_ssl_certs=True, decompress=True, timeout=None,
+                 connect_timeout=None, **options):
+        if self.library is not None and load_backend(self.library) is None:
+            raise ImportError('%s needs the %s library' %
+                              (type(self).__name__, self.library))
         self._verify_ssl_certs = verify_ssl_certs
+        self.decompress = decompress
+        self.timeout = timeout if timeout is not None else \
+            self.default_timeout
+        self.connect_timeout = connect_timeout if connect_timeout is not \
+            None else self.default_connect_timeout
+
+    # Size of the chunks handed out by `stream`.
+    chunk_size = 64 * 1024
+
+    # Phase timings of the last request of each thread.
+    _timings = threading.local()
 
-    def request(self, method, url, headers = {}, body=None):
+    def request(self, method, url, headers={}, body=None, timeout=None):
+        """ Send a request. Returns `(content, status_code, headers)`,
+        where `headers` is a dict of the response headers with lower-cased
+        names. `timeout` overrides the backend's. """
         raise NotImplementedError(
             'HTTPClient subclasses must implement `request`')
 
+    def stream(self, method, url, headers={}, body=None, timeout=None):
+        """ Like `request`, but the content is an iterator of byte chunks
+        read from the connection as the caller consumes it. Backends that
+        can't stream hand out the whole content as a single chunk. """
+        content, status_code, rheaders = self.request(method, url, headers,
+                                                      body, timeout=timeout)
+        return iter([content]), status_code, rheaders
+
+    def pop_timings(self):
+        """ The phase timings (see `metrics`) the backend measured for the
+        calling thread's last request, e.g. `{'server': 0.12}`. """
+        timings = getattr(self._timings, 'value', None)
+        self._timings.value = None
+        return timings or {}
+
+    def _record_timings(self, **timings):
+        self._timings.value = timings
+
+    def pop_wire_bytes(self):
+        """ The size of the body of the calling thread's last reply as
+        received, before decoding, or None when the backend can't tell. """
+        size = getattr(self._timings, 'wire', None)
+        self._timings.wire = None
+        return size
+
+    def _record_wire_bytes(self, size):
+        self._timings.wire = size
+
+    def _timeouts(self, timeout):
+        """ `(connect, total)` seconds allowed to a request given
+        `timeout`, the backend's own when None. """
+        if timeout is None:
+            timeout = self.timeout
+        return min(self.connect_timeout, timeout), timeout
+
+    def _encoding_headers(self, headers):
+        """ `headers` asking for encoded replies if `decompress`, and for
+        plain ones otherwise. """
+        accept = self.accept_encoding if self.decompress else 'identity'
+        return dict(headers, **{'Accept-Encoding': accept})
+
+    @staticmethod
+    def _lower_headers(items):
+        return dict((k.lower(), v) for k, v in items)
+
+    def close(self):
+        pass
+
+
+class PoolStats(object):
+    """ Thread-safe connection pool counters.
+
+    `requests` counts requests sent through the pool, `new_connections` the
+    connections that had to be opened for them and `waits` the times a
+    request found every connection to its host checked out. Every request
+    that did not open a connection reused a pooled one, which is `hits`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+        self.waits = 0
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    @property
+    def hits(self):
+        return max(self.requests - self.new_connections, 0)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'hits': max(self.requests - self.new_connections, 0),
+                'new_connections': self.new_connections,
+                'waits': self.waits,
+            }
+
+
+def _counting_pool_class(base, stats):
+    """ Subclass a urllib3 connection pool so it reports into `stats`. """
+
+    class CountingConnectionPool(base):
+
+        def _get_conn(self, timeout=None):
+            if self.block and self.pool is not None and self.pool.empty():
+                stats.incr('waits')
+            return base._get_conn(self, timeout=timeout)
+
+        def _new_conn(self):
+            stats.incr('new_connections')
+            return base._new_conn(self)
+
+        def urlopen(self, *args, **kwargs):
+            stats.incr('requests')
+            return base.urlopen(self, *args, **kwargs)
+
+    CountingConnectionPool.__name__ = 'Counting' + base.__name__
+    return CountingConnectionPool
+
+
+def _pooled_adapter(stats, **kwargs):
+    """ Build a requests transport adapter whose pools report into `stats`. """
+    from requests.adapters import HTTPAdapter
+
+    class PooledAdapter(HTTPAdapter):
+
+        def init_poolmanager(self, *args, **pool_kwargs):
+            HTTPAdapter.init_poolmanager(self, *args, **pool_kwargs)
+            manager = self.poolmanager
+            manager.pool_classes_by_scheme = dict(
+                (scheme, _counting_pool_class(cls, stats))
+                for scheme, cls in manager.pool_classes_by_scheme.items())
+
+    return PooledAdapter(**kwargs)
+
 
 class RequestsClient(HTTPClient):
+    """ HTTP backend on top of pooled, keep-alive `requests` sessions.
+
+    A `requests.Session` is not safe to share between threads, so each
+    thread gets its own session. All of them mount the same transport
+    adapter, which means they all draw from one connection pool.
+    """
     name = 'requests'
+    library = 'requests'
+
+    def __init__(self, verify_ssl_certs=True, pool_connections=10,
+                 pool_maxsize=10, pool_block=False, keep_alive=True,
+                 **options):
+        super(RequestsClient, self).__init__(verify_ssl_certs, **options)
+        self.keep_alive = keep_alive
+        self.stats = PoolStats()
+        self._adapter = _pooled_adapter(self.stats,
+                                        pool_connections=pool_connections,
+                                        pool_maxsize=pool_maxsize,
+                                        pool_block=pool_block)
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('http://', self._adapter)
+            session.mount('https://', self._adapter)
+            if not self.keep_alive:
+                session.headers['Connection'] = 'close'
+            self._local.session = session
+        return session
+
+    def close(self):
+        self._adapter.close()
 
-    def request(self, method, url, headers={}, body=None):
+    def _send(self, method, url, headers, body, stream=False, timeout=None):
         kwargs = {}
 
         if self._verify_ssl_certs:
@@ -113,32 +1168,64 @@ class RequestsClient(HTTPClient):
             kwargs['verify'] = False
 
         try:
-            try:
-                result = requests.request(method,
-                                          url,
-                                          headers=headers,
-                                          data=body,
-                                          timeout=80,
-                                          **kwargs)
-            except TypeError, e:
-                raise TypeError(
-                    'Warning: It looks like your installed version of the '
-                    '"requests" library is not compatible with Fluid\'s '
-                    'usage thereof. (HINT: The most likely cause is that '
-                    'your "requests" library is out of date. You can fix '
-                    'that by running "pip install -U requests".) The '
-                    'underlying error was: %s' % (e,))
+            return self.session.request(method,
+                                        url,
+                                        headers=self._encoding_headers(
+                                            headers),
+                                        data=body,
+                                        timeout=self._timeouts(timeout),
+                                        stream=stream,
+                                        **kwargs)
+        except TypeError as e:
+            raise TypeError(
+                'Warning: It looks like your installed version of the '
+                '"requests" library is not compatible with Fluid\'s '
+                'usage thereof. (HINT: The most likely cause is that '
+                'your "requests" library is out of date. You can fix '
+                'that by running "pip install -U requests".) The '
+                'underlying error was: %s' % (e,))
+
+    def request(self, method, url, headers={}, body=None, timeout=None):
+        try:
+            result = self._send(method, url, headers, body, timeout=timeout)
 
             # This causes the content to actually be read, which could cause
             # e.g. a socket timeout. TODO: The other fetch methods probably
             # are succeptible to the same and should be updated.
             content = result.content
             status_code = result.status_code
-        except Exception, e:
+            rheaders = self._lower_headers(result.headers.items())
+            self._record_timings(server=result.elapsed.total_seconds())
+            self._record_wire_bytes(_raw_bytes_read(result))
+        except Exception as e:
             # Would catch just requests.exceptions.RequestException, but can
             # also raise ValueError, RuntimeError, etc.
             self._handle_request_error(e)
-        return content, status_code
+        return content, status_code, rheaders
+
+    def stream(self, method, url, headers={}, body=None, timeout=None):
+        try:
+            result = self._send(method, url, headers, body, stream=True,
+                                timeout=timeout)
+        except Exception as e:
+            self._handle_request_error(e)
+        self._record_timings(server=result.elapsed.total_seconds())
+
+        def release():
+            self._record_wire_bytes(_raw_bytes_read(result))
+            result.close()
+
+        def chunks(release):
+            try:
+                for chunk in result.iter_content(self.chunk_size):
+                    yield chunk
+            except Exception as e:
+                self._handle_request_error(e)
+            finally:
+                release()
+
+        return (_streamed(chunks, release), result.status_code,
+                self._lower_headers(result.headers.items()))
 
     def _handle_request_error(self, e):
         if isinstance(e, requests.exceptions.RequestException):
@@ -162,26 +1249,36 @@ class RequestsClient(HTTPClient):
 
 class UrlFetchClient(HTTPClient):
     name = 'urlfetch'
+    library = 'urlfetch'
 
-    def request(self, method, url, headers={}, body=None):
+    # GAE requests time out after 60 seconds, so make sure we leave some
+    # time for the application to handle a slow Fluid.
+    default_timeout = 55
+
+    def request(self, method, url, headers={}, body=None, timeout=None):
         try:
             result = urlfetch.fetch(
                 url=url,
                 method=method,
-                headers=headers,
+                headers=self._encoding_headers(headers),
                 # Google App Engine doesn't let us specify our own cert bundle.
                 # However, that's ok because the CA bundle they use recognizes
                 # api.fluidsurveys.com.
                 validate_certificate=self._verify_ssl_certs,
-                # GAE requests time out after 60 seconds, so make sure we leave
-                # some time for the application to handle a slow Fluid
-                deadline=55,
+                deadline=self._timeouts(timeout)[1],
                 payload=body
             )
-        except urlfetch.Error, e:
+        except urlfetch.Error as e:
             self._handle_request_error(e, url)
 
-        return result.content, result.status_code
+        rheaders = self._lower_headers(result.headers.items())
+        content = result.content
+        # App Engine usually decodes replies itself.
+        decoder = _Decoder.for_headers(rheaders)
+        if decoder is not None:
+            self._record_wire_bytes(len(content))
+            content = decoder.decode(content) + decoder.flush()
+        return content, result.status_code, rheaders
 
     def _handle_request_error(self, e, url):
         if isinstance(e, urlfetch.InvalidURLError):
@@ -200,49 +1297,322 @@ class UrlFetchClient(HTTPClient):
                    "problem persists, let us know at support@fluidsurveys.com.")
 
         msg = textwrap.fill(msg) + "\n\n(Network error: " + str(e) + ")"
-        raise error.APIConnectionError(msg)
+        raise exceptions.APIConnectionError(msg)
 
 
 class PycurlClient(HTTPClient):
+    """ HTTP backend on top of libcurl.
+
+    Curl handles are kept in a pool and reused, and all of them share
+    libcurl's connection, DNS and TLS session caches, so connections stay
+    open across requests and threads. Up to `pool_maxsize` idle handles are
+    kept; with `pool_block` a request waits for a handle once that many are
+    in use.
+
+    `request_many` runs a batch of requests concurrently on the calling
+    thread over a `CurlMulti`, at most `multi_concurrency` at a time and
+    `pool_maxsize` connections per host. With `multiplex`, requests to an
+    HTTP/2 server share connections.
+    """
     name = 'pycurl'
+    library = 'pycurl'
+
+    def __init__(self, verify_ssl_certs=True, pool_maxsize=10,
+                 pool_block=False, keep_alive=True, multiplex=False,
+                 multi_concurrency=16, **options):
+        super(PycurlClient, self).__init__(verify_ssl_certs, **options)
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.keep_alive = keep_alive
+        self.multiplex = multiplex
+        self.multi_concurrency = multi_concurrency
+        self.stats = PoolStats()
+        self._idle = []
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self._share = pycurl.CurlShare()
+        for data in ('LOCK_DATA_CONNECT', 'LOCK_DATA_DNS',
+                     'LOCK_DATA_SSL_SESSION'):
+            try:
+                self._share.setopt(pycurl.SH_SHARE, getattr(pycurl, data))
+            except (AttributeError, pycurl.error):
+                # Older libcurl can't share this.
+                pass
 
-    def request(self, method, url, headers={}, body=None):
-        s = util.StringIO.StringIO()
+    def close(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for curl in idle:
+            curl.close()
+        multi = getattr(self._local, 'multi', None)
+        if multi is not None:
+            multi.close()
+            self._local.multi = None
+
+    def _checkout(self, block=True):
+        with self._cond:
+            if self.pool_block and block:
+                if not self._idle and self._in_use >= self.pool_maxsize:
+                    self.stats.incr('waits')
+                while not self._idle and self._in_use >= self.pool_maxsize:
+                    self._cond.wait()
+            self._in_use += 1
+            if self._idle:
+                return self._idle.pop()
         curl = pycurl.Curl()
+        curl.setopt(pycurl.SHARE, self._share)
+        return curl
+
+    def _checkin(self, curl):
+        # Counts the connections the transfer had to open.
+        self.stats.incr('requests')
+        try:
+            self.stats.incr('new_connections',
+                            curl.getinfo(pycurl.NUM_CONNECTS))
+        except pycurl.error:
+            pass
+        # Keeps the handle's share, so its connections stay reusable.
+        curl.reset()
+        with self._cond:
+            self._in_use -= 1
+            if len(self._idle) < self.pool_maxsize:
+                self._idle.append(curl)
+                curl = None
+            self._cond.notify()
+        if curl is not None:
+            curl.close()
+
+    def request(self, method, url, headers={}, body=None, timeout=None):
+        received = []
+        rheaders = {}
+        curl = self._checkout()
+        try:
+            self._prepare(curl, method, url, headers, body, received.append,
+                          rheaders, timeout)
+            try:
+                curl.perform()
+            except pycurl.error as e:
+                self._handle_request_error(e)
+            rbody = b''.join(received)
+            rcode = curl.getinfo(pycurl.RESPONSE_CODE)
+            self._record_timings(**self._curl_timings(curl))
+            self._record_wire_bytes(self._wire_bytes(curl))
+        finally:
+            self._checkin(curl)
+        return rbody, rcode, rheaders
+
+    def request_many(self, calls, concurrency=None, timeout=None):
+        """ Send `(method, url, headers, body)` requests concurrently,
+        each within `timeout`.
+
+        Returns, in the order of `calls`, the `(content, status_code,
+        headers)` of each request or the `APIConnectionError` it failed
+        with.
+        """
+        multi = self._multi()
+        concurrency = concurrency or self.multi_concurrency
+        calls = iter(enumerate(calls))
+        results = {}
+        active = {}
+
+        def start():
+            for index, (method, url, headers, body) in calls:
+                received, rheaders = [], {}
+                curl = self._checkout(block=False)
+                self._prepare(curl, method, url, headers, body,
+                              received.append, rheaders, timeout)
+                multi.add_handle(curl)
+                active[curl] = (index, received, rheaders)
+                if len(active) >= concurrency:
+                    return
+
+        def finish(curl, error=None):
+            index, received, rheaders = active.pop(curl)
+            multi.remove_handle(curl)
+            if error is None:
+                results[index] = (b''.join(received),
+                                  curl.getinfo(pycurl.RESPONSE_CODE),
+                                  rheaders)
+            else:
+                try:
+                    self._handle_request_error(error)
+                except exceptions.APIConnectionError as e:
+                    results[index] = e
+            self._checkin(curl)
 
+        try:
+            start()
+            while active:
+                while True:
+                    ret, running = multi.perform()
+                    if ret != pycurl.E_CALL_MULTI_PERFORM:
+                        break
+                while True:
+                    queued, ok, failed = multi.info_read()
+                    for curl in ok:
+                        finish(curl)
+                    for curl, errno, errmsg in failed:
+                        finish(curl, pycurl.error(errno, errmsg))
+                    if not queued:
+                        break
+                start()
+                if active:
+                    multi.select(1.0)
+        finally:
+            for curl in list(active):
+                multi.remove_handle(curl)
+                active.pop(curl)
+                self._checkin(curl)
+        return [results[index] for index in range(len(results))]
+
+    def _multi(self):
+        """ The calling thread's CurlMulti. """
+        multi = getattr(self._local, 'multi', None)
+        if multi is None:
+            multi = pycurl.CurlMulti()
+            multi.setopt(pycurl.M_MAX_HOST_CONNECTIONS, self.pool_maxsize)
+            if self.multiplex:
+                multi.setopt(pycurl.M_PIPELINING, pycurl.PIPE_MULTIPLEX)
+            self._local.multi = multi
+        return multi
+
+    def stream(self, method, url, headers={}, body=None, timeout=None):
+        received = []
+        rheaders = {}
+        curl = self._checkout()
+        self._prepare(curl, method, url, headers, body, received.append,
+                      rheaders, timeout)
+        multi = pycurl.CurlMulti()
+        multi.add_handle(curl)
+
+        def perform():
+            while True:
+                ret, active = multi.perform()
+                if ret != pycurl.E_CALL_MULTI_PERFORM:
+                    return active
+
+        def check():
+            queued, ok, failed = multi.info_read()
+            for handle, errno, errmsg in failed:
+                self._handle_request_error(pycurl.error(errno, errmsg))
+
+        def release():
+            self._record_wire_bytes(self._wire_bytes(curl))
+            multi.remove_handle(curl)
+            self._checkin(curl)
+            multi.close()
+
+        # Drive the transfer until the headers are in, then hand out the
+        # body as libcurl receives it.
+        try:
+            active = perform()
+            while active and not received and not curl.getinfo(
+                    pycurl.RESPONSE_CODE):
+                multi.select(1.0)
+                active = perform()
+            check()
+        except Exception:
+            release()
+            raise
+        timings = self._curl_timings(curl)
+        del timings['download']
+        self._record_timings(**timings)
+
+        def chunks(release):
+            try:
+                remaining = active
+                while True:
+                    while received:
+                        yield received.pop(0)
+                    if not remaining:
+                        break
+                    multi.select(1.0)
+                    remaining = perform()
+                    check()
+            finally:
+                release()
+
+        return (_streamed(chunks, release),
+                curl.getinfo(pycurl.RESPONSE_CODE), rheaders)
+
+    def _prepare(self, curl, method, url, headers, body, write, rheaders,
+                 timeout=None):
+        method = method.lower()
         if method == 'get':
             curl.setopt(pycurl.HTTPGET, 1)
         elif method == 'post':
             curl.setopt(pycurl.POST, 1)
-            curl.setopt(pycurl.POSTFIELDS, body)
+            curl.setopt(pycurl.POSTFIELDS, body or '')
+        elif method == 'head':
+            curl.setopt(pycurl.NOBODY, 1)
         else:
             curl.setopt(pycurl.CUSTOMREQUEST, method.upper())
+            if body is not None:
+                curl.setopt(pycurl.POSTFIELDS, body)
 
         # pycurl doesn't like unicode URLs
         curl.setopt(pycurl.URL, util.utf8(url))
 
-        curl.setopt(pycurl.WRITEFUNCTION, s.write)
+        curl.setopt(pycurl.WRITEFUNCTION, write)
+        curl.setopt(pycurl.HEADERFUNCTION,
+                    lambda line: self._parse_header(line, rheaders))
         curl.setopt(pycurl.NOSIGNAL, 1)
-        curl.setopt(pycurl.CONNECTTIMEOUT, 30)
-        curl.setopt(pycurl.TIMEOUT, 80)
+        # Idle connections the shared cache keeps; libcurl defaults to 5.
+        curl.setopt(pycurl.MAXCONNECTS, self.pool_maxsize)
+        if not self.keep_alive:
+            curl.setopt(pycurl.FORBID_REUSE, 1)
+        # Milliseconds, at least one: libcurl takes 0 as no timeout.
+        connect, total = self._timeouts(timeout)
+        curl.setopt(pycurl.CONNECTTIMEOUT_MS, max(int(connect * 1000), 1))
+        curl.setopt(pycurl.TIMEOUT_MS, max(int(total * 1000), 1))
+        if self.decompress:
+            # libcurl asks for the codings and decodes the reply itself.
+            curl.setopt(pycurl.ENCODING, self.accept_encoding)
+        else:
+            headers = self._encoding_headers(headers)
         curl.setopt(pycurl.HTTPHEADER, ['%s: %s' % (k, v)
-                    for k, v in headers.iteritems()])
+                    for k, v in headers.items()])
         if self._verify_ssl_certs:
             curl.setopt(pycurl.CAINFO, os.path.join(
                 os.path.dirname(__file__), 'data/ca-certificates.crt'))
         else:
             curl.setopt(pycurl.SSL_VERIFYHOST, False)
 
+    @staticmethod
+    def _wire_bytes(curl):
+        """ Body bytes received, before libcurl decoded them. """
         try:
-            curl.perform()
-        except pycurl.error, e:
-            self._handle_request_error(e)
-        rbody = s.getvalue()
-        rcode = curl.getinfo(pycurl.RESPONSE_CODE)
-        return rbody, rcode
+            return int(curl.getinfo(getattr(pycurl, 'SIZE_DOWNLOAD_T',
+                                            pycurl.SIZE_DOWNLOAD)))
+        except pycurl.error:
+            return None
+
+    @staticmethod
+    def _curl_timings(curl):
+        dns = curl.getinfo(pycurl.NAMELOOKUP_TIME)
+        connect = curl.getinfo(pycurl.CONNECT_TIME)
+        first_byte = curl.getinfo(pycurl.STARTTRANSFER_TIME)
+        total = curl.getinfo(pycurl.TOTAL_TIME)
+        return {
+            'dns': dns,
+            'connect': max(connect - dns, 0.0),
+            'server': max(first_byte - connect, 0.0),
+            'download': max(total - first_byte, 0.0),
+        }
+
+    @staticmethod
+    def _parse_header(line, rheaders):
+        line = line.decode('iso-8859-1') if isinstance(line, bytes) else line
+        if line.startswith('HTTP/'):
+            # A new status line, e.g. after a redirect or `100 Continue`.
+            rheaders.clear()
+        elif ':' in line:
+            name, value = line.split(':', 1)
+            rheaders[name.strip().lower()] = value.strip()
 
     def _handle_request_error(self, e):
-        if e[0] in [pycurl.E_COULDNT_CONNECT,
+        if e.args[0] in [pycurl.E_COULDNT_CONNECT,
                     pycurl.E_COULDNT_RESOLVE_HOST,
                     pycurl.E_OPERATION_TIMEOUTED]:
             msg = ("Could not connect to Fluid.  Please check your "
@@ -250,7 +1620,7 @@ class PycurlClient(HTTPClient):
                    "persists, you should check Fluid's service status at "
                    "https://twitter.com/fluidstatus, or let us know at "
                    "support@fluidsurveys.com.")
-        elif (e[0] in [pycurl.E_SSL_CACERT,
+        elif (e.args[0] in [pycurl.E_SSL_CACERT,
                        pycurl.E_SSL_PEER_CERTIFICATE]):
             msg = ("Could not verify Fluid's SSL certificate.  Please make "
                    "sure that your network is not intercepting certificates.  "
@@ -260,38 +1630,94 @@ class PycurlClient(HTTPClient):
             msg = ("Unexpected error communicating with Fluid. If this "
                    "problem persists, let us know at support@fluidsurveys.com.")
 
-        msg = textwrap.fill(msg) + "\n\n(Network error: " + e[1] + ")"
-        raise error.APIConnectionError(msg)
+        msg = textwrap.fill(msg) + "\n\n(Network error: " + e.args[1] + ")"
+        raise exceptions.APIConnectionError(msg)
 
 
 class Urllib2Client(HTTPClient):
+    library = 'urllib2'
     if sys.version_info >= (3, 0):
         name = 'urllib.request'
     else:
         name = 'urllib2'
 
-    def request(self, method, url, headers={}, body=None):
-        if sys.version_info >= (3, 0) and isinstance(body, basestring):
+    def request(self, method, url, headers={}, body=None, timeout=None):
+        started = time.time()
+        response, rcode, rheaders = self._open(method, url, headers, body,
+                                               timeout)
+        self._record_timings(server=time.time() - started)
+        try:
+            rbody = response.read()
+        except (urllib2.URLError, ValueError) as e:
+            self._handle_request_error(e)
+        finally:
+            response.close()
+        self._record_wire_bytes(len(rbody))
+        decoder = _Decoder.for_headers(rheaders)
+        if decoder is not None:
+            try:
+                rbody = decoder.decode(rbody) + decoder.flush()
+            except zlib.error as e:
+                self._handle_request_error(e)
+        return rbody, rcode, rheaders
+
+    def stream(self, method, url, headers={}, body=None, timeout=None):
+        response, rcode, rheaders = self._open(method, url, headers, body,
+                                               timeout)
+        decoder = _Decoder.for_headers(rheaders)
+
+        received = [0]
+
+        def release():
+            self._record_wire_bytes(received[0])
+            response.close()
+
+        def chunks(release):
+            try:
+                while True:
+                    chunk = response.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    received[0] += len(chunk)
+                    if decoder is not None:
+                        chunk = decoder.decode(chunk)
+                        if not chunk:
+                            continue
+                    yield chunk
+                if decoder is not None:
+                    chunk = decoder.flush()
+                    if chunk:
+                        yield chunk
+            except (urllib2.URLError, ValueError, zlib.error) as e:
+                self._handle_request_error(e)
+            finally:
+                release()
+
+        return _streamed(chunks, release), rcode, rheaders
+
+    def _open(self, method, url, headers, body, timeout=None):
+        if sys.version_info >= (3, 0) and isinstance(body, str):
             body = body.encode('utf-8')
 
-        req = urllib2.Request(url, body, headers)
+        req = urllib2.Request(url, body, self._encoding_headers(headers))
 
         if method not in ('get', 'post'):
             req.get_method = lambda: method.upper()
 
         try:
-            response = urllib2.urlopen(req)
-            rbody = response.read()
+            response = urllib2.urlopen(req,
+                                       timeout=self._timeouts(timeout)[1])
             rcode = response.code
-        except urllib2.HTTPError, e:
+        except urllib2.HTTPError as e:
+            # HTTP errors are responses too and can be read like one.
+            response = e
             rcode = e.code
-            rbody = e.read()
-        except (urllib2.URLError, ValueError), e:
+        except (urllib2.URLError, ValueError) as e:
             self._handle_request_error(e)
-        return rbody, rcode
+        return response, rcode, self._lower_headers(response.info().items())
 
     def _handle_request_error(self, e):
         msg = ("Unexpected error communicating with Fluid. "
                "If this problem persists, let us know at support@fluidsurveys.com.")
         msg = textwrap.fill(msg) + "\n\n(Network error: " + str(e) + ")"
-        raise error.APIConnectionError(msg)
+        raise exceptions.APIConnectionError(msg)
@@ -0,0 +1,128 @@
+"""
+Incremental decoding of listing pages.
+
+A listing page is a JSON object whose `results` array holds the records.
+`ResultsStream` reads the page from an iterable of byte chunks and yields
+each record as soon as its closing bracket has arrived, so the page never
+has to be held in memory as a whole, neither as bytes nor decoded. The
+other members of the object (`count`, `next`, ...) are collected in
+`meta`, which is complete once the records have been consumed.
+"""
+import codecs
+import json
+import re
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+# Once this many characters of the buffer have been consumed it is trimmed.
+_TRIM = 1 << 16
+
+
+class _NeedMore(Exception):
+    pass
+
+
+class ResultsStream(object):
+
+    def __init__(self, chunks, key='results'):
+        self.key = key
+        self.meta = {}
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json = json.JSONDecoder()
+        self._buf = u''
+        self._pos = 0
+        self._eof = False
+        self._started = False
+
+    def __iter__(self):
+        try:
+            for record in self._records():
+                yield record
+        finally:
+            self.close()
+
+    def close(self):
+        close = getattr(self._chunks, 'close', None)
+        if close is not None:
+            close()
+
+    def _read(self):
+        """ Append the next chunk to the buffer. False at end of input. """
+        if self._eof:
+            return False
+        if self._pos > _TRIM:
+            self._buf = self._buf[self._pos:]
+            self._pos = 0
+        for chunk in self._chunks:
+            if chunk:
+                self._buf += self._decoder.decode(chunk)
+                return True
+        self._buf += self._decoder.decode(b'', True)
+        self._eof = True
+        return False
+
+    def _peek(self):
+        """ The next significant character, reading as much as needed. """
+        while True:
+            self._pos = _WHITESPACE.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._read():
+                raise ValueError('Unexpected end of JSON input')
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise ValueError('Expecting %r at position %d of the JSON input'
+                             % (char, self._pos))
+        self._pos += 1
+
+    def _value(self):
+        """ Decode the next complete value, reading until it is complete. """
+        self._peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buf, self._pos)
+                # A number ending with the buffer may continue in the next
+                # chunk, so only trust values that end before it.
+                if end == len(self._buf) and not self._eof:
+                    raise _NeedMore()
+            except (ValueError, _NeedMore):
+                if self._read():
+                    continue
+                if self._eof and self._pos < len(self._buf):
+                    value, end = self._json.raw_decode(self._buf, self._pos)
+                else:
+                    raise
+            self._pos = end
+            return value
+
+    def _records(self):
+        if self._peek() != '{':
+            # Not a listing page; keep the whole document.
+            self.meta = self._value()
+            return
+        self._pos += 1
+        if self._peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            name = self._value()
+            self._expect(':')
+            if name == self.key and self._peek() == '[':
+                self._pos += 1
+                if self._peek() == ']':
+                    self._pos += 1
+                else:
+                    while True:
+                        yield self._value()
+                        if self._peek() == ']':
+                            self._pos += 1
+                            break
+                        self._expect(',')
+            else:
+                self.meta[name] = self._value()
+            if self._peek() == '}':
+                self._pos += 1
+                return
+            self._expect(',')
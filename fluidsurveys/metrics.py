@@ -0,0 +1,357 @@
+"""
+Instrumentation of API calls.
+
+An `Instrumentation` attached to `http_client.Client` sees every API call
+as a `RequestEvent`. Hooks registered with `add_hook` run before and after
+each call, and the built-in `LatencyMetrics` keep per endpoint latency
+histograms of the phases of the calls along with status, byte and retry
+counters. The metrics read as a dict with `snapshot` or as Prometheus text
+with `prometheus`.
+
+The phases of a call, in seconds:
+
+- `wait`: held back by the rate limiter or backing off between retries,
+- `dns` and `connect`: name lookup and connection setup, for backends that
+  tell them apart (pycurl); others count them in `server`,
+- `server`: from sending the request to the start of the reply,
+- `download`: reading the body,
+- `decode`: decoding of the body by the client's JSON codec,
+- `total`: the whole call.
+
+Endpoints are urls relative to `api_base` with ids replaced, e.g.
+`surveys/{id}/structure`. A client without instrumentation skips all of it.
+
+`PayloadStats`, set as the `payload_stats` of a manager, measures what
+partial updates save in upload size.
+"""
+import bisect
+import re
+import threading
+import time
+
+from fluidsurveys.compat import urlparse
+
+PHASES = ('wait', 'dns', 'connect', 'server', 'download', 'decode', 'total')
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_ID_SEGMENT = re.compile(r'/(?:\d+|[0-9a-fA-F-]{20,})(?=/|$)')
+
+
+def endpoint_for(url, api_base=''):
+    """ The endpoint a url belongs to, e.g. `surveys/{id}/responses`. """
+    path = urlparse(url).path
+    base = urlparse(api_base).path.rstrip('/')
+    if base and path.startswith(base):
+        path = path[len(base):]
+    return _ID_SEGMENT.sub('/{id}', path).strip('/')
+
+
+class RequestEvent(object):
+    """ One API call, as seen by the hooks.
+
+    `timings` maps the phases of the call to seconds. `retries` is the
+    number of times the call was sent again, `cached` whether the reply
+    came from the response cache, `coalesced` whether it was shared with an
+    identical call in flight, `hedged` whether a second copy of it was sent
+    to cut its latency and `error` the exception the call raised, if any.
+    Hooks may set attributes of their own on the event.
+
+    `bytes_in` and `bytes_out` are the sizes of the encoded bodies before
+    compression, `wire_bytes_in` and `wire_bytes_out` as they travelled,
+    compressed or not; None when the backend can't tell.
+    """
+
+    def __init__(self, method, url, endpoint, bytes_out=0):
+        self.method = method
+        self.url = url
+        self.endpoint = endpoint
+        self.status_code = None
+        self.bytes_out = bytes_out
+        self.bytes_in = 0
+        self.wire_bytes_out = None
+        self.wire_bytes_in = None
+        self.retries = 0
+        self.cached = False
+        self.coalesced = False
+        self.hedged = False
+        self.error = None
+        self.timings = {}
+        self.started = time.time()
+
+    def add_time(self, phase, seconds):
+        self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+
+
+class Histogram(object):
+    """ Counts of observations per bucket, Prometheus style: the count of
+    a bucket is of the values up to its upper bound, and a final bucket
+    catches everything above the last bound. """
+
+    __slots__ = ('buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """ (upper bound, count of values up to it) of every bucket. """
+        total, result = 0, []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q):
+        """ Estimate the `q` quantile, interpolating within its bucket. """
+        if not self.count:
+            return None
+        rank, seen, lower = q * self.count, 0, 0.0
+        for bound, count in zip(self.buckets, self.counts):
+            if count and seen + count >= rank:
+                return lower + (bound - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return self.buckets[-1]
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'buckets': self.cumulative(),
+        }
+
+
+class LatencyMetrics(object):
+    """ Thread-safe per endpoint and method histograms and counters. """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def record(self, event):
+        key = (event.endpoint, event.method)
+        status = 'error' if event.status_code is None else event.status_code
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {
+                    'requests': {},
+                    'retries': 0,
+                    'cached': 0,
+                    'coalesced': 0,
+                    'hedged': 0,
+                    'bytes_in': 0,
+                    'bytes_out': 0,
+                    'wire_bytes_in': 0,
+                    'wire_bytes_out': 0,
+                    'latency': {},
+                }
+            series['requests'][status] = series['requests'].get(status, 0) + 1
+            series['retries'] += event.retries
+            series['cached'] += event.cached
+            series['coalesced'] += event.coalesced
+            series['hedged'] += event.hedged
+            series['bytes_in'] += event.bytes_in
+            series['bytes_out'] += event.bytes_out
+            # Sizes the backend could not measure count as uncompressed.
+            series['wire_bytes_in'] += _first(event.wire_bytes_in,
+                                              event.bytes_in)
+            series['wire_bytes_out'] += _first(event.wire_bytes_out,
+                                               event.bytes_out)
+            latency = series['latency']
+            for phase, seconds in event.timings.items():
+                histogram = latency.get(phase)
+                if histogram is None:
+                    histogram = latency[phase] = Histogram(self.buckets)
+                histogram.observe(seconds)
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def snapshot(self):
+        """ `{endpoint: {method: counters and latency per phase}}`. """
+        result = {}
+        with self._lock:
+            for (endpoint, method), series in self._series.items():
+                entry = dict(series, requests=dict(series['requests']))
+                entry['latency'] = dict(
+                    (phase, histogram.snapshot())
+                    for phase, histogram in series['latency'].items())
+                result.setdefault(endpoint, {})[method] = entry
+        return result
+
+    def prometheus(self, prefix='fluidsurveys'):
+        """ The metrics in the Prometheus text exposition format. """
+        with self._lock:
+            series = sorted(self._series.items())
+            durations = [(labels, phase, histogram.cumulative(),
+                          histogram.sum, histogram.count)
+                         for labels, s in series
+                         for phase, histogram in sorted(s['latency'].items())]
+            counters = [(labels, dict(s, requests=dict(s['requests'])))
+                        for labels, s in series]
+
+        lines = []
+        name = prefix + '_request_duration_seconds'
+        lines.append('# HELP %s Duration of the phases of API calls.' % name)
+        lines.append('# TYPE %s histogram' % name)
+        for (endpoint, method), phase, buckets, total, count in durations:
+            labels = _labels(endpoint=endpoint, method=method, phase=phase)
+            for bound, cumulative in buckets:
+                lines.append('%s_bucket{%s,le="%s"} %d' % (
+                    name, labels, _bound(bound), cumulative))
+            lines.append('%s_sum{%s} %r' % (name, labels, total))
+            lines.append('%s_count{%s} %d' % (name, labels, count))
+
+        name = prefix + '_requests_total'
+        lines.append('# HELP %s API calls by status code.' % name)
+        lines.append('# TYPE %s counter' % name)
+        for (endpoint, method), s in counters:
+            for status, count in sorted(s['requests'].items(),
+                                        key=lambda item: str(item[0])):
+                lines.append('%s{%s} %d' % (name, _labels(
+                    endpoint=endpoint, method=method, status=status), count))
+
+        for field, help in (('retries', 'Retried API calls.'),
+                            ('cached', 'API calls answered from the cache.'),
+                            ('coalesced',
+                             'API calls sharing an identical call\'s reply.'),
+                            ('hedged', 'API calls sent a second time to cut '
+                                       'their latency.'),
+                            ('bytes_in', 'Bytes received.'),
+                            ('bytes_out', 'Bytes sent.'),
+                            ('wire_bytes_in',
+                             'Bytes received, before decompression.'),
+                            ('wire_bytes_out',
+                             'Bytes sent, after compression.')):
+            name = '%s_%s_total' % (prefix, field)
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s counter' % name)
+            for (endpoint, method), s in counters:
+                lines.append('%s{%s} %d' % (name, _labels(
+                    endpoint=endpoint, method=method), s[field]))
+        return '\n'.join(lines) + '\n'
+
+
+class PayloadStats(object):
+    """ Sizes of the updates a manager sends, to weigh partial updates
+    against sending whole objects.
+
+    Counts updates by method and saves `skipped` for lack of changes;
+    `bytes_sent` is the JSON size of the bodies sent and `bytes_full` the
+    size the whole objects would have had.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.updates = {}
+            self.skipped = 0
+            self.bytes_sent = 0
+            self.bytes_full = 0
+
+    def record(self, method, sent, full):
+        with self._lock:
+            self.updates[method] = self.updates.get(method, 0) + 1
+            self.bytes_sent += sent
+            self.bytes_full += full
+
+    def record_skipped(self):
+        with self._lock:
+            self.skipped += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'updates': dict(self.updates),
+                'skipped': self.skipped,
+                'bytes_sent': self.bytes_sent,
+                'bytes_full': self.bytes_full,
+                'bytes_saved': self.bytes_full - self.bytes_sent,
+            }
+
+
+def _first(*values):
+    for value in values:
+        if value is not None:
+            return value
+
+
+def _labels(**labels):
+    return ','.join('%s="%s"' % (key, _escape(value))
+                    for key, value in sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+def _bound(bound):
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+
+class Instrumentation(object):
+    """ Hooks and metrics for the API calls of a client.
+
+    `before` hooks are called with the `RequestEvent` of a call before it
+    is sent, `after` hooks once it completed or failed; both run in the
+    thread making the call. With `metrics` the calls also feed a
+    `LatencyMetrics`.
+    """
+
+    def __init__(self, metrics=True, buckets=DEFAULT_BUCKETS):
+        self.before = []
+        self.after = []
+        self.metrics = LatencyMetrics(buckets) if metrics else None
+
+    def add_hook(self, before=None, after=None):
+        if before is not None:
+            self.before.append(before)
+        if after is not None:
+            self.after.append(after)
+
+    def remove_hook(self, before=None, after=None):
+        if before is not None:
+            self.before.remove(before)
+        if after is not None:
+            self.after.remove(after)
+
+    def start(self, method, url, api_base='', bytes_out=0):
+        event = RequestEvent(method, url, endpoint_for(url, api_base),
+                             bytes_out)
+        for hook in self.before:
+            hook(event)
+        return event
+
+    def finish(self, event):
+        event.timings['total'] = time.time() - event.started
+        if self.metrics is not None:
+            self.metrics.record(event)
+        for hook in self.after:
+            hook(event)
+
+    def snapshot(self):
+        return self.metrics.snapshot() if self.metrics is not None else {}
+
+    def prometheus(self, prefix='fluidsurveys'):
+        if self.metrics is None:
+            return ''
+        return self.metrics.prometheus(prefix)
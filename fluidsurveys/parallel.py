@@ -0,0 +1,157 @@
+"""
+Export of survey responses by several processes.
+
+`ShardedExport` splits the pages of a survey's responses into ranges of
+`pages_per_shard` pages and hands them to a pool of worker processes. Each
+worker fetches the pages of its range, fills an `export.ResponseTable` and
+writes it as a shard file of its own, so that decoding runs on every core
+instead of behind one interpreter lock, and a worker never holds more than
+one shard. The shards are then joined into the target file in page order,
+or left as they are as a partitioned dataset.
+
+Pages are addressed by number through `page_param`: responses created
+while the export runs can shift records across page boundaries. Export a
+fixed range through `params`, such as an end date, when that matters.
+"""
+import math
+import multiprocessing
+import os
+
+import fluidsurveys
+from fluidsurveys import exceptions, export
+from fluidsurveys.compat import urlencode
+from fluidsurveys.http_client import Client
+
+_worker_client = None
+
+
+def _init_worker(access_info):
+    global _worker_client
+    _worker_client = Client(access_info=access_info)
+
+
+def _export_shard(task, client=None):
+    """ Fetch and write one shard; returns its number of records. """
+    from fluidsurveys.resources import Response
+    survey_id, structure, meta_fields, pages, capacity, path, format = task
+    manager = Response.get_manager(client=client or _worker_client,
+                                   survey=survey_id)
+    table = export.ResponseTable.from_structure(
+        structure, meta_fields=meta_fields, capacity=capacity)
+    for page_url in pages:
+        page, status_code = manager.client.stream('GET', page_url)
+        if status_code >= 400:
+            page.close()
+            raise exceptions.APIError('Fluid answered %s to GET %s' % (
+                status_code, page_url), http_status=status_code)
+        table.extend(page)
+    table.write(path, format)
+    return len(table)
+
+
+class ShardedExport(object):
+    """ Exports the responses of surveys of a given `structure`.
+
+    `processes` workers, as many as there are cores by default, export
+    shards of `pages_per_shard` pages each. With `processes=0` the shards
+    are exported one after the other by the calling process, through
+    `client`. Workers build their own `http_client.Client` with the
+    credentials and `api_base` of `client` when the export starts.
+    """
+
+    def __init__(self, structure, meta_fields=('id',), processes=None,
+                 pages_per_shard=20, page_param='page', client=None):
+        self.structure = structure
+        self.meta_fields = tuple(meta_fields)
+        self.processes = processes
+        self.pages_per_shard = pages_per_shard
+        self.page_param = page_param
+        self.client = client
+
+    def shard_path(self, path, index):
+        return '%s.part%05d' % (path, index)
+
+    def run(self, survey_id, path, format='csv', params=None, merge=True):
+        """ Export the responses of a survey to `path`.
+
+        Returns a dict with the number of `rows`, of `pages` and the
+        `shards` left on disk: none once merged into `path`, otherwise
+        the shard files in page order.
+        """
+        from fluidsurveys.resources import Response
+        if format not in ('csv', 'columnar'):
+            raise ValueError('Unknown export format %r' % (format,))
+        manager = Response.get_manager(client=self.client, survey=survey_id)
+        url = manager.build_url()
+
+        # The first page is exported here; it tells how many there are.
+        first_url = url + ('?' + urlencode(params) if params else '')
+        page, status_code = manager.client.request('GET', first_url)
+        if status_code >= 400:
+            raise exceptions.APIError('Fluid answered %s to GET %s' % (
+                status_code, first_url), http_status=status_code,
+                json_body=page)
+        results = (page or {}).get('results') or []
+        pages = 1
+        if page and page.get('next') and results:
+            pages = int(math.ceil(float(page.get('count') or 0) /
+                                  len(results))) or 1
+
+        table = export.ResponseTable.from_structure(
+            self.structure, meta_fields=self.meta_fields,
+            capacity=len(results))
+        table.extend(results)
+        shards = [self.shard_path(path, 0)]
+        table.write(shards[0], format)
+        rows = len(table)
+        del table
+
+        tasks = []
+        for start in range(2, pages + 1, self.pages_per_shard):
+            page_urls = [url + '?' + urlencode(dict(params or {}, **{
+                self.page_param: number})) for number in
+                range(start, min(start + self.pages_per_shard, pages + 1))]
+            shard = self.shard_path(path, len(shards))
+            shards.append(shard)
+            # Every page but the last holds as many records as the first.
+            tasks.append((survey_id, self.structure, self.meta_fields,
+                          page_urls, len(results) * len(page_urls), shard,
+                          format))
+        try:
+            rows += sum(self._map(tasks, manager.client))
+            if merge:
+                merge_shards = (export.merge_csv if format == 'csv'
+                                else export.merge_columnar)
+                merge_shards(shards, path)
+        except BaseException:
+            self._remove(shards)
+            raise
+        if merge:
+            self._remove(shards)
+            shards = []
+        return {'rows': rows, 'pages': pages, 'shards': shards}
+
+    def _map(self, tasks, client):
+        if not tasks:
+            return []
+        if self.processes == 0:
+            return [_export_shard(task, client) for task in tasks]
+        processes = min(self.processes or multiprocessing.cpu_count(),
+                        len(tasks))
+        access = getattr(client, 'access', fluidsurveys.AccessInfo)
+        pool = multiprocessing.Pool(processes, _init_worker, (dict(access),))
+        try:
+            counts = pool.map(_export_shard, tasks, chunksize=1)
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        return counts
+
+    def _remove(self, shards):
+        for shard in shards:
+            if os.path.exists(shard):
+                os.remove(shard)
+
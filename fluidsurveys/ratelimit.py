@@ -0,0 +1,281 @@
+"""
+Client-side rate limiting, adaptive concurrency and retries.
+
+`RateLimiter` paces requests with a token bucket and caps requests in
+flight with a limit that adapts AIMD-style: both the rate and the
+concurrency limit creep up additively while the API keeps answering and
+are cut multiplicatively as soon as it throttles (429, 503), so the client
+settles right below the server's limit. A `Retry-After` from the server
+pauses every request going through the limiter until it has passed.
+
+`RetryPolicy` decides which failed requests are sent again and how long to
+wait before doing so: exponential backoff with full jitter, or the
+server's `Retry-After` when there is one.
+
+`HedgePolicy` decides when a slow GET gets a second copy sent alongside
+it, the first reply of the two being used.
+"""
+import random
+import threading
+import time
+from collections import deque
+
+THROTTLE_STATUSES = frozenset([429, 503])
+
+
+def parse_retry_after(value, now=None):
+    """ Seconds to wait according to a `Retry-After` header, or None. """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    # An HTTP date; email.utils is slow to import and rarely needed.
+    import email.utils
+    parsed = email.utils.parsedate_tz(value)
+    if parsed is None:
+        return None
+    return max(email.utils.mktime_tz(parsed) - (now or time.time()), 0.0)
+
+
+class TokenBucket(object):
+    """ Thread-safe token bucket: `rate` tokens a second, up to `burst`. """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate, 1))
+        self._tokens = self.burst
+        self._stamp = time.time()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds):
+        """ Hand out no tokens for the next `seconds`. """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.time() + seconds)
+            self._tokens = min(self._tokens, 0.0)
+
+    def acquire(self):
+        """ Take a token, sleeping until one is available. """
+        while True:
+            with self._lock:
+                now = time.time()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._tokens = min(
+                        self.burst,
+                        self._tokens + (now - self._stamp) * self.rate)
+                    self._stamp = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class RateLimiter(object):
+    """ Token bucket pacing plus an AIMD concurrency limit.
+
+    `rate` is the starting request rate (requests/second) and may move
+    between `min_rate` and `max_rate`; `concurrency` is the starting
+    number of requests in flight, bounded by `min_concurrency` and
+    `max_concurrency`. A rate of None leaves requests unpaced and only
+    limits concurrency.
+    """
+
+    def __init__(self, rate=None, concurrency=8, min_rate=0.5, max_rate=None,
+                 min_concurrency=1, max_concurrency=64, increase=1.0,
+                 decrease=0.5):
+        self.bucket = TokenBucket(rate) if rate else None
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.limit = float(concurrency)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.increase = increase
+        self.decrease = decrease
+        self.in_flight = 0
+        self.throttled = 0
+        self.completed = 0
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+
+    @property
+    def rate(self):
+        return self.bucket.rate if self.bucket else None
+
+    @property
+    def concurrency(self):
+        return int(self.limit)
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+            wait = self._paused_until - time.time()
+        if wait > 0:
+            time.sleep(wait)
+        if self.bucket is not None:
+            self.bucket.acquire()
+
+    def release(self, status_code=None, retry_after=None):
+        """ Give back a slot and adapt to how the request went.
+
+        `status_code` is None when no reply came back at all.
+        """
+        throttled = status_code in THROTTLE_STATUSES
+        succeeded = not throttled and status_code is not None and \
+            status_code < 500
+        bucket = self.bucket
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.throttled += 1
+                self.limit = max(self.min_concurrency,
+                                 self.limit * self.decrease)
+                if bucket is not None:
+                    bucket.rate = max(self.min_rate,
+                                      bucket.rate * self.decrease)
+            elif succeeded:
+                self.completed += 1
+                # About +increase per round of `limit` requests, and per
+                # second's worth of requests for the rate.
+                self.limit = min(self.max_concurrency,
+                                 self.limit + self.increase / self.limit)
+                if bucket is not None:
+                    rate = bucket.rate + self.increase / max(bucket.rate, 1.0)
+                    if self.max_rate is not None:
+                        rate = min(self.max_rate, rate)
+                    bucket.rate = rate
+            self._cond.notify_all()
+        if retry_after:
+            self.pause(retry_after)
+
+    def pause(self, seconds):
+        """ Hold every request back for the next `seconds`. """
+        with self._cond:
+            self._paused_until = max(self._paused_until,
+                                     time.time() + seconds)
+        if self.bucket is not None:
+            self.bucket.pause(seconds)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'rate': self.rate,
+                'concurrency': int(self.limit),
+                'in_flight': self.in_flight,
+                'throttled': self.throttled,
+                'completed': self.completed,
+            }
+
+
+class RetryPolicy(object):
+    """ Which requests to retry and how long to back off before it.
+
+    Throttled requests (429) were not processed, so they are retried for
+    any method; server errors and connection failures only for idempotent
+    methods.
+    """
+
+    IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'PUT', 'DELETE',
+                                    'OPTIONS'])
+    RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+    def __init__(self, max_retries=3, backoff=0.5, max_backoff=30.0):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def should_retry(self, method, status_code, attempt):
+        """ Whether to send again a request that got `status_code`, or no
+        reply at all when it is None, on its `attempt`-th try (from 0). """
+        if attempt >= self.max_retries:
+            return False
+        if status_code == 429:
+            return True
+        if status_code is None or status_code in self.RETRY_STATUSES:
+            return method.upper() in self.IDEMPOTENT_METHODS
+        return False
+
+    def delay(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        return random.uniform(0, min(self.max_backoff,
+                                     self.backoff * (2 ** attempt)))
+
+
+class HedgePolicy(object):
+    """ When to send a second copy of a GET that is slow to answer.
+
+    A GET still unanswered after the `percentile` of the latencies of the
+    last `window` GETs, kept between `min_delay` and `max_delay` seconds,
+    gets a hedge; none is sent until `min_samples` latencies were seen.
+    At most a `budget` fraction of the GETs are hedged, which bounds the
+    extra load.
+    """
+
+    def __init__(self, percentile=95, window=1000, min_samples=50,
+                 min_delay=0.005, max_delay=None, budget=0.05):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.requests = 0
+        self.hedged = 0
+        self.won = 0
+        self._samples = deque(maxlen=window)
+        self._delay = None
+        self._stale = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        """ Add the latency of a GET that was answered. """
+        with self._lock:
+            self._samples.append(seconds)
+            self._stale += 1
+
+    def delay(self):
+        """ Seconds to wait before hedging a GET being sent, or None to
+        send it without a hedge. """
+        with self._lock:
+            self.requests += 1
+            samples = self._samples
+            if len(samples) < self.min_samples:
+                return None
+            # The percentile is worked out again every few samples only.
+            if self._delay is None or self._stale * 20 >= len(samples):
+                ordered = sorted(samples)
+                index = int(round(self.percentile / 100.0 *
+                                  (len(ordered) - 1)))
+                delay = max(ordered[index], self.min_delay)
+                if self.max_delay is not None:
+                    delay = min(delay, self.max_delay)
+                self._delay, self._stale = delay, 0
+            return self._delay
+
+    def allow(self):
+        """ Take a hedge out of the budget, if there is one left. """
+        with self._lock:
+            if self.hedged + 1 > self.budget * self.requests:
+                return False
+            self.hedged += 1
+            return True
+
+    def record_win(self):
+        """ Count a hedge that was answered before the request it copied. """
+        with self._lock:
+            self.won += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'hedged': self.hedged,
+                'won': self.won,
+                'delay': self._delay,
+            }
@@ -6,6 +6,7 @@ class TemplateManager(base.Manager):
 
 
 class Template(base.Resource):
+	__slots__ = ()
 	manager_class = TemplateManager
 
 
@@ -14,7 +15,61 @@ class ResponseManager(base.Manager):
 	key = 'response'
 	base_url = "/surveys/%(survey)s"
 
+	def sync_to(self, path, **options):
+		""" Incrementally sync this survey's responses into the SQLite
+		database at `path`. See `sync.ResponseSync`. """
+		from fluidsurveys.sync import ResponseSync
+		store = ResponseSync(path, client=self.client, **options)
+		try:
+			return store.sync(self.kwargs['survey'])
+		finally:
+			store.close()
+
+	def import_rows(self, path, structure=None, format=None, columns=None,
+			strict=False, **options):
+		""" Create responses of this survey from the rows of the CSV or
+		NDJSON file at `path`, checked against the survey's `structure`.
+		See `bulk.ResponseImport`. """
+		from fluidsurveys.bulk import ResponseImport, RowMapper
+		if structure is None:
+			structure = self.get_structure()
+		mapper = RowMapper(structure, columns=columns, strict=strict)
+		job = ResponseImport(mapper, client=self.client, **options)
+		return job.run(self.kwargs['survey'], path, format=format)
+
+	def iter_decoded(self, structure=None, params=None, meta_fields=('id',),
+			tuples=False):
+		""" Iterate over the responses of this survey decoded into typed
+		values, as dicts or as tuples in the order of the decoder's
+		`fields`. See `decoder.ResponseDecoder`. """
+		from fluidsurveys.decoder import decoder_for
+		if structure is None:
+			structure = self.get_structure()
+		decoder = decoder_for(self.kwargs['survey'], structure, meta_fields)
+		for page in self.iter_pages(params=params, stream=True):
+			for record in decoder.decode_many(page, tuples=tuples):
+				yield record
+
+	def export_sharded(self, path, structure=None, format='csv',
+			meta_fields=('id',), params=None, merge=True, **options):
+		""" Export the responses of this survey to `path` from several
+		processes, each exporting a range of pages. See
+		`parallel.ShardedExport`. """
+		from fluidsurveys.parallel import ShardedExport
+		if structure is None:
+			structure = self.get_structure()
+		job = ShardedExport(structure, meta_fields=meta_fields,
+			client=self.client, **options)
+		return job.run(self.kwargs['survey'], path, format=format,
+			params=params, merge=merge)
+
+	def get_structure(self):
+		""" The structure of this survey. """
+		return Survey.get_manager(client=self.client).get_structure(
+			Survey({'id': self.kwargs['survey']}))
+
 class Response(base.Resource):
+	__slots__ = ()
 	manager_class = ResponseManager
 
 
@@ -23,7 +78,8 @@ class GroupManager(base.Manager):
 	base_url = "/surveys/%(survey)s"
 
 class Group(base.Resource):
-	manager_class = ResponseManager
+	__slots__ = ()
+	manager_class = GroupManager
 
 class SurveyManager(base.Manager):
 	collection_key = 'surveys'
@@ -34,14 +90,64 @@ class SurveyManager(base.Manager):
 
 
 class Survey(base.Resource):
+	__slots__ = ('_structure',)
 	manager_class = SurveyManager
-	_structure = None
 
 	@property
 	def structure(self):
-	    if not self._structure:
-	    	self._structure = self.manager.get_structure(self)
-	    return self._structure
+		if not getattr(self, '_structure', None):
+			self._structure = self.manager.get_structure(self)
+		return self._structure
+
+	def export_responses(self, path=None, format='csv', meta_fields=('id',),
+			params=None, flush_rows=65536):
+		""" Export the responses of this survey as typed columns.
+
+		Responses are streamed page by page into an `export.ResponseTable`
+		laid out after `structure`. Without a `path` the table is returned.
+		With one, the table is written to it as `csv` or `columnar` every
+		`flush_rows` rows and emptied, so memory holds no more than that
+		many rows, and the number of rows written is returned.
+		"""
+		from fluidsurveys import export
+		table = export.ResponseTable.from_structure(self.structure,
+			meta_fields=meta_fields)
+		manager = Response.get_manager(client=self.manager.client,
+			survey=self.id)
+		writer = None
+		if path is not None:
+			writer = export.TableWriter(table, path, format)
+		sized = False
+		try:
+			for page in manager.iter_pages(params=params, stream=True):
+				table.extend(page)
+				if not sized:
+					# The listing's count is in once its first page is read.
+					sized = True
+					meta = page.meta if isinstance(page.meta, dict) else {}
+					expected = meta.get('count') or 0
+					if writer is not None:
+						expected = min(expected, flush_rows + len(table))
+					table.reserve(expected)
+				if writer is not None and len(table) >= flush_rows:
+					writer.flush()
+		except BaseException:
+			if writer is not None:
+				writer.abort()
+			raise
+		if writer is None:
+			return table
+		return writer.close()
+
+	def export_sharded(self, path, format='csv', meta_fields=('id',),
+			params=None, merge=True, **options):
+		""" Export the responses of this survey to `path` with a pool of
+		worker processes. See `ResponseManager.export_sharded`. """
+		manager = Response.get_manager(client=self.manager.client,
+			survey=self.id)
+		return manager.export_sharded(path, structure=self.structure,
+			format=format, meta_fields=meta_fields, params=params,
+			merge=merge, **options)
 
 	 
 	
@@ -0,0 +1,91 @@
+"""
+Coalescing of concurrent identical calls.
+
+`SingleFlight.do` runs a call unless an identical one, by key, is already
+running on another thread, in which case it waits for that call and
+shares its result or exception. `http_client.Client` runs its GETs through
+one, keyed on url and credentials, so that threads asking for the same
+survey at the same moment send a single request.
+"""
+import threading
+
+from fluidsurveys import deadline, exceptions
+
+
+class _Call(object):
+
+    __slots__ = ('done', 'result', 'error', 'abandoned', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.abandoned = False
+        self.waiters = 0
+
+
+class SingleFlight(object):
+    """ Shares the execution of calls with the same key among the threads
+    that make them concurrently.
+
+    Callers waiting on another thread's call give up after `timeout`
+    seconds, if set, and make the call themselves. They wait no longer
+    than the time left before their own `deadline`, raising
+    `exceptions.DeadlineExceeded` once it passes. Exceptions are shared,
+    except for the `DeadlineExceeded` of the thread that made the call,
+    whose deadline is not theirs, and interruptions other than an
+    `Exception`, such as a `KeyboardInterrupt` on its thread: waiters then
+    start over, one of them making the call for the others.
+    """
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self.shared = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function):
+        """ `(result of function(), whether it was shared)`. """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+                else:
+                    call.waiters += 1
+
+            if leader:
+                try:
+                    call.result = function()
+                except Exception as e:
+                    call.error = e
+                    raise
+                except BaseException:
+                    call.abandoned = True
+                    raise
+                finally:
+                    with self._lock:
+                        del self._calls[key]
+                    call.done.set()
+                return call.result, False
+
+            if not call.done.wait(deadline.timeout(self.timeout)):
+                deadline.check()
+                return function(), False
+            if call.abandoned or isinstance(call.error,
+                                            exceptions.DeadlineExceeded):
+                continue
+            with self._lock:
+                self.shared += 1
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'waiting': sum(c.waiters for c in self._calls.values()),
+                'shared': self.shared,
+            }
@@ -0,0 +1,151 @@
+"""
+Incremental sync of survey responses into a local SQLite database.
+
+`ResponseSync` keeps a high-water mark per survey: the largest value of
+`mark_field` (a modification timestamp or an increasing id) it has stored.
+A sync asks the API only for responses at or past the mark, through the
+`since_param` query parameter, and upserts them in batches. Every page is
+committed together with the url of the page that follows it, so a sync
+interrupted half way resumes from where it stopped instead of starting
+over, and the mark only moves once a sync has run to the end.
+"""
+import json
+import sqlite3
+
+import six
+
+from fluidsurveys import exceptions
+from fluidsurveys.compat import urlencode
+from fluidsurveys.resources import Response
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    survey_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    mark TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (survey_id, id)
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    survey_id TEXT PRIMARY KEY,
+    high_water TEXT,
+    pending_high_water TEXT,
+    cursor TEXT
+);
+"""
+
+
+class ResponseSync(object):
+
+    def __init__(self, path, client=None, mark_field='_updated_at',
+                 since_param='since', batch_size=500):
+        self.client = client
+        self.mark_field = mark_field
+        self.since_param = since_param
+        self.batch_size = batch_size
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def high_water(self, survey_id):
+        state = self._state(survey_id)
+        if state is None or state[0] is None:
+            return None
+        return json.loads(state[0])
+
+    def responses(self, survey_id):
+        """ Iterate over the stored responses of a survey. """
+        rows = self.db.execute(
+            'SELECT data FROM responses WHERE survey_id = ?',
+            (str(survey_id),))
+        for (data,) in rows:
+            yield json.loads(data)
+
+    def sync(self, survey_id):
+        """ Bring the stored responses of a survey up to date.
+
+        Returns a dict with the number of `requests` sent, of `records`
+        received and whether the sync `resumed` an interrupted one.
+        """
+        survey_id = str(survey_id)
+        manager = Response.get_manager(client=self.client, survey=survey_id)
+        high_water, pending, cursor = self._state(survey_id) or (
+            None, None, None)
+        stats = {'requests': 0, 'records': 0, 'resumed': cursor is not None}
+
+        url = cursor
+        if url is None:
+            url = manager.build_url()
+            if high_water is not None and self.since_param:
+                url += '?' + urlencode(
+                    {self.since_param: json.loads(high_water)})
+            pending = high_water
+
+        while url:
+            page, status_code = manager.client.stream('GET', url)
+            stats['requests'] += 1
+            if status_code >= 400:
+                page.close()
+                raise exceptions.APIError('Fluid answered %s to GET %s' % (
+                    status_code, url), http_status=status_code)
+            batch = []
+            for record in page:
+                if not record:
+                    continue
+                pending = self._newer(pending, record.get(self.mark_field))
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    self._upsert(survey_id, batch)
+                    stats['records'] += len(batch)
+                    batch = []
+            self._upsert(survey_id, batch)
+            stats['records'] += len(batch)
+            url = page.meta.get('next') if isinstance(page.meta, dict) else None
+            # The page's records and the position after it land together.
+            self._save_state(survey_id, high_water, pending, url)
+            self.db.commit()
+
+        self._save_state(survey_id, pending, None, None)
+        self.db.commit()
+        return stats
+
+    def _newer(self, current, mark):
+        if mark is None:
+            return current
+        mark = json.dumps(mark)
+        if current is None:
+            return mark
+        return max(current, mark, key=_sort_key)
+
+    def _upsert(self, survey_id, records):
+        if not records:
+            return
+        mark_field = self.mark_field
+        self.db.executemany(
+            'INSERT OR REPLACE INTO responses (survey_id, id, mark, data) '
+            'VALUES (?, ?, ?, ?)',
+            [(survey_id, str(r.get('id')), json.dumps(r.get(mark_field)),
+              json.dumps(r)) for r in records])
+
+    def _state(self, survey_id):
+        """ (high_water, pending_high_water, cursor) of a survey, marks
+        as JSON text, or None if it was never synced. """
+        return self.db.execute(
+            'SELECT high_water, pending_high_water, cursor FROM sync_state '
+            'WHERE survey_id = ?', (str(survey_id),)).fetchone()
+
+    def _save_state(self, survey_id, high_water, pending, cursor):
+        self.db.execute(
+            'INSERT OR REPLACE INTO sync_state '
+            '(survey_id, high_water, pending_high_water, cursor) '
+            'VALUES (?, ?, ?, ?)', (survey_id, high_water, pending, cursor))
+
+
+def _sort_key(mark):
+    value = json.loads(mark)
+    # Numbers compare as numbers, anything else (timestamps) as text.
+    if isinstance(value, (int, float)):
+        return (0, value, '')
+    return (1, 0, six.text_type(value))
@@ -0,0 +1,117 @@
+"""
+Clients of several FluidSurveys accounts in one process.
+
+`ClientRegistry` keeps an `http_client.Client` per tenant, each with the
+tenant's own credentials, `api_base`, connection pool and concurrency
+limit, so that one process can serve many accounts concurrently without
+touching the global `AccessInfo`. Managers and resources take the client
+like any other::
+
+    tenants = ClientRegistry(concurrency=4)
+    client = tenants.client('acme', username='acme', api_key='...')
+    surveys = Survey.list(client=client)
+"""
+import threading
+from collections import OrderedDict
+
+from fluidsurveys import AccessInfo, AccessInfoClass, base
+from fluidsurveys.http_client import Client
+from fluidsurveys.ratelimit import RateLimiter
+
+
+class ClientRegistry(object):
+    """ The clients of tenants, built on first use and cached by tenant.
+
+    Each client gets a `ratelimit.RateLimiter` capping it at `concurrency`
+    requests in flight when that is set, and `client_options` otherwise
+    (cache, retry, pool settings...). With a `transport`, an `HTTPClient`
+    backend, every client sends through it and so shares its connections;
+    by default each opens its own pool.
+
+    Past `max_clients`, the client least recently asked for is closed and
+    dropped, and built again on its tenant's next request: keep it above
+    the number of tenants served at the same time.
+    """
+
+    def __init__(self, max_clients=1024, concurrency=None, transport=None,
+                 **client_options):
+        self.max_clients = max_clients
+        self.concurrency = concurrency
+        self.transport = transport
+        self.client_options = client_options
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._clients)
+
+    def __contains__(self, tenant):
+        return tenant in self._clients
+
+    def client(self, tenant, **access):
+        """ The client of `tenant`.
+
+        `access` holds the tenant's `username`, `api_key` and, unless it
+        is that of the global `AccessInfo`, `api_base`. It may be left out
+        once the tenant has a client; the client is built again when it
+        differs from the one the client has, e.g. after a key rotation.
+        """
+        with self._lock:
+            client = self._clients.pop(tenant, None)
+            if client is not None and access and \
+                    self._access(access) != client.access_info:
+                self._discard(client)
+                client = None
+            if client is None:
+                if not access:
+                    raise KeyError('No credentials for tenant %r' % (tenant,))
+                client = self._build(self._access(access))
+            self._clients[tenant] = client
+            while len(self._clients) > self.max_clients:
+                evicted_tenant, evicted = self._clients.popitem(last=False)
+                self._discard(evicted)
+                self.evicted += 1
+        return client
+
+    def remove(self, tenant):
+        """ Close and forget the client of `tenant`, if it has one. """
+        with self._lock:
+            client = self._clients.pop(tenant, None)
+            if client is not None:
+                self._discard(client)
+
+    def close(self):
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+            for client in clients:
+                self._discard(client)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'clients': len(self._clients),
+                'created': self.created,
+                'evicted': self.evicted,
+            }
+
+    def _access(self, access):
+        info = AccessInfoClass(api_base=AccessInfo['api_base'])
+        info.update(access)
+        return info
+
+    def _build(self, access_info):
+        options = dict(self.client_options)
+        if self.concurrency is not None:
+            options['rate_limiter'] = RateLimiter(
+                concurrency=self.concurrency,
+                max_concurrency=self.concurrency)
+        self.created += 1
+        return Client(access_info=access_info, httpclient=self.transport,
+                      **options)
+
+    def _discard(self, client):
+        client.close()
+        base.forget_client(client)
@@ -0,0 +1,193 @@
+import json
+import unittest
+
+import fluidsurveys
+from fluidsurveys import deadline, exceptions
+from fluidsurveys.resources import Response, Survey, Template
+
+try:
+	import asyncio
+	from fluidsurveys import aio
+except (ImportError, SyntaxError):
+	asyncio = None
+
+
+def _stub_protocol(server):
+	""" asyncio protocol of a tiny keep-alive FluidSurveys stand-in. """
+
+	class StubProtocol(asyncio.Protocol):
+
+		def connection_made(self, transport):
+			self.transport = transport
+			self.buffer = b''
+			server.connections += 1
+
+		def data_received(self, data):
+			self.buffer += data
+			while b'\r\n\r\n' in self.buffer:
+				head, rest = self.buffer.split(b'\r\n\r\n', 1)
+				lines = head.decode('latin-1').split('\r\n')
+				headers = dict(line.lower().split(': ', 1) for line in lines[1:])
+				length = int(headers.get('content-length', 0))
+				if len(rest) < length:
+					return
+				self.buffer = rest[length:]
+				method, path = lines[0].split(' ')[:2]
+				server.requests.append((method, path, headers, rest[:length]))
+				server.in_flight += 1
+				server.max_in_flight = max(server.max_in_flight, server.in_flight)
+				asyncio.get_event_loop().call_later(
+					server.delay, self.respond, method, path, rest[:length])
+
+		def respond(self, method, path, body):
+			server.in_flight -= 1
+			if method == 'HEAD':
+				self.transport.write(b'HTTP/1.1 204 No Content\r\n\r\n')
+				return
+			status = b'200 OK'
+			if path.endswith('/structure/'):
+				data = {'pages': [{'questions': []}]}
+			elif path.startswith('/api/surveys/404/'):
+				status, data = b'404 Not Found', {'detail': 'Not found'}
+			elif path.startswith('/api/surveys/') and path != '/api/surveys/':
+				data = {'id': int(path.split('/')[3]), 'name': 'survey'}
+			elif method == 'POST':
+				data = dict(kv.split('=') for kv in body.decode('utf-8').split('&'))
+			else:
+				data = {'results': [{'id': 1}, {'id': 2}], 'next': None}
+			payload = json.dumps(data).encode('utf-8')
+			self.transport.write(
+				b'HTTP/1.1 ' + status + b'\r\nContent-Type: application/json\r\n'
+				b'Content-Length: ' + str(len(payload)).encode('ascii') +
+				b'\r\n\r\n' + payload)
+
+	return StubProtocol
+
+
+@unittest.skipIf(asyncio is None, 'asyncio requires Python 3')
+class TestAsyncManager(unittest.TestCase):
+
+	def setUp(self):
+		self.loop = asyncio.new_event_loop()
+		self.connections = 0
+		self.requests = []
+		self.in_flight = self.max_in_flight = 0
+		self.delay = 0
+		self.server = self.loop.run_until_complete(
+			self.loop.create_server(_stub_protocol(self), '127.0.0.1', 0))
+		port = self.server.sockets[0].getsockname()[1]
+		self.old_base = fluidsurveys.AccessInfo['api_base']
+		fluidsurveys.AccessInfo(api_base='http://127.0.0.1:%d/api/' % port)
+		self.client = aio.AsyncClient(max_concurrency=3)
+
+	def tearDown(self):
+		fluidsurveys.AccessInfo(api_base=self.old_base)
+		self.loop.run_until_complete(self.client.close())
+		self.server.close()
+		self.loop.run_until_complete(self.server.wait_closed())
+		self.loop.close()
+
+	def wait(self, coro):
+		return self.loop.run_until_complete(coro)
+
+	def test_get_and_structure(self):
+		surveys = aio.manager_for(Survey, client=self.client)
+		survey = self.wait(surveys.get(5))
+		self.assertIsInstance(survey, Survey)
+		self.assertEqual(survey.id, 5)
+		structure = self.wait(surveys.get_structure(survey))
+		self.assertEqual(structure, {'pages': [{'questions': []}]})
+		self.assertEqual(self.connections, 1)
+
+	def test_list_and_create(self):
+		templates = aio.manager_for(Template, client=self.client)
+		self.assertEqual([t.id for t in self.wait(templates.list())], [1, 2])
+		created = self.wait(templates.create({'name': 'new'}))
+		self.assertEqual(created.name, 'new')
+		self.assertEqual(self.requests[-1][:2], ('POST', '/api/templates/'))
+
+	def test_iter(self):
+		surveys = aio.manager_for(Survey, client=self.client).iter()
+		first = self.wait(surveys.__anext__())
+		second = self.wait(surveys.__anext__())
+		self.assertEqual((first.id, second.id), (1, 2))
+
+	def test_get_many_head_and_find(self):
+		surveys = aio.manager_for(Survey, client=self.client)
+		found, errors = self.wait(surveys.get_many([3, 404, 1]))
+		self.assertEqual([s.id for s in found], [3, 1])
+		self.assertIsInstance(errors[404], exceptions.NotFound)
+		found, errors = self.wait(surveys.get_many([2, 5], ordered=False))
+		self.assertEqual(sorted(s.id for s in found), [2, 5])
+		self.assertTrue(self.wait(surveys.head(3)))
+
+		templates = aio.manager_for(Template, client=self.client)
+		pages = templates.iter_pages()
+		self.assertEqual(self.wait(pages.__anext__()), [{'id': 1}, {'id': 2}])
+		self.assertEqual([t.id for t in self.wait(templates.findall(id=2))],
+			[2])
+		self.assertEqual(self.wait(templates.find(id=1)).id, 1)
+		self.assertRaises(exceptions.NotFound, self.wait,
+			templates.find(id=3))
+		self.assertRaises(TypeError, templates.build_index, 'id')
+
+	def test_response_manager(self):
+		responses = aio.manager_for(Response, client=self.client, survey=5)
+		self.assertEqual(self.wait(responses.get_structure()),
+			{'pages': [{'questions': []}]})
+		self.assertEqual(self.requests[-1][:2],
+			('GET', '/api/surveys/5/structure/'))
+		self.assertRaises(TypeError, responses.sync_to, 'responses.db')
+		self.assertRaises(TypeError, responses.export_sharded, 'export.csv')
+
+	def test_concurrency_limit(self):
+		self.delay = 0.02
+		surveys = aio.manager_for(Survey, client=self.client)
+		tasks = [self.loop.create_task(surveys.get(i)) for i in range(1, 13)]
+		results = self.wait(asyncio.gather(*tasks))
+		self.assertEqual([s.id for s in results], list(range(1, 13)))
+		self.assertEqual(self.max_in_flight, 3)
+		self.assertEqual(self.connections, 3)
+
+	def test_coalesces_identical_gets(self):
+		self.delay = 0.02
+		surveys = aio.manager_for(Survey, client=self.client)
+		tasks = [self.loop.create_task(surveys.get(7)) for _ in range(5)]
+		self.loop.call_later(0.005, tasks[0].cancel)
+		results = self.wait(asyncio.gather(*tasks, return_exceptions=True))
+		self.assertIsInstance(results[0], asyncio.CancelledError)
+		self.assertEqual([s.id for s in results[1:]], [7] * 4)
+		self.assertEqual(len(self.requests), 1)
+		self.assertEqual(self.client.shared, 4)
+		self.wait(surveys.get(7))
+		self.assertEqual(len(self.requests), 2)
+
+	@unittest.skipIf(deadline.contextvars is None,
+		'tasks carry deadlines on Python 3.7+')
+	def test_shared_gets_keep_each_callers_deadline(self):
+		self.delay = 0.1
+		surveys = aio.manager_for(Survey, client=self.client)
+		started = self.loop.time()
+		finished = []
+
+		def get(seconds):
+			with deadline.within(seconds):
+				task = self.loop.create_task(surveys.get(7))
+			task.add_done_callback(
+				lambda task: finished.append(self.loop.time() - started))
+			return task
+		survey, error = self.wait(asyncio.gather(get(60), get(0.03),
+			return_exceptions=True))
+		self.assertEqual(survey.id, 7)
+		self.assertIsInstance(error, exceptions.DeadlineExceeded)
+		self.assertTrue(finished[0] < 0.08)
+		self.assertEqual(len(self.requests), 1)
+
+		started = self.loop.time()
+		finished[:] = []
+		error, survey = self.wait(asyncio.gather(get(0.03), get(60),
+			return_exceptions=True))
+		self.assertIsInstance(error, exceptions.DeadlineExceeded)
+		self.assertTrue(finished[0] < 0.08)
+		self.assertEqual(survey.id, 7)
+		self.assertEqual(len(self.requests), 3)
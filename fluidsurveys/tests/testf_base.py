@@ -0,0 +1,297 @@
+import pickle
+import threading
+import time
+import unittest
+
+from mock import Mock
+
+from fluidsurveys import base, exceptions, http_client, metrics
+from fluidsurveys.jsonstream import ResultsStream
+from fluidsurveys.resources import Response, Survey, SurveyManager
+
+
+def _paged_client(pages):
+	""" Fake client serving `pages` (lists of results) linked by `next`. """
+	def request(method, url, body=None):
+		index = int(url.rsplit('page=', 1)[1]) if 'page=' in url else 0
+		next_url = None
+		if index + 1 < len(pages):
+			next_url = 'http://api.test/surveys/?page=%d' % (index + 1)
+		return {'results': pages[index], 'next': next_url}, 200
+	client = Mock()
+	client.request.side_effect = request
+	return client
+
+
+class TestIter(unittest.TestCase):
+
+	def test_follows_next_links(self):
+		client = _paged_client([[{'id': 1}, {'id': 2}], [{'id': 3}], [{'id': 4}]])
+		manager = base.Manager(Survey, client=client)
+		surveys = manager.iter()
+		self.assertEqual(client.request.call_count, 0)
+		self.assertEqual([s.id for s in surveys], [1, 2, 3, 4])
+		self.assertEqual(client.request.call_count, 3)
+
+	def test_is_lazy(self):
+		client = _paged_client([[{'id': 1}], [{'id': 2}], [{'id': 3}]])
+		surveys = base.Manager(Survey, client=client).iter()
+		self.assertEqual(next(surveys).id, 1)
+		self.assertEqual(client.request.call_count, 1)
+
+	def test_prefetch(self):
+		pages = [[{'id': i}] for i in range(10)]
+		client = _paged_client(pages)
+		manager = base.Manager(Survey, client=client)
+		ids = [s.id for s in manager.iter(prefetch=True, max_pages=3)]
+		self.assertEqual(ids, list(range(10)))
+
+	def test_stream(self):
+		pages = {
+			'/surveys': b'{"results": [{"id": 1}, {"id": 2}], "next": "http://api/surveys/?page=2"}',
+			'http://api/surveys/?page=2': b'{"next": null, "results": [{"id": 3}]}',
+		}
+		client = Mock()
+		client.stream.side_effect = lambda method, url, body=None: (
+			ResultsStream([pages[url]]), 200)
+		manager = base.Manager(Survey, client=client)
+		manager.collection_key = 'surveys'
+		self.assertEqual([s.id for s in manager.iter(stream=True)], [1, 2, 3])
+		self.assertRaises(ValueError, next, manager.iter(stream=True, prefetch=True))
+
+	def test_prefetch_reraises_errors(self):
+		client = Mock()
+		client.request.side_effect = IOError('boom')
+		manager = base.Manager(Survey, client=client)
+		self.assertRaises(IOError, list, manager.iter(prefetch=True))
+
+	def test_prefetched_is_bounded(self):
+		produced = []
+		release = threading.Event()
+
+		def source():
+			for i in range(100):
+				produced.append(i)
+				yield i
+
+		items = base.prefetched(source(), max_items=3)
+		self.assertEqual(next(items), 0)
+		release.wait(0.3)
+		self.assertTrue(len(produced) <= 5)
+		items.close()
+
+	def test_iter_all_passes_manager_kwargs(self):
+		client = _paged_client([[{'id': 7}]])
+		responses = list(Response.iter_all(survey=3, client=client))
+		self.assertEqual(responses[0].id, 7)
+		self.assertEqual(responses[0].manager.base_url, '/surveys/3')
+		self.assertEqual(client.request.call_args[0][1], '/surveys/3/responses')
+
+
+class TestGetMany(unittest.TestCase):
+
+	def setUp(self):
+		self.in_flight = self.max_in_flight = 0
+		self.lock = threading.Lock()
+
+	def request(self, method, url, body=None):
+		entity_id = int(url.rsplit('/', 1)[1])
+		with self.lock:
+			self.in_flight += 1
+			self.max_in_flight = max(self.max_in_flight, self.in_flight)
+		time.sleep(0.01 * (entity_id % 3))
+		with self.lock:
+			self.in_flight -= 1
+		if entity_id == 13:
+			raise IOError('unlucky')
+		if entity_id == 17:
+			return {'detail': 'Not found.'}, 404
+		return {'id': entity_id}, 200
+
+	def test_results_in_input_order(self):
+		client = Mock()
+		client.can_send_many.return_value = False
+		client.request.side_effect = self.request
+		manager = base.Manager(Survey, client=client)
+		ids = list(range(20))
+		surveys, errors = manager.get_many(ids, max_workers=4)
+		self.assertEqual([s.id for s in surveys],
+			[i for i in ids if i not in (13, 17)])
+		self.assertEqual(sorted(errors), [13, 17])
+		self.assertIsInstance(errors[13], IOError)
+		self.assertIsInstance(errors[17], exceptions.NotFound)
+		self.assertRaises(exceptions.NotFound, manager.get, 17)
+		self.assertEqual(self.max_in_flight, 4)
+
+	def test_as_completed(self):
+		client = Mock()
+		client.can_send_many.return_value = False
+		client.request.side_effect = self.request
+		surveys, errors = Survey.retreive_many([2, 1, 0], client=client,
+			ordered=False)
+		self.assertEqual(sorted(s.id for s in surveys), [0, 1, 2])
+		self.assertEqual(errors, {})
+
+	def test_multiplexed(self):
+		client = Mock()
+		client.can_send_many.return_value = True
+		error = IOError('unlucky')
+		client.request_many.return_value = [({'id': 1}, 200), error,
+			({'detail': 'Not found.'}, 404), ({'detail': 'Oops.'}, 500)]
+		manager = base.Manager(Survey, client=client)
+		surveys, errors = manager.get_many([1, 2, 3, 4])
+		self.assertEqual([s.id for s in surveys], [1])
+		self.assertIs(errors[2], error)
+		self.assertIsInstance(errors[3], exceptions.NotFound)
+		self.assertEqual(errors[4].http_status, 500)
+		self.assertFalse(client.request.called)
+		urls = client.request_many.call_args[0][1]
+		self.assertEqual(urls, [manager.build_url(i) for i in range(1, 5)])
+
+
+class TestFind(unittest.TestCase):
+
+	def setUp(self):
+		self.client = _paged_client([
+			[{'id': 1, 'name': 'a', 'status': 'live'}, {'id': 2, 'name': 'b', 'status': 'live'}],
+			[{'id': 3, 'name': 'c', 'status': 'draft'}]])
+		self.manager = Survey.manager_class(Survey, client=self.client)
+
+	def test_find_scans_listing(self):
+		self.assertEqual(self.manager.find(name='c').id, 3)
+		self.assertRaises(exceptions.NotFound, self.manager.find, name='z')
+		self.assertRaises(exceptions.NoUniqueMatch, self.manager.find, status='live')
+
+	def test_filter_fields_become_query_parameters(self):
+		self.manager.filter_fields = ('status',)
+		self.manager.findall(status='draft', name='c')
+		url = self.client.request.call_args_list[0][0][1]
+		self.assertEqual(url, '/surveys?status=draft')
+
+	def test_index_lookups_skip_listing(self):
+		self.manager.build_index('name', 'status')
+		calls = self.client.request.call_count
+		self.assertEqual(self.manager.find(name='b').id, 2)
+		self.assertEqual([s.id for s in self.manager.findall(status='live', name='a')], [1])
+		self.assertEqual(self.manager.findall(status='gone'), [])
+		self.assertEqual(self.client.request.call_count, calls)
+
+	def test_index_follows_writes(self):
+		self.manager.build_index('name')
+		self.client.request.side_effect = None
+		self.client.request.return_value = ({'id': 2, 'name': 'renamed'}, 200)
+		self.manager.update(self.manager.find(name='b'))
+		self.assertEqual(self.manager.find(name='renamed').id, 2)
+		self.assertEqual(self.manager.findall(name='b'), [])
+		self.manager.delete(2)
+		self.assertEqual(self.manager.findall(name='renamed'), [])
+
+	def test_index_discard_removes_only_that_id(self):
+		surveys = [Survey({'id': i, 'name': 'n%d' % (i % 2), 'tags': []})
+			for i in range(4)]
+		index = base.ResourceIndex(('name', 'tags'), surveys)
+		index.discard(2)
+		index.discard(7)
+		self.assertEqual([s.id for s in index.lookup(name='n0')], [0])
+		self.assertEqual([s.id for s in index.lookup(name='n1')], [1, 3])
+		index.discard(0)
+		self.assertEqual(index.lookup(name='n0'), [])
+		self.assertEqual(index._maps['name'], {'n1': surveys[1::2]})
+
+
+class TestResource(unittest.TestCase):
+
+	def test_fields(self):
+		survey = Survey({'id': 1, 'name': 'a'})
+		self.assertFalse(hasattr(survey, '__dict__'))
+		survey.name = 'b'
+		survey.status = 'live'
+		survey._add_details({'name': 'c', 'id': 1})
+		self.assertEqual(survey.to_dict(), {'id': 1, 'name': 'c', 'status': 'live'})
+		self.assertEqual(survey._layout.keys.count('name'), 1)
+		self.assertRaises(AttributeError, getattr, survey, 'missing')
+		del survey.status
+		self.assertFalse(hasattr(survey, 'status'))
+
+	def test_layouts_are_shared(self):
+		first = Survey({'id': 1, 'name': 'a'})
+		second = Survey({'id': 2, 'name': 'b'})
+		self.assertIs(first._layout, second._layout)
+		first.extra = second.extra = True
+		self.assertIs(first._layout, second._layout)
+
+	def test_managers_are_shared(self):
+		self.assertIs(Survey({'id': 1}).manager, Survey({'id': 2}).manager)
+		self.assertIs(Response(survey=1).manager, Response(survey=1).manager)
+		self.assertIsNot(Response(survey=1).manager, Response(survey=2).manager)
+
+	def test_clone_and_pickle(self):
+		response = Response({'id': 3, 'answer': 'x'}, loaded=True, survey=9)
+		clone = response.clone(answer='y')
+		self.assertEqual(clone.to_dict(), {'id': 3, 'answer': 'y'})
+		self.assertIs(clone.manager, response.manager)
+		restored = pickle.loads(pickle.dumps(response))
+		self.assertEqual(restored.to_dict(), response.to_dict())
+		self.assertIs(restored.manager, response.manager)
+		self.assertEqual(restored, response)
+
+	def test_save_sends_changed_fields(self):
+		client = Mock()
+		client.request.return_value = ({'id': 1, 'name': 'b', 'rev': 2}, 200)
+		manager = SurveyManager(Survey, client=client)
+		manager.payload_stats = metrics.PayloadStats()
+		survey = manager.wrap({'id': 1, 'name': 'a', 'questions': [1, 2]})
+		survey.name = 'a'
+		survey.save()
+		self.assertEqual(client.request.call_count, 0)
+
+		survey.name = 'b'
+		self.assertEqual(survey.dirty_fields(), frozenset(['name']))
+		survey.save()
+		client.request.assert_called_once_with('PATCH', '/surveys/1',
+			body={'name': 'b'})
+		self.assertFalse(survey.is_dirty())
+		self.assertEqual(survey.rev, 2)
+
+		survey.questions.append(3)
+		survey.questions = survey.questions
+		survey.save(merge=False)
+		self.assertEqual(client.request.call_args[1]['body'],
+			{'questions': [1, 2, 3]})
+		stats = manager.payload_stats.snapshot()
+		self.assertEqual((stats['updates'], stats['skipped']), ({'PATCH': 2}, 1))
+		self.assertTrue(0 < stats['bytes_sent'] < stats['bytes_full'])
+
+	def test_save_falls_back_to_put(self):
+		client = Mock()
+		client.request.side_effect = [(None, 405), ({'id': 1}, 200),
+			({'id': 1}, 200), ({'id': 1}, 200)]
+		manager = SurveyManager(Survey, client=client)
+		survey = manager.wrap({'id': 1, 'name': 'a', 'status': 'live'})
+		survey.name = 'b'
+		survey.save()
+		self.assertEqual([c[0][0] for c in client.request.call_args_list],
+			['PATCH', 'PUT'])
+		self.assertFalse(manager.supports_patch)
+		del survey.status
+		survey.save()
+		self.assertEqual(client.request.call_args,
+			(('PUT', '/surveys/1'), {'body': {'id': 1, 'name': 'b'}}))
+		unloaded = Survey({'id': 1, 'name': 'c'}, manager=manager)
+		unloaded.save()
+		self.assertEqual(client.request.call_args[1]['body'],
+			{'id': 1, 'name': 'c'})
+
+	def test_not_implemented_patch_falls_back_to_put(self):
+		transport = Mock()
+		transport.request.side_effect = [(b'', 501, {}),
+			(b'{"id": 1, "name": "b"}', 200, {})]
+		client = http_client.Client(httpclient=transport, coalesce=False)
+		manager = SurveyManager(Survey, client=client)
+		survey = manager.wrap({'id': 1, 'name': 'a'})
+		survey.name = 'b'
+		survey.save()
+		self.assertEqual([c[0][0] for c in transport.request.call_args_list],
+			['PATCH', 'PUT'])
+		self.assertFalse(manager.supports_patch)
+		self.assertEqual(survey.name, 'b')
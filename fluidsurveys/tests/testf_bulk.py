@@ -0,0 +1,170 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from mock import Mock
+
+from fluidsurveys import http_client
+from fluidsurveys.bulk import ResponseImport, RowMapper, iter_rows
+from fluidsurveys.resources import Response
+
+STRUCTURE = {'pages': [{'id': 'page1', 'children': [
+	{'id': 'q1', 'question_type': 'number', 'title': 'Age'},
+	{'id': 'q2', 'question_type': 'single-choice', 'title': 'Colour',
+		'choices': [{'label': 'Red', 'code': 'r'},
+			{'label': 'Blue', 'code': 'b'}]},
+	{'id': 'q3', 'question_type': 'multiple-choice', 'title': 'Pets',
+		'choices': [{'label': 'Cat', 'code': 'c'},
+			{'label': 'Dog', 'code': 'd'}]},
+	{'id': 'q4', 'question_type': 'text', 'title': 'Comment'},
+]}]}
+
+
+class TestRowMapper(unittest.TestCase):
+
+	def setUp(self):
+		self.mapper = RowMapper(STRUCTURE)
+
+	def test_maps_columns_by_id_and_title(self):
+		body = self.mapper.map({'id': '7', 'q1': '42', 'colour': 'Blue',
+			'Pets': 'Cat; d', 'Comment': 'hi', '_language': 'en',
+			'other': 'x', 'q4': ''})
+		self.assertEqual(body, {'q1': 42, 'q2': 'b', 'q3': ['c', 'd'],
+			'_language': 'en', 'q4': 'hi'})
+
+	def test_rejects_invalid_values(self):
+		self.assertRaises(ValueError, self.mapper.map, {'q1': 'old'})
+		self.assertRaises(ValueError, self.mapper.map, {'q2': 'Green'})
+		self.assertRaises(ValueError, self.mapper.map, ['q1'])
+		strict = RowMapper(STRUCTURE, strict=True)
+		self.assertRaises(ValueError, strict.map, {'other': 'x'})
+		mapped = RowMapper(STRUCTURE, columns={'years': 'q1'})
+		self.assertEqual(mapped.map({'years': '2.5'}), {'q1': 2.5})
+
+
+class TestResponseImport(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.checkpoint = os.path.join(self.tmp, 'import.checkpoint')
+		self.errors = os.path.join(self.tmp, 'import.errors')
+		self.posted = []
+		self.client = Mock()
+		self.client.request.side_effect = self.post
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+
+	def post(self, method, url, json=None):
+		record = json
+		self.posted.append(record)
+		if record.get('q4') == 'refused':
+			return {'detail': 'refused'}, 400
+		return dict(record, id=len(self.posted)), 201
+
+	def write(self, name, text):
+		path = os.path.join(self.tmp, name)
+		with io.open(path, 'w', encoding='utf-8') as f:
+			f.write(text)
+		return path
+
+	def importer(self, **options):
+		return ResponseImport(RowMapper(STRUCTURE), client=self.client,
+			checkpoint=self.checkpoint, errors=self.errors, **options)
+
+	def test_iter_rows(self):
+		path = self.write('rows.csv', u'q1,Comment\n1,caf\xe9\n2,\n')
+		self.assertEqual(list(iter_rows(path)), [
+			(1, {'q1': '1', 'Comment': u'caf\xe9'}),
+			(2, {'q1': '2', 'Comment': ''})])
+		self.assertRaises(ValueError, iter_rows, 'rows.xls')
+
+	def test_rejects_rows_longer_than_the_header(self):
+		path = self.write('rows.csv', u'q1,Comment\n1,a,extra\n2,b,\n3,c\n')
+		stats = self.importer().run(5, path)
+		self.assertEqual((stats['imported'], stats['rejected']), (2, 1))
+		with open(self.errors) as f:
+			errors = [json.loads(line) for line in f]
+		self.assertEqual([e['row'] for e in errors], [1])
+		self.assertIn('1 extra cells', errors[0]['error'])
+
+	def test_import_writes_errors_and_checkpoint(self):
+		path = self.write('rows.ndjson', u'\n'.join([
+			'{"q1": 1}', '{"q1": "old"}', '', 'not json',
+			'{"q4": "refused"}', '{"q2": "Red"}']) + u'\n')
+		stats = self.importer(max_in_flight=3).run(5, path)
+		self.assertEqual((stats['imported'], stats['rejected']), (2, 3))
+		self.assertEqual(self.client.request.call_args[0][1],
+			'/surveys/5/responses')
+		self.client.invalidate.assert_called_once_with('/surveys/5/responses')
+		with open(self.errors) as f:
+			errors = [json.loads(line) for line in f]
+		self.assertEqual(sorted(e['row'] for e in errors), [2, 4, 5])
+		with open(self.checkpoint) as f:
+			checkpoint = json.load(f)
+		self.assertEqual(checkpoint['rows_done'], 6)
+		self.assertTrue(checkpoint['complete'])
+
+	def test_resumes_from_checkpoint(self):
+		path = self.write('rows.ndjson', u''.join('{"q1": %d}\n' % i
+			for i in range(1, 11)))
+		mapper = RowMapper(STRUCTURE)
+		mapper.map = Mock(side_effect=lambda record: {'q1': record['q1']}
+			if record['q1'] != 7 else self.fail('interrupted'))
+		job = ResponseImport(mapper, client=self.client,
+			checkpoint=self.checkpoint, max_in_flight=3, checkpoint_every=2)
+		self.assertRaises(AssertionError, job.run, 1, path)
+		with open(self.checkpoint) as f:
+			self.assertEqual(json.load(f)['rows_done'], 6)
+
+		self.client.request.side_effect = self.post
+		self.posted = []
+		stats = self.importer(max_in_flight=1).run(1, path)
+		self.assertEqual(stats['skipped'], 6)
+		self.assertEqual([r['q1'] for r in self.posted], list(range(7, 11)))
+
+	def test_bounded_in_flight(self):
+		path = self.write('rows.ndjson', u'{"q1": 1}\n' * 40)
+		lock = threading.Lock()
+		active = [0, 0]
+
+		def slow(method, url, json=None):
+			with lock:
+				active[0] += 1
+				active[1] = max(active)
+			time.sleep(0.002)
+			with lock:
+				active[0] -= 1
+			return {}, 201
+		self.client.request.side_effect = slow
+		stats = self.importer(max_in_flight=4).run(1, path)
+		self.assertEqual(stats['imported'], 40)
+		self.assertTrue(1 < active[1] <= 4)
+
+	def test_manager_import_rows(self):
+		path = self.write('rows.csv', u'Age,Colour\n30,Red\n')
+		self.client.request.side_effect = lambda method, url, body=None, \
+				json=None: (
+			(STRUCTURE, 200) if method == 'GET' else ({}, 201))
+		manager = Response.get_manager(client=self.client, survey='3')
+		stats = manager.import_rows(path)
+		self.assertEqual(stats['imported'], 1)
+		self.assertEqual(self.client.request.call_args[1]['json'],
+			{'q1': 30, 'q2': 'r'})
+
+	def test_posts_json(self):
+		path = self.write('rows.ndjson', u'{"q1": 3}\n')
+		transport = Mock()
+		transport.request.return_value = (b'{"id": 1}', 201, {})
+		client = http_client.Client(httpclient=transport, coalesce=False)
+		stats = ResponseImport(RowMapper(STRUCTURE), client=client).run(2, path)
+		self.assertEqual(stats['imported'], 1)
+		method, url, headers, body = transport.request.call_args[0]
+		self.assertEqual(method, 'POST')
+		self.assertEqual(headers['Content-Type'], 'application/json')
+		self.assertEqual(json.loads(body.decode('utf-8')), {'q1': 3})
@@ -0,0 +1,85 @@
+import json
+import time
+import unittest
+
+from mock import Mock
+
+from fluidsurveys import http_client
+from fluidsurveys.cache import LRUCache
+from fluidsurveys.resources import Survey
+
+
+class TestLRUCache(unittest.TestCase):
+
+	def test_evicts_least_recently_used(self):
+		cache = LRUCache(max_entries=2)
+		cache.set(('a', None), 1)
+		cache.set(('b', None), 2)
+		cache.get(('a', None))
+		cache.set(('c', None), 3)
+		self.assertIsNone(cache.get(('b', None)))
+		self.assertEqual(cache.get(('a', None)).body, 1)
+		self.assertEqual(cache.stats()['evictions'], 1)
+
+	def test_evicts_by_size(self):
+		cache = LRUCache(max_bytes=100)
+		cache.set(('a', None), 1, size=60)
+		cache.set(('b', None), 2, size=60)
+		self.assertEqual(len(cache), 1)
+		self.assertEqual(cache.stats()['bytes'], 60)
+
+	def test_expired_entries_without_validators_are_dropped(self):
+		cache = LRUCache(ttl=0)
+		cache.set(('a', None), 1)
+		cache.set(('b', None), 2, etag='"v1"')
+		time.sleep(0.01)
+		self.assertIsNone(cache.get(('a', None)))
+		entry = cache.get(('b', None))
+		self.assertFalse(entry.is_fresh())
+		self.assertEqual(entry.conditional_headers(), {'If-None-Match': '"v1"'})
+
+	def test_invalidate_prefix(self):
+		cache = LRUCache()
+		cache.set(('http://api/surveys/1/', None), 1)
+		cache.set(('http://api/surveys/1/structure/', None), 2)
+		cache.set(('http://api/templates/', None), 3)
+		cache.invalidate('http://api/surveys/')
+		self.assertEqual(len(cache), 1)
+
+
+class TestCachingClient(unittest.TestCase):
+
+	def setUp(self):
+		self.client = http_client.Client(cache=LRUCache(ttl=60))
+		self.client.httpclient = Mock()
+		self.payload = json.dumps({'id': 1, 'name': 'survey'}).encode('utf-8')
+		self.client.httpclient.request.return_value = (
+			self.payload, 200, {'etag': '"v1"'})
+
+	def test_fresh_hits_skip_the_network(self):
+		first, _ = self.client.request('GET', '/surveys/1')
+		second, status_code = self.client.request('GET', '/surveys/1')
+		self.assertIs(first, second)
+		self.assertEqual(status_code, 200)
+		self.assertEqual(self.client.httpclient.request.call_count, 1)
+		self.assertEqual(self.client.cache.stats()['hits'], 1)
+
+	def test_not_modified_reuses_cached_body(self):
+		self.client.cache.ttl = 0
+		first, _ = self.client.request('GET', '/surveys/1')
+		time.sleep(0.01)
+		self.client.httpclient.request.return_value = (b'', 304, {})
+		second, status_code = self.client.request('GET', '/surveys/1')
+		self.assertIs(first, second)
+		self.assertEqual(status_code, 200)
+		headers = self.client.httpclient.request.call_args[0][2]
+		self.assertEqual(headers['If-None-Match'], '"v1"')
+		self.assertEqual(self.client.cache.stats()['revalidations'], 1)
+
+	def test_manager_update_invalidates(self):
+		manager = Survey.manager_class(Survey, client=self.client)
+		survey = manager.get(1)
+		manager.update(survey)
+		self.assertEqual(len(self.client.cache), 0)
+		manager.get(1)
+		self.assertEqual(self.client.httpclient.request.call_count, 3)
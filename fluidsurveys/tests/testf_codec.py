@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+
+from mock import Mock, patch
+
+import fluidsurveys
+from fluidsurveys import codec, http_client
+
+
+class TestCodec(unittest.TestCase):
+
+	def test_codecs_round_trip_bytes(self):
+		self.assertEqual(codec.available_codecs()[-1], 'json')
+		value = {'name': u'caf\xe9', 'count': 3, 'items': [1.5, None, True]}
+		for name in codec.available_codecs():
+			loaded = codec.load_codec(name)
+			encoded = loaded.encode(value)
+			self.assertIsInstance(encoded, bytes)
+			self.assertEqual(json.loads(encoded.decode('utf-8')), value)
+			self.assertEqual(loaded.decode(json.dumps(value).encode('utf-8')),
+				value)
+		self.assertRaises(ValueError, codec.load_codec, 'yaml')
+
+	def test_environment_selects_codec(self):
+		with patch.dict('os.environ', {codec.CODEC_ENV: 'json'}):
+			with patch.object(codec, '_default', None):
+				self.assertEqual(codec.default_codec().name, 'json')
+		self.assertIs(codec.get_codec('json'), codec.load_codec('json'))
+
+
+class TestPreparedClient(unittest.TestCase):
+
+	def setUp(self):
+		self.old_info = dict(fluidsurveys.AccessInfo)
+		self.decoded = []
+		decode = lambda data: self.decoded.append(data) or json.loads(
+			data.decode('utf-8'))
+		self.client = http_client.Client(
+			codec=codec.Codec('test', decode, None), coalesce=False)
+		self.client.httpclient = Mock()
+		self.client.httpclient.request.return_value = (b'{"id": 1}', 200, {})
+
+	def tearDown(self):
+		fluidsurveys.AccessInfo.clear()
+		fluidsurveys.AccessInfo.update(self.old_info)
+
+	def test_headers_follow_access_info(self):
+		fluidsurveys.AccessInfo(api_base='http://one/api/', username='a')
+		body, status_code = self.client.request('GET', '/surveys/1?x=1')
+		self.assertEqual(body, {'id': 1})
+		self.assertEqual(self.decoded, [b'{"id": 1}'])
+		method, url, headers, _ = self.client.httpclient.request.call_args[0]
+		self.assertEqual(url, 'http://one/api/surveys/1/?x=1')
+		self.assertTrue(headers['AUTHORIZATION'].startswith('apikey a@'))
+
+		fluidsurveys.AccessInfo(api_base='http://two/api', username='b')
+		self.client.request('GET', 'http://other/surveys/')
+		method, url, headers, _ = self.client.httpclient.request.call_args[0]
+		self.assertEqual(url, 'http://other/surveys/')
+		self.assertTrue(headers['AUTHORIZATION'].startswith('apikey b@'))
+		self.assertEqual(self.client.build_url('/surveys'),
+			http_client.build_url('/surveys'))
+
+	def test_json_bodies_use_the_codec(self):
+		self.client.codec = codec.Codec('test', json.loads,
+			lambda obj: b'encoded')
+		self.client.request('POST', '/surveys', json={'name': 'x'})
+		method, url, headers, body = self.client.httpclient.request.call_args[0]
+		self.assertEqual(body, b'encoded')
+		self.assertEqual(headers['Content-Type'], 'application/json')
+		self.client.request('POST', '/surveys', {'name': 'x'})
+		method, url, headers, body = self.client.httpclient.request.call_args[0]
+		self.assertEqual((body, headers['Content-Type']),
+			(b'name=x', 'application/x-www-form-urlencoded'))
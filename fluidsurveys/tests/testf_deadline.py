@@ -0,0 +1,124 @@
+import threading
+import time
+import unittest
+
+from mock import Mock
+
+from fluidsurveys import base, deadline, exceptions, http_client
+from fluidsurveys.metrics import Instrumentation
+from fluidsurveys.ratelimit import HedgePolicy, RetryPolicy
+
+
+class TestDeadline(unittest.TestCase):
+
+	def test_nested_deadlines_keep_the_earliest(self):
+		self.assertIsNone(deadline.current())
+		self.assertEqual(deadline.timeout(80), 80)
+		with deadline.within(10) as outer:
+			self.assertTrue(9 < deadline.timeout(80) <= 10)
+			self.assertEqual(deadline.timeout(5), 5)
+			with deadline.within(60) as inner:
+				self.assertIs(inner, outer)
+			with deadline.within(1):
+				self.assertTrue(deadline.timeout() <= 1)
+			self.assertIs(deadline.current(), outer)
+			self.assertRaises(exceptions.DeadlineExceeded, deadline.check, 20)
+		self.assertIsNone(deadline.current())
+
+		with deadline.within(-1):
+			self.assertRaises(exceptions.DeadlineExceeded, deadline.timeout, 80)
+
+	def test_worker_threads_inherit_the_deadline(self):
+		with deadline.within(10) as operation:
+			seen = [d for _, d, _ in base.threaded_map(
+				lambda i: deadline.current(), range(3), max_workers=3)]
+			seen.extend(base.prefetched(deadline.current() for _ in range(2)))
+		self.assertEqual(seen, [operation] * 5)
+
+
+class TestDeadlinePropagation(unittest.TestCase):
+
+	def setUp(self):
+		self.transport = Mock()
+		self.transport.request.return_value = (b'{"id": 1}', 200, {})
+		self.client = http_client.Client(httpclient=self.transport,
+			coalesce=False, retry=RetryPolicy(max_retries=5, backoff=1))
+
+	def test_requests_get_the_time_left(self):
+		self.client.request('GET', '/surveys/1')
+		self.assertNotIn('timeout', self.transport.request.call_args[1])
+
+		self.client.timeout = 3
+		self.client.request('GET', '/surveys/1')
+		self.assertEqual(self.transport.request.call_args[1], {'timeout': 3})
+		with deadline.within(0.5):
+			self.client.request('GET', '/surveys/1')
+		self.assertTrue(0 < self.transport.request.call_args[1]['timeout'] <= 0.5)
+
+	def test_no_retry_past_the_deadline(self):
+		self.transport.request.side_effect = exceptions.APIConnectionError(
+			'down')
+		started = time.time()
+		with deadline.within(0.3):
+			self.assertRaises(exceptions.DeadlineExceeded, self.client.request,
+				'GET', '/surveys/1')
+		self.assertTrue(time.time() - started < 0.3)
+
+	def test_backend_timeouts(self):
+		backend = http_client.HTTPClient(timeout=10, connect_timeout=3)
+		self.assertEqual(backend._timeouts(None), (3, 10))
+		self.assertEqual(backend._timeouts(0.5), (0.5, 0.5))
+		self.assertEqual(http_client.HTTPClient()._timeouts(None), (30, 80))
+
+
+class TestHedging(unittest.TestCase):
+
+	def setUp(self):
+		self.calls = []
+		self.lock = threading.Lock()
+
+		def request(method, url, headers, body):
+			with self.lock:
+				self.calls.append(url)
+				first = len(self.calls) == 1
+			if first and self.slow:
+				time.sleep(0.5)
+				return b'{"attempt": "first"}', 200, {}
+			return b'{"attempt": "hedge"}', 200, {}
+		self.slow = False
+		self.transport = Mock()
+		self.transport.request.side_effect = request
+		self.transport.pop_timings.return_value = {}
+		self.transport.pop_wire_bytes.return_value = None
+		self.hedge = HedgePolicy(min_samples=3, min_delay=0.01, max_delay=0.05,
+			budget=0.5)
+		self.instrumentation = Instrumentation()
+		self.client = http_client.Client(httpclient=self.transport,
+			coalesce=False, hedge=self.hedge,
+			instrumentation=self.instrumentation)
+
+	def test_hedge_answers_a_slow_get(self):
+		for _ in range(3):
+			self.client.request('GET', '/surveys/1')
+		self.calls[:] = []
+		self.slow = True
+		started = time.time()
+		body, status_code = self.client.request('GET', '/surveys/1')
+		self.assertTrue(time.time() - started < 0.4)
+		self.assertEqual(body, {'attempt': 'hedge'})
+		self.assertEqual(len(self.calls), 2)
+		stats = self.hedge.stats()
+		self.assertEqual((stats['hedged'], stats['won']), (1, 1))
+		metrics = self.instrumentation.snapshot()['surveys/{id}']['GET']
+		self.assertEqual(metrics['hedged'], 1)
+
+	def test_budget_and_writes(self):
+		self.assertIsNone(self.hedge.delay())
+		self.client.request('POST', '/surveys', {'name': 'x'})
+		self.assertEqual(self.hedge.requests, 1)
+		hedge = HedgePolicy(min_samples=1, budget=0.1)
+		hedge.record(0.01)
+		for _ in range(10):
+			hedge.delay()
+		self.assertTrue(hedge.allow())
+		self.assertFalse(hedge.allow())
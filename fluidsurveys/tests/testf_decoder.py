@@ -0,0 +1,68 @@
+import json
+import unittest
+
+from mock import Mock
+
+from fluidsurveys import decoder
+from fluidsurveys.decoder import ResponseDecoder, decoder_for
+from fluidsurveys.jsonstream import ResultsStream
+from fluidsurveys.resources import Response
+
+STRUCTURE = {'pages': [{'id': 'page1', 'children': [
+	{'id': 'q1', 'question_type': 'number', 'title': 'Age'},
+	{'id': 'q2', 'question_type': 'single-choice',
+		'choices': [{'label': 'Red', 'code': 'r'},
+			{'label': 'Blue', 'code': 'b'}]},
+	{'id': 'q3', 'question_type': 'multiple-choice',
+		'choices': [{'label': 'Cat', 'code': 'c'}, 'Dog']},
+	{'id': "q'4", 'question_type': 'text'},
+]}]}
+
+
+class TestResponseDecoder(unittest.TestCase):
+
+	def setUp(self):
+		self.decoder = ResponseDecoder(STRUCTURE)
+
+	def test_decodes_typed_values(self):
+		record = {'id': 9, 'q1': '2.5', 'q2': 'b', 'q3': ['c', 'Dog'],
+			"q'4": 'hi', 'extra': 1}
+		self.assertEqual(self.decoder.fields, ('id', 'q1', 'q2', 'q3', "q'4"))
+		self.assertEqual(self.decoder.decode(record), {'id': 9, 'q1': 2.5,
+			'q2': 'Blue', 'q3': ('Cat', 'Dog'), "q'4": 'hi'})
+		self.assertEqual(self.decoder.decode_tuple({'q1': '3', 'q2': 'x',
+			'q3': {'c': True, 'Dog': False}}), (None, 3, 'x', ('Cat',), None))
+
+	def test_bad_values(self):
+		decoded = self.decoder.decode({'q1': 'many', 'q2': ['r'], 'q3': None})
+		self.assertEqual((decoded['q1'], decoded['q2'], decoded['q3']),
+			(None, ['r'], ()))
+		self.assertEqual(ResponseDecoder({}, meta_fields=()).decode_tuple({}),
+			())
+
+	def test_decoders_are_cached_per_structure_version(self):
+		first = decoder_for(1, STRUCTURE)
+		self.assertIs(decoder_for(1, json.loads(json.dumps(STRUCTURE))), first)
+		self.assertIsNot(decoder_for(2, STRUCTURE), first)
+		changed = dict(STRUCTURE, version=2)
+		self.assertIsNot(decoder_for(1, changed), first)
+		self.assertEqual(decoder.structure_version(changed), 'version:2')
+
+
+class TestIterDecoded(unittest.TestCase):
+
+	def test_listing_yields_decoded_records(self):
+		pages = [{'results': [{'id': 1, 'q2': 'r'}, {}],
+			'next': '/surveys/4/responses?page=2'},
+			{'results': [{'id': 2, 'q1': 7}], 'next': None}]
+		client = Mock()
+		client.request.return_value = (STRUCTURE, 200)
+		client.stream.side_effect = [
+			(ResultsStream([json.dumps(page).encode('utf-8')]), 200)
+			for page in pages]
+		manager = Response.get_manager(client=client, survey='4')
+		records = list(manager.iter_decoded(tuples=True))
+		self.assertEqual(records, [(1, None, 'Red', (), None),
+			(2, 7, None, (), None)])
+		self.assertEqual(client.request.call_args[0][:2],
+			('GET', '/surveys/4/structure'))
@@ -0,0 +1,86 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from mock import Mock
+
+from fluidsurveys import http_client
+from fluidsurveys.diskcache import PersistentCache
+from fluidsurveys.resources import Group, GroupManager
+
+SURVEY = ('https://fluidsurveys.com/api/v3/surveys/1/', 'Basic c2VjcmV0')
+
+
+class TestPersistentCache(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.path = os.path.join(self.tmp, 'metadata.db')
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+
+	def test_shared_through_the_file(self):
+		cache = PersistentCache(self.path)
+		cache.set(SURVEY, {'id': 1}, size=9, etag='"v1"')
+		cache.set(('https://fluidsurveys.com/api/v3/surveys/1/responses/',
+			None), {'results': []})
+		cache.close()
+
+		other = PersistentCache(self.path)
+		entry = other.get(SURVEY)
+		self.assertEqual(entry.body, {'id': 1})
+		self.assertEqual(entry.etag, '"v1"')
+		self.assertEqual(len(other), 1)
+		self.assertIsNone(other.get((SURVEY[0], None)))
+		self.assertEqual(other.stats()['disk_hits'], 1)
+		with open(self.path, 'rb') as f:
+			self.assertNotIn(b'c2VjcmV0', f.read())
+
+		other.invalidate('https://fluidsurveys.com/api/v3/surveys/')
+		self.assertIsNone(other.get(SURVEY))
+		self.assertEqual(len(PersistentCache(self.path)), 0)
+
+	def test_versions_and_stale_window(self):
+		cache = PersistentCache(self.path, ttl=0, stale_while_revalidate=60)
+		cache.set(SURVEY, {'id': 1})
+		time.sleep(0.01)
+		entry = cache.get(SURVEY)
+		self.assertFalse(entry.is_fresh())
+		self.assertTrue(entry.is_servable(cache.stale_while_revalidate))
+		self.assertIsNone(PersistentCache(self.path, version=2).get(SURVEY))
+		expired = PersistentCache(self.path, stale_while_revalidate=0)
+		self.assertIsNone(expired.get(SURVEY))
+
+
+class TestStaleWhileRevalidate(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		cache = PersistentCache(os.path.join(self.tmp, 'metadata.db'), ttl=0)
+		self.client = http_client.Client(cache=cache)
+		self.client.httpclient = Mock()
+		self.client.httpclient.request.return_value = (
+			json.dumps({'results': [{'id': 4}]}).encode('utf-8'), 200,
+			{'etag': '"v1"'})
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+
+	def test_serves_stale_and_revalidates_in_background(self):
+		manager = GroupManager(Group, client=self.client, survey=3)
+		self.assertEqual([g.id for g in manager.list()], [4])
+		time.sleep(0.01)
+		self.client.httpclient.request.return_value = (b'', 304, {})
+		self.assertEqual([g.id for g in manager.list()], [4])
+
+		deadline = time.time() + 5
+		while self.client.cache.revalidations == 0 and time.time() < deadline:
+			time.sleep(0.005)
+		self.assertEqual(self.client.httpclient.request.call_count, 2)
+		headers = self.client.httpclient.request.call_args[0][2]
+		self.assertEqual(headers['If-None-Match'], '"v1"')
+		self.assertEqual(self.client.cache.revalidations, 1)
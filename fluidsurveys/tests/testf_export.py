@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import Mock
+
+from fluidsurveys import export
+from fluidsurveys.jsonstream import ResultsStream
+from fluidsurveys.resources import Survey
+
+STRUCTURE = {'pages': [{'children': [
+	{'id': 'age', 'question_type': 'number'},
+	{'id': 'colour', 'question_type': 'single-choice', 'choices': [
+		{'label': u'Rouge', 'code': 'r'}, {'label': 'Blue', 'code': 'b'}]},
+	{'id': 'pets', 'question_type': 'checkbox', 'choices': ['cat', 'dog']},
+	{'id': 'comment', 'question_type': 'text'},
+]}]}
+
+RECORDS = [
+	{'id': 1, 'age': '31', 'colour': 'b', 'pets': ['cat', 'dog'], 'comment': u'très bien'},
+	{'id': 2, 'age': None, 'colour': u'Rouge', 'pets': {'dog': True, 'cat': False}},
+	{'id': 3, 'age': 'n/a', 'colour': 'green', 'pets': []},
+]
+
+
+class TestResponseTable(unittest.TestCase):
+
+	def setUp(self):
+		self.numpy = export.numpy
+		self.tmp = tempfile.mkdtemp()
+
+	def tearDown(self):
+		export.numpy = self.numpy
+		shutil.rmtree(self.tmp)
+
+	def build(self):
+		table = export.ResponseTable.from_structure(STRUCTURE)
+		table.extend(RECORDS)
+		return table
+
+	def check_columns(self, columns):
+		self.assertEqual(list(columns['id']), [1, 2, 3])
+		self.assertFalse([v for v in columns['id'] if isinstance(v, float)])
+		age = list(columns['age'])
+		self.assertEqual(age[0], 31.0)
+		self.assertTrue(age[1] != age[1] and age[2] != age[2])
+		self.assertEqual(list(columns['colour']), [1, 0, -1])
+		self.assertEqual(list(columns['pets:cat']), [1, 0, 0])
+		self.assertEqual(list(columns['pets:dog']), [1, 1, 0])
+		self.assertEqual(list(columns['comment']), [u'très bien', u'', u''])
+
+	def test_columns(self):
+		for numpy in (self.numpy, None):
+			export.numpy = numpy
+			table = self.build()
+			self.assertEqual(len(table), 3)
+			self.assertEqual([c.kind for c in table.columns],
+				['integer', 'numeric', 'categorical', 'flag', 'flag', 'text'])
+			values = table.as_dict()
+			values['comment'] = [v or u'' for v in values['comment']]
+			self.check_columns(values)
+
+	def test_growth(self):
+		table = export.ResponseTable.from_structure(STRUCTURE)
+		table.extend({'id': i, 'age': i} for i in range(5000))
+		self.assertEqual(list(table.as_dict()['age'])[-1], 4999.0)
+
+	def test_csv(self):
+		path = os.path.join(self.tmp, 'out.csv')
+		self.build().write(path, 'csv')
+		with io.open(path, encoding='utf-8') as f:
+			lines = f.read().splitlines()
+		self.assertEqual(lines[0], 'id,age,colour,pets:cat,pets:dog,comment')
+		self.assertEqual(lines[1], u'1,31,Blue,1,1,très bien')
+		self.assertEqual(lines[3], '3,,,0,0,')
+
+	def test_columnar_round_trip(self):
+		for numpy in (self.numpy, None):
+			export.numpy = numpy
+			path = os.path.join(self.tmp, 'out.fscol')
+			self.build().write(path, 'columnar')
+			header, columns = export.read_columnar(path)
+			self.assertEqual(header['rows'], 3)
+			self.assertEqual(header['columns'][2]['categories'], [u'Rouge', 'Blue'])
+			self.assertEqual(header['columns'][0]['dtype'], '<i8')
+			self.check_columns(columns)
+
+	def read(self, path):
+		if path.endswith('.columnar'):
+			header, columns = export.read_columnar(path)
+			# NaN never equals itself.
+			return header, dict((name, [None if v != v else v for v in values])
+				for name, values in columns.items())
+		with open(path, 'rb') as f:
+			return f.read()
+
+	def survey(self, pages=1, count=None):
+		client = Mock()
+		client.request.return_value = (STRUCTURE, 200)
+		head = '{"count": %d, "next": null, "results": ' % (
+			count or len(RECORDS) * pages)
+		client.stream.side_effect = lambda method, url: (ResultsStream(
+			[head.encode('utf-8'),
+			export.json.dumps(RECORDS * pages).encode('utf-8'), b'}']), 200)
+		return Survey({'id': 4}, manager=Survey.get_manager(client=client))
+
+	def test_survey_export_responses(self):
+		survey = self.survey()
+		table = survey.export_responses()
+		self.assertEqual(len(table), 3)
+		self.assertEqual(survey.manager.client.stream.call_args[0][1],
+			'/surveys/4/responses')
+		table = self.survey(count=5000).export_responses()
+		self.assertEqual(set(len(c.data) for c in table.columns
+			if c.kind != 'text'), set([5000]))
+
+	def test_export_flushes_parts(self):
+		for format in ('csv', 'columnar'):
+			expected = os.path.join(self.tmp, 'expected.' + format)
+			table = export.ResponseTable.from_structure(STRUCTURE)
+			table.extend(RECORDS * 4)
+			table.write(expected, format)
+			path = os.path.join(self.tmp, 'out.' + format)
+			rows = self.survey(pages=4).export_responses(path, format=format,
+				flush_rows=5)
+			self.assertEqual(rows, 12)
+			self.assertEqual(self.read(path), self.read(expected))
+		self.assertEqual(sorted(os.listdir(self.tmp)), ['expected.columnar',
+			'expected.csv', 'out.columnar', 'out.csv'])
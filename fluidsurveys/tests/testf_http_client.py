@@ -0,0 +1,251 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import unittest
+import zlib
+
+from mock import patch
+from six.moves import BaseHTTPServer, socketserver
+
+import fluidsurveys
+from fluidsurveys import http_client
+from fluidsurveys.metrics import Instrumentation
+from fluidsurveys.ratelimit import RetryPolicy
+from fluidsurveys.resources import Survey, Template
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+
+	def do_GET(self):
+		if '/slow/' in self.path:
+			time.sleep(0.2)
+		if '/flaky/' in self.path and self.path not in self.server.failed:
+			self.server.failed.add(self.path)
+			return self._reply({'detail': 'busy'}, 503)
+		results = []
+		if '/responses' in self.path:
+			results = [{'id': i, 'answer': 'x' * 50} for i in range(2000)]
+		self._reply({'path': self.path, 'results': results, 'next': None})
+
+	def do_POST(self):
+		body = self.rfile.read(int(self.headers['Content-Length']))
+		if self.headers.get('Content-Encoding') == 'gzip':
+			body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+		self._reply({'path': self.path, 'body': body.decode('utf-8'),
+			'encoding': self.headers.get('Content-Encoding'),
+			'type': self.headers.get('Content-Type')})
+
+	do_PUT = do_POST
+
+	def _reply(self, data, status=200):
+		payload = json.dumps(data).encode('utf-8')
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json')
+		if 'gzip' in (self.headers.get('Accept-Encoding') or ''):
+			compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+			payload = compressor.compress(payload) + compressor.flush()
+			self.send_header('Content-Encoding', 'gzip')
+		self.send_header('Content-Length', str(len(payload)))
+		self.end_headers()
+		self.wfile.write(payload)
+
+	def log_message(self, *args):
+		pass
+
+
+class _Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	daemon_threads = True
+
+
+class TestPooledClient(unittest.TestCase):
+
+	def setUp(self):
+		self.server = _Server(('127.0.0.1', 0), _Handler)
+		self.server.failed = set()
+		self.thread = threading.Thread(target=self.server.serve_forever)
+		self.thread.daemon = True
+		self.thread.start()
+		self.old_base = fluidsurveys.AccessInfo['api_base']
+		self.old_pool = dict(http_client.POOL_DEFAULTS)
+		fluidsurveys.AccessInfo(api_base='http://127.0.0.1:%d/' % self.server.server_address[1])
+
+	def tearDown(self):
+		fluidsurveys.AccessInfo(api_base=self.old_base)
+		self.server.shutdown()
+		self.server.server_close()
+		http_client.configure_pool(**self.old_pool)
+
+	def test_connections_are_reused(self):
+		client = http_client.Client(pool_maxsize=2)
+		for _ in range(5):
+			body, status_code = client.request('GET', '/surveys')
+			self.assertEqual(status_code, 200)
+		stats = client.pool_stats()
+		self.assertEqual(stats['requests'], 5)
+		self.assertEqual(stats['new_connections'], 1)
+		self.assertEqual(stats['hits'], 4)
+		client.close()
+
+	def test_blocking_pool_counts_waits(self):
+		client = http_client.Client(pool_maxsize=1, pool_block=True,
+			coalesce=False)
+		# Every request arrives while the first one holds the connection.
+		threads = [threading.Thread(target=client.request,
+				args=('GET', '/surveys/slow/%d' % i)) for i in range(8)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		stats = client.pool_stats()
+		self.assertEqual(stats['requests'], 8)
+		self.assertEqual(stats['new_connections'], 1)
+		self.assertEqual(stats['waits'], 7)
+		client.close()
+
+	def test_streaming_backends(self):
+		backends = [http_client.Urllib2Client, http_client.RequestsClient]
+		if http_client.load_backend('pycurl') is not None:
+			backends.append(http_client.PycurlClient)
+		for backend in backends:
+			client = http_client.Client()
+			client.httpclient = backend(verify_ssl_certs=False)
+			stream, status_code = client.stream('GET', '/surveys/1/responses')
+			self.assertEqual(status_code, 200)
+			records = list(stream)
+			self.assertEqual(len(records), 2000, backend.name)
+			self.assertEqual(records[-1], {'id': 1999, 'answer': 'x' * 50})
+			self.assertEqual(stream.meta['path'], '/surveys/1/responses/')
+			client.close()
+
+	def test_compression(self):
+		backends = [http_client.Urllib2Client, http_client.RequestsClient]
+		if http_client.load_backend('pycurl') is not None:
+			backends.append(http_client.PycurlClient)
+		for backend in backends:
+			instrumentation = Instrumentation()
+			client = http_client.Client(compress_min_size=100,
+				instrumentation=instrumentation)
+			client.httpclient = backend(verify_ssl_certs=False)
+			stream, status_code = client.stream('GET', '/surveys/1/responses')
+			self.assertEqual(len(list(stream)), 2000, backend.name)
+			body = json.dumps({'answer': 'y' * 500})
+			reply, status_code = client.request('POST', '/surveys', body)
+			self.assertEqual((reply['body'], reply['encoding']), (body, 'gzip'))
+			reply, status_code = client.request('POST', '/surveys', '{}')
+			self.assertEqual(reply['encoding'], None)
+			metrics = instrumentation.snapshot()
+			listing = metrics['surveys/{id}/responses']['GET']
+			self.assertLess(listing['wire_bytes_in'], listing['bytes_in'] / 10)
+			created = metrics['surveys']['POST']
+			self.assertLess(created['wire_bytes_out'], created['bytes_out'])
+			client.httpclient.decompress = False
+			body, status_code = client.request('GET', '/surveys/1')
+			self.assertEqual(body['path'], '/surveys/1/')
+			client.close()
+
+	@unittest.skipIf(http_client.load_backend('pycurl') is None,
+		'pycurl is not installed')
+	def test_pycurl_reuses_handles_and_multiplexes(self):
+		client = http_client.Client(retry=RetryPolicy(max_retries=0))
+		client.httpclient = http_client.PycurlClient(verify_ssl_certs=False,
+			pool_maxsize=2)
+		for _ in range(3):
+			client.request('GET', '/surveys/1')
+		self.assertEqual(client.pool_stats()['new_connections'], 1)
+		self.assertTrue(client.can_send_many())
+		results = client.request_many('GET',
+			['/surveys/%d' % i for i in range(10)] + ['http://127.0.0.1:1/'])
+		self.assertEqual([r[0]['path'] for r in results[:10]],
+			['/surveys/%d/' % i for i in range(10)])
+		self.assertIsInstance(results[10], fluidsurveys.exceptions.APIConnectionError)
+		self.assertLessEqual(client.pool_stats()['new_connections'], 3)
+		client.close()
+
+	def test_retried_streams_give_their_connection_back(self):
+		backends = [http_client.RequestsClient]
+		if http_client.load_backend('pycurl') is not None:
+			backends.append(http_client.PycurlClient)
+		for backend in backends:
+			client = http_client.Client(retry=RetryPolicy(backoff=0))
+			client.httpclient = backend(pool_maxsize=1, pool_block=True)
+			results = []
+
+			def fetch():
+				for i in range(2):
+					stream, status_code = client.stream('GET',
+						'/surveys/flaky/%s/%d' % (backend.name, i))
+					results.append((status_code, len(list(stream))))
+			thread = threading.Thread(target=fetch)
+			thread.daemon = True
+			thread.start()
+			thread.join(10)
+			self.assertFalse(thread.is_alive(), backend.name)
+			self.assertEqual(results, [(200, 0), (200, 0)])
+			client.close()
+
+	def test_form_bodies_on_every_backend(self):
+		backends = [http_client.Urllib2Client, http_client.RequestsClient]
+		if http_client.load_backend('pycurl') is not None:
+			backends.append(http_client.PycurlClient)
+		for backend in backends:
+			client = http_client.Client(coalesce=False)
+			client.httpclient = backend(verify_ssl_certs=False)
+			manager = Survey.get_manager(client=client)
+			created = manager.create({'name': u'caf\xe9', 'tags': ['a', 'b'],
+				'note': None})
+			self.assertEqual(created.path, '/surveys/', backend.name)
+			self.assertEqual(sorted(created.body.split('&')),
+				['name=caf%C3%A9', 'tags=a', 'tags=b'])
+			self.assertEqual(created.type, 'application/x-www-form-urlencoded')
+
+			survey = manager.wrap({'id': 1, 'name': 'a'})
+			survey.name = 'b'
+			updated = manager.update(survey)
+			self.assertEqual(updated.path, '/surveys/1/', backend.name)
+			self.assertEqual(sorted(updated.body.split('&')), ['id=1', 'name=b'])
+			client.close()
+
+	def test_managers_share_one_client(self):
+		self.assertIs(Survey().manager.client, Template().manager.client)
+		self.assertIs(Survey().manager.client, http_client.get_shared_client())
+
+	def test_configure_pool_rebuilds_shared_client(self):
+		before = http_client.get_shared_client()
+		http_client.configure_pool(pool_maxsize=4)
+		self.assertIsNot(before, http_client.get_shared_client())
+		self.assertEqual(http_client.POOL_DEFAULTS['pool_maxsize'], 4)
+		self.assertRaises(ValueError, http_client.configure_pool, bogus=1)
+
+
+class TestBackendSelection(unittest.TestCase):
+
+	def tearDown(self):
+		http_client.configure_backend(None)
+
+	def test_import_does_not_load_backends(self):
+		code = ('import sys, fluidsurveys.resources; '
+			'print(any(m in sys.modules for m in ("requests", "pycurl")))')
+		root = os.path.join(os.path.dirname(__file__), '..', '..')
+		output = subprocess.check_output([sys.executable, '-c', code],
+			cwd=root)
+		self.assertEqual(output.strip(), b'False')
+
+	def test_configured_backend(self):
+		http_client.configure_backend('urllib2')
+		client = http_client.get_shared_client()
+		self.assertIsInstance(client.httpclient, http_client.Urllib2Client)
+		self.assertRaises(ValueError, http_client.configure_backend, 'curl')
+
+	def test_environment_variable(self):
+		with patch.dict(os.environ, {http_client.BACKEND_ENV: 'requests'}):
+			client = http_client.Client()
+		self.assertIsInstance(client.httpclient, http_client.RequestsClient)
+
+	def test_selected_backend_must_be_installed(self):
+		http_client.configure_backend('urlfetch')
+		self.assertRaises(ImportError, http_client.Client)
+		self.assertNotIn('urlfetch', http_client.available_backends())
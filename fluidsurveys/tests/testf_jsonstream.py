@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+
+from fluidsurveys.jsonstream import ResultsStream
+
+
+PAGE = {
+	'count': 3,
+	'previous': None,
+	'results': [{'id': 1, 'name': u'café'}, {'id': 2, 'scores': [1.5, 20]}, 123456],
+	'next': 'http://api/surveys/1/responses/?page=2',
+}
+
+
+def _chunks(data, size):
+	return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class TestResultsStream(unittest.TestCase):
+
+	def test_any_chunking(self):
+		raw = json.dumps(PAGE, ensure_ascii=False).encode('utf-8')
+		for size in (1, 2, 5, 64, len(raw)):
+			stream = ResultsStream(_chunks(raw, size))
+			self.assertEqual(list(stream), PAGE['results'])
+			meta = dict(PAGE)
+			del meta['results']
+			self.assertEqual(stream.meta, meta)
+
+	def test_records_arrive_before_the_page_ends(self):
+		raw = json.dumps({'results': [{'id': i} for i in range(1000)]}).encode('utf-8')
+		consumed = []
+
+		def chunks():
+			for chunk in _chunks(raw, 100):
+				consumed.append(chunk)
+				yield chunk
+
+		records = iter(ResultsStream(chunks()))
+		self.assertEqual(next(records), {'id': 0})
+		self.assertEqual(len(consumed), 1)
+
+	def test_not_a_listing(self):
+		stream = ResultsStream([b'{"detail": "Not found"}'])
+		self.assertEqual(list(stream), [])
+		self.assertEqual(stream.meta, {'detail': 'Not found'})
+		stream = ResultsStream([b'[1, 2]'])
+		self.assertEqual(list(stream), [])
+		self.assertEqual(stream.meta, [1, 2])
+
+	def test_truncated_input(self):
+		self.assertRaises(ValueError, list, ResultsStream([b'{"results": [{"id": 1}, {"id"']))
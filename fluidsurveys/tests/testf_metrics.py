@@ -0,0 +1,119 @@
+import json
+import unittest
+
+from mock import Mock
+
+from fluidsurveys import http_client
+from fluidsurveys.cache import LRUCache
+from fluidsurveys.metrics import (Histogram, Instrumentation, LatencyMetrics,
+	RequestEvent, endpoint_for)
+from fluidsurveys.ratelimit import RetryPolicy
+
+
+class TestMetrics(unittest.TestCase):
+
+	def test_endpoint_for(self):
+		base = 'https://fluidsurveys.com/api/v3/'
+		self.assertEqual(endpoint_for(base + 'surveys/12/structure/', base),
+			'surveys/{id}/structure')
+		self.assertEqual(endpoint_for(base + 'surveys/?page=2', base), 'surveys')
+		self.assertEqual(endpoint_for('/api/v3/surveys/3/responses/9/',
+			'/api/v3'), 'surveys/{id}/responses/{id}')
+
+	def test_histogram(self):
+		histogram = Histogram(buckets=(0.1, 1.0))
+		for value in (0.05, 0.1, 0.5, 5.0):
+			histogram.observe(value)
+		self.assertEqual(histogram.cumulative(),
+			[(0.1, 2), (1.0, 3), (float('inf'), 4)])
+		self.assertAlmostEqual(histogram.quantile(0.5), 0.1)
+		self.assertEqual(histogram.quantile(1), 1.0)
+		self.assertIsNone(Histogram().quantile(0.5))
+
+	def test_snapshot_and_prometheus(self):
+		metrics = LatencyMetrics(buckets=(0.1,))
+		event = RequestEvent('GET', '/surveys/1/', 'surveys/{id}')
+		event.status_code, event.bytes_in, event.retries = 200, 10, 1
+		event.timings = {'total': 0.05}
+		metrics.record(event)
+		entry = metrics.snapshot()['surveys/{id}']['GET']
+		self.assertEqual(entry['requests'], {200: 1})
+		self.assertEqual(entry['bytes_in'], 10)
+		self.assertEqual(entry['latency']['total']['count'], 1)
+		text = metrics.prometheus()
+		self.assertIn('fluidsurveys_request_duration_seconds_bucket{'
+			'endpoint="surveys/{id}",method="GET",phase="total",le="0.1"} 1',
+			text)
+		self.assertIn('fluidsurveys_requests_total{endpoint="surveys/{id}",'
+			'method="GET",status="200"} 1', text)
+		self.assertIn('fluidsurveys_retries_total{endpoint="surveys/{id}",'
+			'method="GET"} 1', text)
+
+
+class TestInstrumentedClient(unittest.TestCase):
+
+	def setUp(self):
+		self.instrumentation = Instrumentation()
+		self.events = []
+		self.instrumentation.add_hook(after=self.events.append)
+		self.client = http_client.Client(instrumentation=self.instrumentation,
+			retry=RetryPolicy(backoff=0))
+		self.client.httpclient = Mock()
+		self.client.httpclient.pop_timings.return_value = {'server': 0.01}
+		self.client.httpclient.pop_wire_bytes.return_value = None
+		self.payload = json.dumps({'id': 1}).encode('utf-8')
+		self.client.httpclient.request.return_value = (self.payload, 200, {})
+
+	def test_records_phases_sizes_and_retries(self):
+		before = Mock()
+		self.instrumentation.add_hook(before=before)
+		self.client.httpclient.request.side_effect = [
+			(b'', 503, {}), (self.payload, 200, {})]
+		self.client.request('GET', '/surveys/1/structure')
+		self.assertEqual(before.call_count, 1)
+		event, = self.events
+		self.assertEqual(event.endpoint, 'surveys/{id}/structure')
+		self.assertEqual(event.status_code, 200)
+		self.assertEqual(event.retries, 1)
+		self.assertEqual(event.bytes_in, len(self.payload))
+		for phase in ('wait', 'server', 'download', 'decode', 'total'):
+			self.assertIn(phase, event.timings)
+		self.assertEqual(event.wire_bytes_in, None)
+		entry = self.instrumentation.snapshot()['surveys/{id}/structure']
+		self.assertEqual(entry['GET']['retries'], 1)
+		self.assertEqual(entry['GET']['wire_bytes_in'], len(self.payload))
+
+	def test_cached_and_failed_calls(self):
+		self.client.cache = LRUCache()
+		self.client.request('GET', '/surveys/1')
+		self.client.request('GET', '/surveys/1')
+		self.assertTrue(self.events[1].cached)
+		self.client.httpclient.request.return_value = (b'', 404, {})
+		self.client.request('DELETE', '/surveys/1')
+		self.assertEqual(self.events[2].status_code, 404)
+
+	def test_sizes_of_encoded_bodies(self):
+		self.client.request('POST', '/surveys', {'name': u'caf\xe9', 'n': 1})
+		self.client.compress_min_size = 100
+		self.client.request('PUT', '/surveys/1', {'name': 'x' * 200})
+		created, updated = self.events
+		self.assertEqual(created.bytes_out, len(b'name=caf%C3%A9&n=1'))
+		self.assertEqual(created.wire_bytes_out, created.bytes_out)
+		self.assertEqual(updated.bytes_out, 205)
+		self.assertLess(updated.wire_bytes_out, 100)
+
+	def test_streams_complete_when_consumed(self):
+		self.client.httpclient.stream.return_value = (
+			iter([b'{"results": [{"id": 1},', b' {"id": 2}]}']), 200, {})
+		page, status_code = self.client.stream('GET', '/surveys/1/responses')
+		self.assertEqual(self.events, [])
+		self.assertEqual([r['id'] for r in page], [1, 2])
+		event, = self.events
+		self.assertEqual(event.bytes_in, 35)
+		self.assertIn('download', event.timings)
+
+	def test_no_instrumentation(self):
+		self.client.instrumentation = None
+		body, status_code = self.client.request('GET', '/surveys/1')
+		self.assertEqual(body, {'id': 1})
+		self.assertFalse(self.client.httpclient.pop_timings.called)
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from mock import Mock
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import parse_qs, urlparse
+
+import fluidsurveys
+from fluidsurveys import exceptions, export, http_client
+from fluidsurveys.jsonstream import ResultsStream
+from fluidsurveys.parallel import ShardedExport
+from fluidsurveys.resources import Survey
+
+STRUCTURE = {'pages': [{'children': [
+	{'id': 'age', 'question_type': 'number'},
+	{'id': 'colour', 'question_type': 'single-choice', 'choices': [
+		{'label': u'Rouge', 'code': 'r'}, {'label': 'Blue', 'code': 'b'}]},
+	{'id': 'pets', 'question_type': 'checkbox', 'choices': ['cat', 'dog']},
+	{'id': 'comment', 'question_type': 'text'},
+]}]}
+
+RECORDS = [{'id': i, 'age': i % 7, 'colour': 'rb'[i % 2],
+	'pets': ['cat', 'dog'][:i % 3], 'comment': u'é' * (i % 4)}
+	for i in range(1, 24)]
+
+PAGE_SIZE = 5
+
+
+def page(number):
+	start = (number - 1) * PAGE_SIZE
+	return {'count': len(RECORDS), 'results': RECORDS[start:start + PAGE_SIZE],
+		'next': 'next' if start + PAGE_SIZE < len(RECORDS) else None}
+
+
+def page_number(url):
+	return int(parse_qs(urlparse(url).query).get('page', ['1'])[0])
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+
+	def do_GET(self):
+		payload = json.dumps(page(page_number(self.path))).encode('utf-8')
+		self.send_response(200)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(payload)))
+		self.end_headers()
+		self.wfile.write(payload)
+
+	def log_message(self, *args):
+		pass
+
+
+class _Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	daemon_threads = True
+
+
+class TestShardedExport(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.client = Mock()
+		self.client.request.side_effect = lambda method, url: (
+			page(page_number(url)), 200)
+		self.client.stream.side_effect = lambda method, url: (
+			page(page_number(url))['results'], 200)
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+
+	def expected(self, format):
+		path = os.path.join(self.tmp, 'expected.' + format)
+		table = export.ResponseTable.from_structure(STRUCTURE)
+		table.extend(RECORDS)
+		table.write(path, format)
+		return path
+
+	def read(self, path):
+		if path.endswith('.columnar'):
+			header, columns = export.read_columnar(path)
+			return header, dict((name, list(values))
+				for name, values in columns.items())
+		with open(path, 'rb') as f:
+			return f.read()
+
+	def test_merged_shards_match_a_single_export(self):
+		job = ShardedExport(STRUCTURE, processes=0, pages_per_shard=2,
+			client=self.client)
+		for format in ('csv', 'columnar'):
+			path = os.path.join(self.tmp, 'export.' + format)
+			stats = job.run(9, path, format=format)
+			self.assertEqual(stats, {'rows': 23, 'pages': 5, 'shards': []})
+			self.assertEqual(self.read(path), self.read(self.expected(format)))
+		self.assertEqual(self.client.stream.call_args[0][1],
+			'/surveys/9/responses?page=5')
+		self.assertEqual(sorted(os.listdir(self.tmp)), ['expected.columnar',
+			'expected.csv', 'export.columnar', 'export.csv'])
+
+	def test_partitioned(self):
+		job = ShardedExport(STRUCTURE, processes=0, pages_per_shard=3,
+			client=self.client)
+		stats = job.run(9, os.path.join(self.tmp, 'export'), format='columnar',
+			merge=False)
+		self.assertEqual([os.path.basename(s) for s in stats['shards']],
+			['export.part00000', 'export.part00001', 'export.part00002'])
+		self.assertEqual([export.read_columnar(s)[0]['rows']
+			for s in stats['shards']], [5, 15, 3])
+
+	def test_error_replies_fail_the_export(self):
+		job = ShardedExport(STRUCTURE, processes=0, pages_per_shard=2,
+			client=self.client)
+		path = os.path.join(self.tmp, 'export.csv')
+		self.client.request.side_effect = lambda method, url: (
+			{'detail': 'denied'}, 403)
+		self.assertRaises(exceptions.APIError, job.run, 9, path)
+
+		def stream(method, url):
+			if page_number(url) == 4:
+				return ResultsStream([b'{"detail": "gone"}']), 404
+			return page(page_number(url))['results'], 200
+		self.client.request.side_effect = lambda method, url: (
+			page(page_number(url)), 200)
+		self.client.stream.side_effect = stream
+		self.assertRaises(exceptions.APIError, job.run, 9, path)
+		self.assertEqual(os.listdir(self.tmp), [])
+
+	def test_worker_processes(self):
+		server = _Server(('127.0.0.1', 0), _Handler)
+		thread = threading.Thread(target=server.serve_forever)
+		thread.daemon = True
+		thread.start()
+		old_base = fluidsurveys.AccessInfo['api_base']
+		fluidsurveys.AccessInfo(api_base='http://127.0.0.1:%d/' %
+			server.server_address[1])
+		try:
+			client = http_client.Client()
+			survey = Survey({'id': 9}, manager=Survey.get_manager(client=client))
+			survey._structure = STRUCTURE
+			path = os.path.join(self.tmp, 'export.csv')
+			stats = survey.export_sharded(path, processes=2, pages_per_shard=1)
+		finally:
+			fluidsurveys.AccessInfo(api_base=old_base)
+			server.shutdown()
+			server.server_close()
+		self.assertEqual(stats, {'rows': 23, 'pages': 5, 'shards': []})
+		self.assertEqual(self.read(path), self.read(self.expected('csv')))
@@ -0,0 +1,117 @@
+import threading
+import time
+import unittest
+
+from mock import Mock, patch
+
+from fluidsurveys import exceptions, http_client
+from fluidsurveys.ratelimit import (RateLimiter, RetryPolicy, TokenBucket,
+	parse_retry_after)
+
+
+class TestTokenBucket(unittest.TestCase):
+
+	def test_paces_requests_after_the_burst(self):
+		bucket = TokenBucket(rate=50, burst=1)
+		start = time.time()
+		for _ in range(4):
+			bucket.acquire()
+		self.assertGreaterEqual(time.time() - start, 0.05)
+
+	def test_parse_retry_after(self):
+		self.assertEqual(parse_retry_after('3'), 3.0)
+		self.assertIsNone(parse_retry_after(None))
+		self.assertIsNone(parse_retry_after('soon'))
+		self.assertEqual(parse_retry_after('Thu, 01 Jan 1970 00:00:10 GMT',
+			now=4), 6.0)
+
+
+class TestRateLimiter(unittest.TestCase):
+
+	def test_backs_off_on_throttling_and_recovers(self):
+		limiter = RateLimiter(rate=1000, concurrency=8)
+		limiter.acquire()
+		limiter.release(429)
+		self.assertEqual(limiter.concurrency, 4)
+		self.assertEqual(limiter.rate, 500)
+		for _ in range(20):
+			limiter.acquire()
+			limiter.release(200)
+		self.assertGreater(limiter.concurrency, 4)
+		self.assertGreater(limiter.rate, 500)
+		self.assertEqual(limiter.stats()['throttled'], 1)
+
+	def test_caps_requests_in_flight(self):
+		limiter = RateLimiter(concurrency=1)
+		limiter.acquire()
+		acquired = threading.Event()
+
+		def worker():
+			limiter.acquire()
+			acquired.set()
+		thread = threading.Thread(target=worker)
+		thread.start()
+		self.assertFalse(acquired.wait(0.05))
+		limiter.release(200)
+		self.assertTrue(acquired.wait(1))
+		thread.join()
+
+	def test_retry_after_pauses_everyone(self):
+		limiter = RateLimiter()
+		limiter.acquire()
+		limiter.release(429, retry_after=0.05)
+		start = time.time()
+		limiter.acquire()
+		self.assertGreaterEqual(time.time() - start, 0.04)
+
+
+class TestRetryingClient(unittest.TestCase):
+
+	def setUp(self):
+		self.limiter = RateLimiter(concurrency=4)
+		self.client = http_client.Client(rate_limiter=self.limiter,
+			retry=RetryPolicy(max_retries=2, backoff=0))
+		self.client.httpclient = Mock()
+		self.request = self.client.httpclient.request
+
+	def test_retries_throttled_requests(self):
+		self.request.side_effect = [
+			(b'', 429, {'retry-after': '0'}),
+			(b'{"id": 1}', 200, {}),
+		]
+		body, status_code = self.client.request('POST', '/surveys/')
+		self.assertEqual(body, {'id': 1})
+		self.assertEqual(self.request.call_count, 2)
+		self.assertEqual(self.client.rate_stats()['retries'], 1)
+		self.assertEqual(self.limiter.stats()['in_flight'], 0)
+
+	def test_server_errors_are_not_retried_for_posts(self):
+		self.request.return_value = (b'', 503, {})
+		with self.assertRaises(exceptions.APIError) as raised:
+			self.client.request('POST', '/surveys/')
+		self.assertEqual(raised.exception.http_status, 503)
+		self.assertEqual(self.request.call_count, 1)
+
+	def test_gives_up_after_max_retries(self):
+		self.request.return_value = (b'', 502, {})
+		with self.assertRaises(exceptions.APIError):
+			self.client.request('GET', '/surveys/')
+		self.assertEqual(self.request.call_count, 3)
+
+	def test_connection_errors_are_retried_for_gets(self):
+		self.request.side_effect = [
+			exceptions.APIConnectionError('reset'),
+			(b'[]', 200, {}),
+		]
+		body, status_code = self.client.request('GET', '/surveys/')
+		self.assertEqual(body, [])
+
+	@patch('fluidsurveys.http_client.time.sleep')
+	def test_waits_as_long_as_the_server_asks(self, sleep):
+		self.request.side_effect = [
+			(b'', 503, {'retry-after': '2'}),
+			(b'[]', 200, {}),
+		]
+		self.client.rate_limiter = None
+		self.client.request('GET', '/surveys/')
+		sleep.assert_called_once_with(2.0)
@@ -0,0 +1,115 @@
+import threading
+import time
+import unittest
+
+from mock import Mock
+
+from fluidsurveys import deadline, exceptions, http_client
+from fluidsurveys.metrics import Instrumentation
+from fluidsurveys.singleflight import SingleFlight
+
+
+def _run_threads(count, target):
+	results = [None] * count
+
+	def run(index):
+		try:
+			results[index] = target()
+		except Exception as e:
+			results[index] = e
+	threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	return results
+
+
+class TestSingleFlight(unittest.TestCase):
+
+	def setUp(self):
+		self.flight = SingleFlight()
+		self.calls = 0
+		self.release = threading.Event()
+
+	def slow(self, result=None, error=None):
+		def call():
+			self.calls += 1
+			self.release.wait(5)
+			if error is not None:
+				raise error
+			return result
+		return call
+
+	def test_concurrent_calls_share_one(self):
+		timer = threading.Timer(0.05, self.release.set)
+		timer.start()
+		results = _run_threads(6, lambda: self.flight.do('a', self.slow(42)))
+		self.assertEqual(self.calls, 1)
+		self.assertEqual(sorted(results), [(42, False)] + [(42, True)] * 5)
+		self.assertEqual(self.flight.stats(), {'in_flight': 0, 'waiting': 0,
+			'shared': 5})
+		self.flight.do('a', self.slow(1))
+		self.assertEqual(self.calls, 2)
+
+	def test_errors_are_shared(self):
+		error = ValueError('down')
+		threading.Timer(0.05, self.release.set).start()
+		results = _run_threads(4, lambda: self.flight.do('a',
+			self.slow(error=error)))
+		self.assertEqual(self.calls, 1)
+		self.assertEqual(results, [error] * 4)
+
+	def test_waiters_time_out(self):
+		self.flight.timeout = 0.01
+		leader = threading.Thread(target=self.flight.do, args=('a', self.slow()))
+		leader.start()
+		time.sleep(0.01)
+		self.assertEqual(self.flight.do('a', lambda: 'own'), ('own', False))
+		self.release.set()
+		leader.join()
+
+	def test_waiters_keep_their_own_deadline(self):
+		leader = threading.Thread(target=self.flight.do, args=('a', self.slow()))
+		leader.start()
+		time.sleep(0.01)
+		started = time.time()
+		with deadline.within(0.05):
+			self.assertRaises(exceptions.DeadlineExceeded, self.flight.do, 'a',
+				lambda: 'own')
+		self.assertTrue(time.time() - started < 0.2)
+		self.release.set()
+		leader.join()
+
+		leader = threading.Thread(target=self.assertRaises, args=(
+			exceptions.DeadlineExceeded, self.flight.do, 'b',
+			self.slow(error=exceptions.DeadlineExceeded('late'))))
+		leader.start()
+		time.sleep(0.01)
+		threading.Timer(0.05, self.release.set).start()
+		results = _run_threads(3, lambda: self.flight.do('b', lambda: 'own'))
+		leader.join()
+		self.assertEqual([result for result, shared in results], ['own'] * 3)
+
+
+class TestCoalescingClient(unittest.TestCase):
+
+	def test_identical_gets_share_a_request(self):
+		instrumentation = Instrumentation()
+		client = http_client.Client(instrumentation=instrumentation)
+		client.httpclient = Mock()
+		client.httpclient.pop_timings.return_value = {}
+		client.httpclient.pop_wire_bytes.return_value = None
+
+		def request(method, url, headers, body):
+			time.sleep(0.05)
+			return b'{"id": 1}', 200, {}
+		client.httpclient.request.side_effect = request
+		results = _run_threads(5, lambda: client.request('GET', '/surveys/1'))
+		self.assertEqual(results, [({'id': 1}, 200)] * 5)
+		self.assertEqual(client.httpclient.request.call_count, 1)
+		metrics = instrumentation.snapshot()['surveys/{id}']['GET']
+		self.assertEqual(metrics['coalesced'], 4)
+
+		_run_threads(3, lambda: client.request('PUT', '/surveys/1', '{}'))
+		self.assertEqual(client.httpclient.request.call_count, 4)
@@ -0,0 +1,108 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import Mock
+
+from fluidsurveys import exceptions
+from fluidsurveys.compat import urlsplit
+from fluidsurveys.jsonstream import ResultsStream
+from fluidsurveys.resources import Response
+from fluidsurveys.sync import ResponseSync
+
+
+class FakeAPI(object):
+	""" Paginated response listing honouring a `since` parameter. """
+
+	def __init__(self, records, page_size=2):
+		self.records = records
+		self.page_size = page_size
+		self.urls = []
+		self.fail_on = None
+		self.errors = {}
+
+	def stream(self, method, url, body=None):
+		self.urls.append(url)
+		if self.fail_on == len(self.urls):
+			raise IOError('connection lost')
+		if len(self.urls) in self.errors:
+			return (ResultsStream([b'{"detail": "denied"}']),
+				self.errors[len(self.urls)])
+		query = dict(kv.split('=') for kv in urlsplit(url).query.split('&') if kv)
+		since = query.get('since')
+		page = int(query.get('page', 0))
+		matching = [r for r in self.records
+			if since is None or r['_updated_at'] >= since.replace('%3A', ':')]
+		chunk = matching[page * self.page_size:(page + 1) * self.page_size]
+		next_url = None
+		if (page + 1) * self.page_size < len(matching):
+			next_url = '/surveys/1/responses?page=%d' % (page + 1)
+			if since:
+				next_url += '&since=' + since
+		body = json.dumps({'next': next_url, 'results': chunk})
+		return ResultsStream([body.encode('utf-8')]), 200
+
+
+class TestResponseSync(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.path = os.path.join(self.tmp, 'responses.db')
+		self.api = FakeAPI([{'id': i, '_updated_at': '2014-03-0%dT00:00' % i}
+			for i in range(1, 6)])
+		self.client = Mock()
+		self.client.stream.side_effect = self.api.stream
+		self.store = ResponseSync(self.path, client=self.client)
+
+	def tearDown(self):
+		self.store.close()
+		shutil.rmtree(self.tmp)
+
+	def test_repeated_sync_only_fetches_changes(self):
+		stats = self.store.sync(1)
+		self.assertEqual((stats['requests'], stats['records']), (3, 5))
+		self.assertEqual(self.store.high_water(1), '2014-03-05T00:00')
+
+		stats = self.store.sync(1)
+		self.assertEqual((stats['requests'], stats['records']), (1, 1))
+
+		self.api.records[1]['_updated_at'] = '2014-03-09T00:00'
+		self.api.records[1]['answer'] = 'changed'
+		stats = self.store.sync(1)
+		self.assertEqual(stats['records'], 2)
+		stored = dict((r['id'], r) for r in self.store.responses(1))
+		self.assertEqual(len(stored), 5)
+		self.assertEqual(stored[2]['answer'], 'changed')
+		self.assertEqual(self.store.high_water(1), '2014-03-09T00:00')
+
+	def test_error_replies_fail_the_sync(self):
+		self.api.errors = {1: 403, 3: 404}
+		self.assertRaises(exceptions.APIError, self.store.sync, 1)
+		self.assertEqual(self.store.high_water(1), None)
+		self.assertRaises(exceptions.APIError, self.store.sync, 1)
+		self.assertEqual(self.store.high_water(1), None)
+		self.assertEqual(len(list(self.store.responses(1))), 2)
+		stats = self.store.sync(1)
+		self.assertTrue(stats['resumed'])
+		self.assertEqual(self.store.high_water(1), '2014-03-05T00:00')
+
+	def test_resumes_after_a_crash(self):
+		self.api.fail_on = 2
+		self.assertRaises(IOError, self.store.sync, 1)
+		self.assertEqual(self.store.high_water(1), None)
+		self.assertEqual(len(list(self.store.responses(1))), 2)
+
+		self.store.close()
+		self.store = ResponseSync(self.path, client=self.client)
+		stats = self.store.sync(1)
+		self.assertTrue(stats['resumed'])
+		self.assertEqual(stats['requests'], 2)
+		self.assertEqual(self.api.urls[-2], '/surveys/1/responses?page=1')
+		self.assertEqual(len(list(self.store.responses(1))), 5)
+		self.assertEqual(self.store.high_water(1), '2014-03-05T00:00')
+
+	def test_manager_sync_to(self):
+		manager = Response.get_manager(client=self.client, survey=1)
+		self.assertEqual(manager.sync_to(self.path)['records'], 5)
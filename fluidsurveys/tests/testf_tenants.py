@@ -0,0 +1,71 @@
+import json
+import threading
+import unittest
+
+from mock import Mock
+
+import fluidsurveys
+from fluidsurveys import base
+from fluidsurveys.resources import Survey
+from fluidsurveys.tenants import ClientRegistry
+
+
+class TestClientRegistry(unittest.TestCase):
+
+	def setUp(self):
+		self.transport = Mock()
+		self.transport.request.side_effect = lambda method, url, headers, body: (
+			json.dumps({'id': 1, 'url': url,
+				'auth': headers['AUTHORIZATION']}).encode('utf-8'), 200, {})
+		self.tenants = ClientRegistry(max_clients=2, concurrency=2,
+			transport=self.transport)
+
+	def tearDown(self):
+		self.tenants.close()
+
+	def test_clients_carry_their_tenants_credentials(self):
+		global_info = dict(fluidsurveys.AccessInfo)
+		seen = {}
+
+		def fetch(tenant):
+			client = self.tenants.client(tenant, username=tenant,
+				api_key='key-' + tenant,
+				api_base='https://%s.example.com/api/v3/' % tenant)
+			for _ in range(20):
+				survey = Survey.get_manager(client=client).get(1)
+				seen.setdefault(tenant, set()).add((survey.url, survey.auth))
+		threads = [threading.Thread(target=fetch, args=(tenant,))
+			for tenant in ('acme', 'globex')]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+
+		self.assertEqual(seen, {
+			'acme': set([('https://acme.example.com/api/v3/surveys/1/',
+				'apikey acme@key-acme')]),
+			'globex': set([('https://globex.example.com/api/v3/surveys/1/',
+				'apikey globex@key-globex')]),
+		})
+		self.assertEqual(dict(fluidsurveys.AccessInfo), global_info)
+		client = self.tenants.client('acme')
+		self.assertIs(client.httpclient, self.transport)
+		self.assertEqual(client.rate_limiter.max_concurrency, 2)
+
+	def test_rebuilds_and_evicts(self):
+		acme = self.tenants.client('acme', username='acme', api_key='old')
+		self.assertIs(self.tenants.client('acme'), acme)
+		self.assertEqual(acme.build_url('/surveys'),
+			fluidsurveys.AccessInfo['api_base'].rstrip('/') + '/surveys/')
+		Survey.get_manager(client=acme)
+
+		rotated = self.tenants.client('acme', username='acme', api_key='new')
+		self.assertIsNot(rotated, acme)
+		self.assertFalse([k for k in base._managers if k[1] is acme])
+		self.tenants.client('globex', username='globex', api_key='k')
+		self.tenants.client('initech', username='initech', api_key='k')
+		self.assertNotIn('acme', self.tenants)
+		self.assertEqual(self.tenants.stats(),
+			{'clients': 2, 'created': 4, 'evicted': 1})
+		self.assertRaises(KeyError, self.tenants.client, 'acme')
+		self.assertFalse(self.transport.close.called)
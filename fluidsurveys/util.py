@@ -0,0 +1,27 @@
+"""
+Small helpers shared by the HTTP backends.
+"""
+import sys
+
+try:
+    import json
+except ImportError:
+    json = None
+
+if not (json and hasattr(json, 'loads')):
+    import simplejson as json
+
+try:
+    import cStringIO as StringIO
+except ImportError:
+    try:
+        import StringIO
+    except ImportError:
+        import io as StringIO
+
+
+def utf8(value):
+    """ Encode unicode strings to utf-8 bytes, leave everything else alone. """
+    if sys.version_info < (3, 0) and isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value